@@ -15,6 +15,7 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import importlib
+import functools
 import zipfile
 import asyncio
 import yaml
@@ -54,8 +55,10 @@ class PyMineAPI:
 
     async def call_async(
         self, func, *args, **kwargs
-    ):  # used to run a blocking function in a process pool
-        await asyncio.get_event_loop().run_in_executor(self.executor, func, *args, **kwargs)
+    ):  # used to run a blocking function in a process pool, func and its args must be picklable
+        return await asyncio.get_event_loop().run_in_executor(
+            self.server.process_executor, functools.partial(func, *args, **kwargs)
+        )
 
     def eid(self):  # used to generate entity ids
         self.eid_current += 1
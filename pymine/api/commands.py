@@ -58,6 +58,9 @@ class CommandHandler:
                 )
 
             self._commands[name] = func, node
+            # the command tree sent to clients changed
+            self.server.invalidate_packet_cache("commands")
+
             return func
 
         return deco
@@ -23,6 +23,12 @@ class InvalidPacketID(BaseException):
     pass
 
 
+class InvalidPacketData(BaseException):
+    def __init__(self, msg: str) -> None:
+        self.msg = msg
+        super().__init__(self.msg)
+
+
 class ServerBindingError(BaseException):
     def __init__(self, server_name: str, addr: str, port: int):
         self.msg = f"Failed to bind {server_name} to {addr}:{port}, is that address already in use?"
@@ -25,13 +25,65 @@ with open(
 ) as dim_codec_file:
     DEFAULT_DIM_CODEC_NBT = nbt.unpack(Buffer(dim_codec_file.read()), root_is_full=False)
 
+DIM_CODECS = {}  # {file: (codec, packed codec)}, see load_dim_codec
+
 
 def new_dim_codec_nbt() -> nbt.TAG_Compound:
     return copy.deepcopy(DEFAULT_DIM_CODEC_NBT)
 
 
-def get_dimension_data(dimension: str) -> nbt.TAG_Compound:
-    dims = DEFAULT_DIM_CODEC_NBT["minecraft:dimension_type"]["value"]
+def unpack_dim_codec(data: bytes, file: str) -> nbt.TAG_Compound:
+    """Unpacks a dimension codec from an .nbt file's data, with or without a root tag header.
+
+    Files written by the game have a header (the root tag's type ID and name), but some (like the
+    default one) are just the root's contents. Parsing one the wrong way usually still succeeds,
+    but stops early, so the way which consumes all of the data is the right one.
+    """
+
+    for root_is_full in (True, False):
+        buf = Buffer(data)
+
+        try:
+            codec = nbt.unpack(buf, root_is_full)
+        except Exception:
+            continue
+
+        if buf.pos == len(buf.buf):
+            return codec
+
+    raise ValueError(f"{file} isn't a valid dimension codec, it doesn't parse as NBT completely.")
+
+
+def load_dim_codec(file: str = None) -> tuple:
+    """Loads a dimension codec from an .snbt or .nbt file, or the default one if file is None.
+
+    Codecs are cached along with their packed form, which is sent as is to every joining player,
+    so the codec shouldn't be modified. Returns (codec, packed codec).
+    """
+
+    try:
+        return DIM_CODECS[file]
+    except KeyError:
+        pass
+
+    if file is None:
+        codec = DEFAULT_DIM_CODEC_NBT
+    elif file.endswith(".snbt"):
+        with open(file, "r", encoding="utf8") as dim_codec_file:
+            codec = nbt.from_snbt(dim_codec_file.read())
+    else:
+        with open(file, "rb") as dim_codec_file:
+            codec = unpack_dim_codec(dim_codec_file.read(), file)
+
+    DIM_CODECS[file] = codec, codec.pack()
+    return DIM_CODECS[file]
+
+
+def get_dimension_data(dimension: str, codec: nbt.TAG_Compound = None) -> nbt.TAG_Compound:
+    if codec is None:
+        codec = DEFAULT_DIM_CODEC_NBT
+
+    dims = codec["minecraft:dimension_type"]["value"]
 
     for dim in dims:
         if dim["name"].data.endswith(
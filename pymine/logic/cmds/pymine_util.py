@@ -37,6 +37,22 @@ async def test(
     print(uuid, b, f, d, i, s, s2, s3)
 
 
+@server.api.commands.on_command(name="chunkcache", node="pymine.cmds.chunkcache")
+async def chunk_cache(uuid):
+    """Shows chunk cache metrics for each world."""
+
+    for name, world in server.worlds.items():
+        stats = world.chunk_cache.stats()
+        lookups = stats["hits"] + stats["misses"]
+
+        server.console.info(
+            f"{name}: {stats['chunks']} chunks ({stats['pinned']} pinned by {stats['tickets']} "
+            f"tickets), {stats['resident_bytes'] / 1048576:.1f} MiB, {stats['hits']} hits, "
+            f"{stats['misses']} misses ({stats['hits'] / max(lookups, 1):.0%} hit rate), "
+            f"{stats['evictions']} evictions"
+        )
+
+
 @server.api.commands.on_command(name="testworldgen", node="pymine.cmds.testworldgen")
 async def test_world_gen(uuid):
     chunk = await server.worlds["minecraft:overworld"].fetch_chunk(0, 0)
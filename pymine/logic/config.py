@@ -37,6 +37,11 @@ DEFAULT_CONFIG = {
     "spawn_protection": 16,
     "pvp": True,
     "comp_thresh": 256,
+    "comp_level": 6,
+    "comp_offload_size": 16384,  # packets at least this big are compressed in the thread pool
+    "autosave_interval": 300,  # seconds between saving every changed chunk
+    "chunk_cache_max": 1024,  # per world, chunks in view of players are kept loaded past this
+    "chunk_cache_max_mb": 256,  # per world, same as above
     "spawn_npcs": True,
     "spawn_animals": True,
     "spawn_monsters": True,
@@ -46,6 +51,8 @@ DEFAULT_CONFIG = {
     "prompt": "> ",
     "generator": "default",
     "vi_mode": False,
+    "connection_engine": "streams",  # either streams or protocol, protocol is faster but newer
+    "dimension_codec": None,  # an .snbt / .nbt file with custom dimensions and biomes
 }
 
 
@@ -49,6 +49,9 @@ async def login_start(stream: Stream, packet: Packet) -> None:
     else:  # No need for encryption since online mode is off, just send login success
         if server.comp_thresh > 0:  # Send set compression packet if needed
             await server.send_packet(stream, LoginSetCompression(server.comp_thresh), -1)
+            await stream.flush()
+
+            server.cache.comp_thresh[stream.remote] = server.comp_thresh
 
         # This should be only generated if the player name isn't found in the world data, but no way to do that rn
         uuid_ = uuid.uuid4()
@@ -81,6 +84,9 @@ async def encrypted_login(stream: Stream, packet: Packet) -> Stream:
 
     if server.comp_thresh > 0:  # Send set compression packet if needed
         await server.send_packet(stream, LoginSetCompression(server.comp_thresh), -1)
+        await stream.flush()
+
+        server.cache.comp_thresh[stream.remote] = server.comp_thresh
 
     # Send LoginSuccess packet, tells client they've logged in succesfully
     await server.send_packet(stream, login_packets.LoginSuccess(*auth))
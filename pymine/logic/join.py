@@ -14,12 +14,11 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import asyncio
 import random
 import uuid
 import time
 
-from pymine.data.default_nbt.dimension_codec import get_dimension_data, new_dim_codec_nbt
+from pymine.data.default_nbt.dimension_codec import get_dimension_data, load_dim_codec
 from pymine.types.bitfield import BitField
 from pymine.data.recipes import RECIPES
 from pymine.util.misc import seed_hash
@@ -49,12 +48,13 @@ async def join(stream: Stream, uuid_: uuid.UUID, username: str, props: list) ->
 
     await send_join_game_packet(stream, world, player)
 
-    # send server brand via plugin channels
-    await server.send_packet(
+    # send server brand via plugin channels, it never changes so it's cached for good
+    await server.send_cached_packet(
         stream,
-        packets.play.plugin_msg.PlayPluginMessageClientBound(
-            "minecraft:brand", Buffer.pack_string(server.meta.pymine)
-        ),
+        "brand",
+        packets.play.plugin_msg.PlayPluginMessageClientBound,
+        "minecraft:brand",
+        Buffer.pack_string(server.meta.pymine),
     )
 
     # sends info about the server difficulty
@@ -82,7 +82,8 @@ async def join_2(stream: Stream, player: Player) -> None:
     # await server.send_packet(stream, packets.play.crafting.PlayDeclareRecipes(RECIPES))
 
     # send tags (data about the different blocks and items)
-    await server.send_packet(stream, packets.play.tags.PlayTags(TAGS))
+    # tags are immutable (see pymine/data/tags.py), so the cached packet is never invalidated
+    await server.send_cached_packet(stream, "tags", packets.play.tags.PlayTags, TAGS)
 
     # send entity status packet, apparently this is required, for now it'll just set player to op lvl 4 (value 28)
     await server.send_packet(stream, packets.play.entity.PlayEntityStatus(player.entity_id, 28))
@@ -112,6 +113,7 @@ async def join_2(stream: Stream, player: Player) -> None:
 # crucial info pertaining to the world and player status
 async def send_join_game_packet(stream: Stream, world: World, player: Player) -> None:
     level_name = server.conf["level_name"]  # level name, i.e. Xenon
+    dim_codec, packed_dim_codec = load_dim_codec(server.conf["dimension_codec"])
 
     await server.send_packet(
         stream,
@@ -121,10 +123,10 @@ async def send_join_game_packet(stream: Stream, world: World, player: Player) ->
             player["playerGameType"].data,  # gamemode
             player["previousPlayerGameType"].data,  # previous gamemode
             [level_name, f"{level_name}_nether", f"{level_name}_the_end"],  # world names
-            new_dim_codec_nbt(),  # Shouldn't change unless CUSTOM DIMENSIONS are added fml
+            packed_dim_codec,  # packed once, custom dimensions come from the dimension_codec file
             # This is like the the dimension data for the dim the player is currently spawning into
             get_dimension_data(
-                player["Dimension"].data
+                player["Dimension"].data, dim_codec
             ),  # player['Dimension'] should be like minecraft:overworld
             server.conf["level_name"],  # level name of the world the player is spawning into
             seed_hash(server.conf["seed"]),
@@ -169,8 +171,11 @@ async def send_command_nodes(stream: Stream) -> None:
     flags.set(0x08, False)
     flags.set(0x10, False)
 
-    await server.send_packet(
-        stream, packets.play.command.PlayDeclareCommands([{"flags": flags.field, "children": []}])
+    await server.send_cached_packet(
+        stream,
+        "commands",
+        packets.play.command.PlayDeclareCommands,
+        [{"flags": flags.field, "children": []}],
     )
 
 
@@ -244,28 +249,20 @@ async def send_update_view_distance(stream: Stream, player: Player) -> None:
 # sends information about the world to the client, like chunk data and other stuff
 async def send_world_info(stream: Stream, world: World, player: Player) -> None:
     view_distance = server.conf["view_distance"] + 1
-    chunks = (
-        {}
-    )  # cache chunks here because they're used multiple times and shouldn't be garbage collected
-
-    for x in range(-view_distance, view_distance):
-        for z in range(-view_distance, view_distance):
-            chunks[x, z] = await world.fetch_chunk(x, z)
-
-    # for chunk in chunks.values():  # send update light packet for each chunk in the player's view distance
-    #     await server.send_packet(stream, packets.play.chunk.PlayUpdateLight(chunk))
-
-    loop = asyncio.get_event_loop()
-
-    for (
-        chunk
-    ) in chunks.values():  # send chunk data packet for every chunk in server render distance
-        packet = await loop.run_in_executor(
-            server.thread_executor, packets.play.chunk.PlayChunkData, chunk, True
+    chunk_coords = [
+        (x, z)
+        for x in range(-view_distance, view_distance)
+        for z in range(-view_distance, view_distance)
+    ]
+
+    world.set_ticket(int(player.uuid), chunk_coords)  # keep the chunks loaded while in view
+
+    # send chunk data packet for every chunk in server render distance, as soon as each is loaded
+    async for chunk in world.fetch_chunks(chunk_coords):
+        # chunks are only encoded again once they've changed, so chunks near spawn are encoded once
+        await server.send_cached_packet(
+            stream, "data", packets.play.chunk.PlayChunkData, chunk, True, cache=chunk.encoded
         )
-        asyncio.create_task(server.send_packet(stream, packet))
-
-    del chunks  # no longer needed so free the memoryyyy
 
     # send the world border data to the client
     await server.send_packet(
@@ -14,9 +14,16 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+from __future__ import annotations
+
+from collections import OrderedDict
 import aiofile
+import asyncio
 import struct
+import pickle
 import numpy
+import time
+import gzip
 import zlib
 import os
 
@@ -29,7 +36,9 @@ import pymine.types.nbt as nbt
 
 
 # Setup world dict and load basic level data for each world
-async def load_worlds(server, level_name: str, chunk_cache_max_per: int) -> dict:
+async def load_worlds(
+    server, level_name: str, chunk_cache_max_per: int, chunk_cache_max_bytes_per: int
+) -> dict:
     worlds = {}
 
     server.console.info(f"Loading default worlds for level {level_name}...")
@@ -41,7 +50,11 @@ async def load_worlds(server, level_name: str, chunk_cache_max_per: int) -> dict
     for ext, proper_name in zip(("", "_nether", "_the_end"), ("overworld", "nether", "the_end")):
         name = level_name + ext
         worlds[f"minecraft:{proper_name}"] = await World(
-            server, name, os.path.join("worlds", name), chunk_cache_max_per
+            server,
+            name,
+            os.path.join("worlds", name),
+            chunk_cache_max_per,
+            chunk_cache_max_bytes_per,
         ).init()
 
     server.console.info(f'Loaded default worlds: {", ".join([w.name for w in worlds.values()])}.')
@@ -49,7 +62,309 @@ async def load_worlds(server, level_name: str, chunk_cache_max_per: int) -> dict
     return worlds
 
 
+class RegionFile:
+    """An open region (.mca) file, its 8 KiB header of chunk locations and timestamps is cached.
+
+    Chunks are read with positional reads, so concurrent reads don't share a file position.
+    Chunks are never overwritten in place, they're written to free sectors and then the header is
+    updated to point at them, so the region file is valid even if the server stops mid write.
+
+    :param str path: The path to the region file.
+    :param AIOFile file: The opened region file.
+    :param bytes header: The first 8 KiB of the region file.
+    :param int size: The size of the region file in bytes.
+    :ivar numpy.ndarray locations: The location of each chunk, (sector offset << 8) | sector count.
+    :ivar numpy.ndarray timestamps: The time each chunk was last saved at.
+    :ivar int readers: The amount of reads in progress, the file isn't closed while it's in use.
+    """
+
+    def __init__(self, path: str, file: aiofile.AIOFile, header: bytes, size: int = 0) -> None:
+        self.path = path
+        self.file = file
+
+        self.locations = numpy.frombuffer(header, ">u4", 1024).astype(numpy.uint32)
+        self.timestamps = numpy.frombuffer(header, ">u4", 1024, 4096).astype(numpy.uint32)
+
+        self.readers = 0
+
+        self._size = size
+        self._used = None  # which sectors are in use, made on the first write
+        self._freed = []  # (start, count) of sectors which may still be being read from
+        self._writing = asyncio.Lock()
+
+    @classmethod
+    async def open(cls, path: str, create: bool = False) -> RegionFile:
+        """Opens a region file for reading and writing, if create is set it's made if missing."""
+
+        if create and not os.path.isfile(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            file = aiofile.AIOFile(path, "w+b")
+            await file.open()
+            await file.write(bytes(8192), 0)
+
+            return cls(path, file, bytes(8192), 8192)
+
+        file = aiofile.AIOFile(path, "r+b")
+        await file.open()
+
+        header = await file.read(8192, 0)
+
+        if len(header) < 8192:  # an empty or truncated region file has no chunks
+            header = header.ljust(8192, b"\x00")
+
+        return cls(path, file, header, os.fstat(file.fileno()).st_size)
+
+    @property
+    def in_use(self) -> bool:
+        return self.readers > 0 or self._writing.locked()
+
+    @staticmethod
+    def index(chunk_x: int, chunk_z: int) -> int:
+        return (chunk_x & 31) + (chunk_z & 31) * 32
+
+    def find_chunk(self, chunk_x: int, chunk_z: int) -> tuple:
+        """Returns the chunk's offset and size in bytes, raises FileNotFoundError if unsaved."""
+
+        offset, size = ChunkIO.find_chunk(int(self.locations[self.index(chunk_x, chunk_z)]))
+
+        if offset == 0 or size == 0:  # the chunk hasn't been generated / saved yet
+            raise FileNotFoundError(f"{self.path} (chunk {chunk_x}, {chunk_z})")
+
+        return offset, size
+
+    def timestamp(self, chunk_x: int, chunk_z: int) -> int:
+        return int(self.timestamps[self.index(chunk_x, chunk_z)])
+
+    async def read(self, offset: int, size: int) -> bytes:
+        """Reads size bytes at offset, without changing any file position."""
+
+        self.readers += 1
+
+        try:
+            return await self.file.read(size, offset)
+        finally:
+            self.readers -= 1
+
+    async def read_chunk(self, chunk_x: int, chunk_z: int) -> tuple:
+        """Reads a chunk's sectors from the region file, returns the still compressed data and its
+        timestamp, see decode_chunk."""
+
+        data = await self.read(*self.find_chunk(chunk_x, chunk_z))
+
+        return data, self.timestamp(chunk_x, chunk_z)
+
+    def _used_sectors(self) -> numpy.ndarray:
+        if self._used is None:
+            used = numpy.zeros(max(2, -(-self._size // 4096)), bool)
+            used[:2] = True  # the header
+
+            for location in self.locations[self.locations != 0]:
+                offset, size = ChunkIO.find_chunk(int(location))
+                used[offset // 4096 : (offset + size) // 4096] = True
+
+            self._used = used
+
+        return self._used
+
+    def _allocate(self, count: int) -> int:
+        """Finds the first run of count free sectors and marks them as used, returns its start."""
+
+        used = self._used_sectors()
+
+        # find the runs of free sectors, the file can grow so there's always a free run at its end
+        edges = numpy.diff(numpy.concatenate(([False], ~used, [True, False])).astype(numpy.int8))
+        starts = numpy.flatnonzero(edges == 1)
+        lengths = numpy.flatnonzero(edges == -1) - starts
+        lengths[-1] = count
+
+        start = int(starts[numpy.argmax(lengths >= count)])
+
+        if start + count > len(used):
+            self._used = used = numpy.concatenate(
+                (used, numpy.zeros(start + count - len(used), bool))
+            )
+
+        used[start : start + count] = True
+
+        return start
+
+    async def write_chunks(self, chunks: list) -> None:
+        """Writes chunks to the region file, then updates its header to point at them.
+
+        :param list chunks: (chunk x, chunk z, data, timestamp), data is from encode_chunk.
+        """
+
+        async with self._writing:
+            if self.readers == 0:  # nothing can be reading from sectors freed by past writes now
+                for start, count in self._freed:
+                    self._used_sectors()[start : start + count] = False
+
+                self._freed.clear()
+
+            locations = self.locations.copy()
+            timestamps = self.timestamps.copy()
+            freed = []
+
+            for chunk_x, chunk_z, data, timestamp in chunks:
+                count = -(-len(data) // 4096)
+
+                if count > 255:  # vanilla stores chunks like this in separate .mcc files
+                    raise ValueError(f"Chunk {chunk_x}, {chunk_z} is too big for {self.path}")
+
+                index = self.index(chunk_x, chunk_z)
+
+                if locations[index] != 0:
+                    offset, size = ChunkIO.find_chunk(int(locations[index]))
+                    freed.append((offset // 4096, size // 4096))
+
+                start = self._allocate(count)
+                await self.file.write(data.ljust(count * 4096, b"\x00"), start * 4096)
+
+                locations[index] = (start << 8) | count
+                timestamps[index] = timestamp
+
+            await self.file.fsync()  # the chunks have to be on the disk before the header is
+
+            await self.file.write(
+                locations.astype(">u4").tobytes() + timestamps.astype(">u4").tobytes(), 0
+            )
+            await self.file.fsync()
+
+            self.locations = locations
+            self.timestamps = timestamps
+            self._freed.extend(freed)
+
+    async def close(self) -> None:
+        await self.file.close()
+
+
+class RegionFilePool:
+    """Keeps the most recently used region files open, so they're only opened and parsed once.
+
+    :param int max_open: The max amount of region files which are kept open at once.
+    :ivar OrderedDict files: The open region files, ordered from least to most recently used.
+    """
+
+    def __init__(self, max_open: int = 64) -> None:
+        self.max_open = max_open
+
+        self.files = OrderedDict()
+        self._opening = {}  # {path: task}, so a region file isn't opened twice at once
+
+    async def get(self, path: str, create: bool = False) -> RegionFile:
+        """Returns the open region file for path, returns None if the region file doesn't exist
+        (unless create is set, then it's created)."""
+
+        region = self.files.get(path)
+
+        if region is not None:
+            self.files.move_to_end(path)
+            return region
+
+        if path not in self._opening:
+            if not create and not os.path.isfile(path):
+                return None
+
+            self._opening[path] = asyncio.ensure_future(RegionFile.open(path, create))
+
+        opening = self._opening[path]
+
+        try:
+            region = await asyncio.shield(opening)
+        finally:
+            first = self._opening.get(path) is opening
+
+            if first:
+                del self._opening[path]
+
+        if not first:  # another get added it to the pool already, it could've been evicted since
+            return await self.get(path, create)
+
+        self.files[path] = region
+
+        # counted as a reader so evicting other files (by this get or another) can't close it
+        region.readers += 1
+
+        try:
+            await self.evict()
+        finally:
+            region.readers -= 1
+
+        return region
+
+    async def evict(self) -> None:
+        """Closes the least recently used region files until there are at most max_open open.
+
+        Files which are being read from or written to are skipped.
+        """
+
+        for path in list(self.files):
+            if len(self.files) <= self.max_open:
+                break
+
+            region = self.files.get(path)  # could've been evicted by another get already
+
+            if region is not None and not region.in_use:
+                del self.files[path]
+                await region.close()
+
+    async def close(self) -> None:
+        """Closes all of the open region files."""
+
+        files = list(self.files.values())
+        self.files.clear()
+
+        for region in files:
+            await region.close()
+
+
+def decompress_chunk(data: bytes) -> bytes:
+    """Decompresses the chunk data stored in a region file's sectors."""
+
+    # each chunk starts with its exact length, the rest of the last sector is padding
+    length = struct.unpack_from(">I", data)[0]
+    compression = data[4]
+    data = data[5 : 4 + length]
+
+    if compression == 2:
+        return zlib.decompress(data)
+
+    if compression == 1:
+        return gzip.decompress(data)
+
+    if compression == 3:
+        return data
+
+    raise ValueError(f"Unsupported chunk compression type: {compression}")
+
+
+def decode_chunk(data: bytes, timestamp: int) -> Chunk:
+    """Decompresses and parses a chunk read from a region file's sectors.
+
+    This is the expensive part of loading a chunk, so it's meant to be ran in a process pool.
+    The sections of the returned Chunk are compact numpy arrays, so it's cheap to send back, and the
+    rest of the chunk's data (like entities) is parsed lazily, so it's sent back as packed NBT.
+    """
+
+    return Chunk(nbt.unpack(Buffer(decompress_chunk(data)), lazy=True), timestamp)
+
+
+def encode_chunk(chunk: bytes) -> bytes:
+    """Serializes and compresses a chunk for a region file's sectors, the reverse of decode_chunk.
+
+    The chunk is passed already pickled, so it's a snapshot of the chunk from when it was queued,
+    a process pool would otherwise pickle it later on in a thread while it could be modified.
+    """
+
+    data = nbt.pack(pickle.loads(chunk).to_nbt(), "zlib")
+
+    return struct.pack(">IB", len(data) + 1, 2) + data
+
+
 class ChunkIO(AbstractChunkIO):
+    regions = RegionFilePool()  # region files are shared between all worlds
+
     @staticmethod
     def calc_offset(chunk_x: int, chunk_z: int) -> int:
         return 4 * ((chunk_x & 31) + (chunk_z & 31) * 32)
@@ -61,50 +376,157 @@ class ChunkIO(AbstractChunkIO):
 
         return offset * 4096, size * 4096
 
+    @staticmethod
+    def region_path(world_path: str, chunk_x: int, chunk_z: int) -> str:
+        return os.path.join(world_path, "region", f"r.{chunk_x // 32}.{chunk_z // 32}.mca")
+
     @classmethod
     def fetch_chunk(cls, world_path: str, chunk_x: int, chunk_z: int) -> Chunk:
-        rx, ry = chunk_x // 32, chunk_z // 32
-        region_path = os.path.join(world_path, "region", f"r.{rx}.{ry}.mca")
-
-        if not os.path.isfile(region_path):
-            raise FileNotFoundError(region_path)
-
+        region_path = cls.region_path(world_path, chunk_x, chunk_z)
         loc_table_loc = cls.calc_offset(chunk_x, chunk_z)
 
         with open(region_path, "rb") as region_file:
-            region_file.seek(loc_table_loc)
+            fd = region_file.fileno()
 
-            offset, length = cls.find_chunk(struct.unpack(">i", region_file.read(4))[0])
+            location, timestamp = struct.unpack(
+                ">II", os.pread(fd, 4, loc_table_loc) + os.pread(fd, 4, loc_table_loc + 4096)
+            )
+            offset, length = cls.find_chunk(location)
 
-            region_file.seek(loc_table_loc + 4096)
-            timestamp = struct.unpack(">i", region_file.read(4))
+            if offset == 0 or length == 0:  # the chunk hasn't been generated / saved yet
+                raise FileNotFoundError(f"{region_path} (chunk {chunk_x}, {chunk_z})")
 
-            region_file.seek(offset + 5)
-            tag = nbt.TAG_Compound.unpack(Buffer(zlib.decompress(region_file.read(length - 5))))
+            data = decompress_chunk(os.pread(fd, length, offset))
 
-        return Chunk(tag, timestamp)
+        return Chunk(nbt.unpack(Buffer(data), lazy=True), timestamp)
 
     @classmethod
-    async def fetch_chunk_async(cls, world_path: str, chunk_x: int, chunk_z: int) -> Chunk:
-        rx, ry = chunk_x // 32, chunk_z // 32
-        region_path = os.path.join(world_path, "region", f"r.{rx}.{ry}.mca")
+    async def fetch_chunk_async(
+        cls, world_path: str, chunk_x: int, chunk_z: int, executor=None
+    ) -> Chunk:
+        region_path = cls.region_path(world_path, chunk_x, chunk_z)
+        region = await cls.regions.get(region_path)
 
-        if not os.path.isfile(region_path):
+        if region is None:
             raise FileNotFoundError(region_path)
 
-        loc_table_loc = cls.calc_offset(chunk_x, chunk_z)
+        data, timestamp = await region.read_chunk(chunk_x, chunk_z)
+
+        return await asyncio.get_event_loop().run_in_executor(
+            executor, decode_chunk, data, timestamp
+        )
+
+    @classmethod
+    async def fetch_chunks_async(
+        cls, world_path: str, chunk_coords: list, executor=None, max_parallel: int = None
+    ):
+        """Fetches many chunks at once, yields (chunk coords, Chunk) in the order they're loaded in.
+
+        The coordinates are grouped by region file, and each region's chunks are read in the order
+        they're stored in. Chunks are decoded in the executor (ideally a process pool, see
+        decode_chunk), at most max_parallel (by default twice the cpu count) at a time.
+        Chunks which aren't saved yet are yielded as (chunk coords, None).
+        """
+
+        loop = asyncio.get_event_loop()
+        limit = asyncio.Semaphore(max_parallel or 2 * (os.cpu_count() or 1))
+        results = asyncio.Queue()
+
+        async def decode(key: tuple, data: bytes, timestamp: int) -> None:
+            async with limit:
+                try:
+                    results.put_nowait(
+                        (key, await loop.run_in_executor(executor, decode_chunk, data, timestamp))
+                    )
+                except BaseException as e:
+                    results.put_nowait((key, e))
+
+        async def read_region(region_path: str, keys: list) -> None:
+            try:
+                region = await cls.regions.get(region_path)
+
+                if region is None:
+                    for key in keys:
+                        results.put_nowait((key, None))
+
+                    return
+
+                located = []
 
-        async with aiofile.async_open(region_path, "rb") as region_file:
-            region_file.seek(loc_table_loc)
+                for key in keys:
+                    try:
+                        located.append((region.find_chunk(*key), key))
+                    except FileNotFoundError:
+                        results.put_nowait((key, None))
 
-            offset, length = cls.find_chunk(struct.unpack(">i", await region_file.read(4))[0])
+                region.readers += 1  # so the pool doesn't close it between reads
 
-            region_file.seek(loc_table_loc + 4096)
-            timestamp = struct.unpack(">i", await region_file.read(4))
+                try:
+                    for (offset, size), key in sorted(located):
+                        data = await region.read(offset, size)
+                        tasks.append(
+                            asyncio.ensure_future(decode(key, data, region.timestamp(*key)))
+                        )
+                finally:
+                    region.readers -= 1
+            except BaseException as e:
+                results.put_nowait((region_path, e))
 
-            region_file.seek(offset + 5)
-            tag = nbt.TAG_Compound.unpack(
-                Buffer(zlib.decompress(await region_file.read(length - 5)))
+        regions = {}
+
+        for key in chunk_coords:
+            regions.setdefault(cls.region_path(world_path, *key), []).append(key)
+
+        tasks = [asyncio.ensure_future(read_region(*region)) for region in regions.items()]
+
+        try:
+            for _ in range(len(chunk_coords)):
+                key, chunk = await results.get()
+
+                if isinstance(chunk, BaseException):
+                    raise chunk
+
+                yield key, chunk
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @classmethod
+    async def save_chunks_async(cls, world_path: str, chunks: list, executor=None) -> None:
+        """Saves chunks to their region files, they're encoded in the executor, see encode_chunk.
+
+        Each region file is written to once with all of its chunks. Afterwards, the chunks are
+        marked as saved, unless they were changed while being saved.
+        """
+
+        loop = asyncio.get_event_loop()
+        timestamp = int(time.time())
+
+        versions = [chunk.full_version for chunk in chunks]
+        encoding = [
+            loop.run_in_executor(
+                executor, encode_chunk, pickle.dumps(chunk, pickle.HIGHEST_PROTOCOL)
+            )
+            for chunk in chunks
+        ]
+
+        regions = {}
+
+        for chunk, data in zip(chunks, await asyncio.gather(*encoding)):
+            regions.setdefault(cls.region_path(world_path, chunk.x, chunk.z), []).append(
+                (chunk.x, chunk.z, data, timestamp)
             )
 
-        return Chunk(tag, timestamp)
+        async def write_region(region_path: str, region_chunks: list) -> None:
+            region = await cls.regions.get(region_path, create=True)
+            await region.write_chunks(region_chunks)
+
+        await asyncio.gather(*(write_region(*region) for region in regions.items()))
+
+        for chunk, version in zip(chunks, versions):
+            chunk.timestamp = timestamp
+            chunk.mark_saved(version)
+
+    @classmethod
+    async def close(cls) -> None:
+        await cls.regions.close()
@@ -66,44 +66,49 @@ class PlayChunkData(Packet):
         self.full = full
 
     def encode(self) -> bytes:
-        out = (
-            Buffer.pack("i", self.chunk.x)
-            + Buffer.pack("i", self.chunk.z)
-            + Buffer.pack("?", self.full)
-        )
+        return self.encode_into(Buffer()).buf
+
+    def encode_into(self, out: Buffer) -> Buffer:
+        out.write_struct("ii?", self.chunk.x, self.chunk.z, self.full)
 
         mask = 0
-        chunk_sections_buffer = Buffer()
+        sections = []
 
         for (
             y,
             section,
-        ) in self.chunk.sections.items():  # pack chunk columns into buffer and generate a bitmask
-            if y >= 0:
+        ) in self.chunk.sections.items():  # pack chunk columns and generate a bitmask
+            if y >= 0 and section.block_states is not None:
                 mask |= 1 << y
-                chunk_sections_buffer.write(Buffer.pack_chunk_section_blocks(section))
-
-        out += Buffer.pack_varint(mask) + Buffer.pack_nbt(
-            nbt.TAG_Compound(
-                "",
-                [
-                    self.chunk["Heightmaps"]["MOTION_BLOCKING"],
-                    self.chunk["Heightmaps"]["WORLD_SURFACE"],
-                ],
+                sections.append(Buffer.pack_chunk_section_blocks(section))  # cached per section
+
+        heightmaps = self.chunk.encoded.get("heightmaps")
+
+        if heightmaps is None:
+            heightmaps = self.chunk.encoded["heightmaps"] = Buffer.pack_nbt(
+                nbt.TAG_Compound(
+                    "",
+                    [
+                        self.chunk["Heightmaps"]["MOTION_BLOCKING"],
+                        self.chunk["Heightmaps"]["WORLD_SURFACE"],
+                    ],
+                )
             )
-        )
+
+        out.write_varint(mask).write(heightmaps)
 
         if self.full:
-            out += Buffer.pack_varint(len(self.chunk["Biomes"])) + b"".join(
-                [Buffer.pack_varint(n) for n in self.chunk["Biomes"]]
-            )
+            out.write_varint(len(self.chunk["Biomes"]))
+            out.write(Buffer.pack_varint_array(self.chunk["Biomes"]))
 
-        out += Buffer.pack_varint(len(chunk_sections_buffer)) + chunk_sections_buffer.read()
+        # the sections are copied straight into the packet's buffer after their total length
+        out.write_varint(sum(len(section) for section in sections))
 
-        # here we would pack the block entities, but we don't support them yet so we just send an array with length of 0
-        out += Buffer.pack_varint(0)
+        for section in sections:
+            out.write(section)
 
-        return out
+        # here we would pack the block entities, but we don't support them yet so we just send an array with length of 0
+        return out.write_varint(0)
 
 
 class PlayUpdateLight(Packet):
@@ -120,6 +125,9 @@ class PlayUpdateLight(Packet):
     def encode(self) -> bytes:
         return Buffer.pack_chunk_light(self.chunk)
 
+    def encode_into(self, buf: Buffer) -> Buffer:
+        return buf.write_chunk_light(self.chunk)
+
     # def encode(self) -> bytes:
     #     out = Buffer.pack_varint(self.chunk.x) + Buffer.pack_varint(self.chunk.z) + Buffer.pack("?", True)
     #
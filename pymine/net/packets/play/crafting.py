@@ -143,7 +143,15 @@ class PlayDeclareRecipes(Packet):
         self.recipes = recipes  # should be the RECIPE map
 
     def encode(self) -> bytes:
-        return b"".join([Buffer.pack_recipe(rid, r) for rid, r in self.recipes.items()])
+        return self.encode_into(Buffer()).buf
+
+    def encode_into(self, buf: Buffer) -> Buffer:
+        buf.write_varint(len(self.recipes))
+
+        for rid, r in self.recipes.items():
+            buf.write_recipe(rid, r)
+
+        return buf
 
 
 class PlayUnlockRecipes(Packet):
@@ -486,7 +486,10 @@ class PlayEntityMetadata(Packet):
         self.metadata = metadata
 
     def encode(self) -> bytes:
-        return Buffer.pack_varint(self.entity_id) + Buffer.pack_entity_metadata(self.metadata)
+        return self.encode_into(Buffer()).buf
+
+    def encode_into(self, buf: Buffer) -> Buffer:
+        return buf.write_varint(self.entity_id).write_entity_metadata(self.metadata)
 
 
 class PlayEntityEquipment(Packet):
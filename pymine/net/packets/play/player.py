@@ -205,6 +205,7 @@ class PlayJoinGame(Packet):
     :param int prev_gamemode: The player's previous gamemode.
     :param list world_names: All of the worlds loaded on the server.
     :param nbt.TAG dim_codec: Represents a dimension and biome registry, see here: https://wiki.vg/Protocol#Join_Game.
+        It may also be packed already (bytes), see dimension_codec.load_dim_codec.
     :param nbt.TAG dimension: A dimension type, see here: https://wiki.vg/Protocol#Join_Game.
     :param str world_name: The name of the world the player is joining.
     :param int hashed_seed: First 8 bytes of SHA-256 hash of the world's seed.
@@ -243,7 +244,7 @@ class PlayJoinGame(Packet):
         gamemode: int,
         prev_gamemode: int,
         world_names: list,
-        dim_codec: nbt.TAG,
+        dim_codec: object,
         dimension: nbt.TAG,
         world_name: str,
         hashed_seed: int,
@@ -280,7 +281,11 @@ class PlayJoinGame(Packet):
             + Buffer.pack("b", self.prev_gamemode)
             + Buffer.pack_varint(len(self.world_names))
             + b"".join([Buffer.pack_string(w) for w in self.world_names])
-            + Buffer.pack_nbt(self.dim_codec)
+            + (
+                self.dim_codec
+                if isinstance(self.dim_codec, bytes)
+                else Buffer.pack_nbt(self.dim_codec)
+            )
             + Buffer.pack_nbt(self.dimension)
             + Buffer.pack_string(self.world_name)
             + Buffer.pack("q", self.hashed_seed)
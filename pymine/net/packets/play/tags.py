@@ -56,7 +56,7 @@ class PlayTags(Packet):
         self.entity = tags["entity_types"]
 
     def encode(self) -> bytes:
-        out = b""
+        out = Buffer()
 
         for tags, REG in (
             (
@@ -76,14 +76,16 @@ class PlayTags(Packet):
                 ENTITY_REGISTRY,
             ),
         ):
-            out += Buffer.pack_varint(len(tags))  # pack length
+            out.write(Buffer.pack_varint(len(tags)))  # pack length
 
             for identifier in tags:
                 # pack identifier name and  length of upcoming array
-                out += Buffer.pack_string(identifier) + Buffer.pack_varint(len(tags[identifier]))
+                out.write(Buffer.pack_string(identifier)).write(
+                    Buffer.pack_varint(len(tags[identifier]))
+                )
 
                 for value in tags[identifier]:
                     # values should be encoded as varints, so we need their id
-                    out += Buffer.pack_varint(REG.encode(value))
+                    out.write(Buffer.pack_varint(REG.encode(value)))
 
-        return out
+        return out.buf
@@ -17,18 +17,17 @@
 from prompt_toolkit.enums import EditingMode
 import asyncio
 import aiohttp
-import struct
 import socket
 import random
 
-from pymine.api.errors import ServerBindingError, InvalidPacketID, StopHandling
+from pymine.api.errors import ServerBindingError, InvalidPacketData, InvalidPacketID, StopHandling
 from pymine.logic.config import load_favicon, load_config
 from pymine.logic.worldio import load_worlds, ChunkIO
 from pymine.util.encryption import gen_rsa_keys
 from pymine.logic.playerio import PlayerDataIO
 from pymine.net.packet_map import PACKET_MAP
 from pymine.logic.query import QueryServer
-from pymine.types.stream import Stream
+from pymine.types.stream import ConnectionProtocol, FrameReader, Stream
 from pymine.types.packet import Packet
 from pymine.types.buffer import Buffer
 from pymine.api import PyMineAPI
@@ -55,6 +54,7 @@ class Server:
             self.states = {}  # {remote: state}
             self.login = {}  # {remote: {username: username, verify: verify token}}
             self.uuid = {}  # {remote: uuid as int}
+            self.comp_thresh = {}  # {remote: compression threshold}, once compression is enabled
 
     def __init__(self, console, process_executor, thread_executor):
         self.console = console  # console instance (see pymine/api/console.py)
@@ -72,6 +72,12 @@ class Server:
         self.comp_thresh = self.conf[
             "comp_thresh"
         ]  # shortcut for compression threshold since it's used so much
+        self.comp_level = self.conf["comp_level"]  # zlib compression level, 1 (fast) to 9 (small)
+        # packets at least this big are compressed in the thread pool
+        self.comp_offload_size = self.conf["comp_offload_size"]
+        # {cache key: {(packet class, comp thresh): framed packet}}, "commands" is invalidated when
+        # a command is registered, "tags" and "brand" never change while the server is running
+        self.packet_cache = {}
 
         self.console.ses.vi_mode = self.conf["vi_mode"]
         self.console.set_prompt(self.conf["prompt"])
@@ -101,9 +107,14 @@ class Server:
         self.console.out.set_title(self.meta.pymine)
 
         try:
-            self.server = await asyncio.start_server(
-                self.handle_connection, host=self.addr, port=self.port
-            )
+            if self.conf["connection_engine"] == "protocol":
+                self.server = await asyncio.get_event_loop().create_server(
+                    (lambda: ConnectionProtocol(self)), host=self.addr, port=self.port
+                )
+            else:
+                self.server = await asyncio.start_server(
+                    self.handle_connection, host=self.addr, port=self.port
+                )
         except OSError as e:
             if e.errno == 98:
                 raise ServerBindingError("PyMine", self.addr, self.port)
@@ -119,9 +130,13 @@ class Server:
         self.api = PyMineAPI(self)
         await self.api.init()
 
-        # 24 / the second arg (the max chunk cache size per world instance), should be dynamically changed based on the
-        # amount of players online on each world, probably something like (len(players)*24)
-        self.worlds = await load_worlds(self, self.conf["level_name"], 1000)
+        # chunks in view of players are always kept loaded, even past the chunk cache limits
+        self.worlds = await load_worlds(
+            self,
+            self.conf["level_name"],
+            self.conf["chunk_cache_max"],
+            self.conf["chunk_cache_max_mb"] * 1024 * 1024,
+        )
         self.playerio = PlayerDataIO(
             self, self.conf["level_name"]
         )  # Player data IO, used to load/dump player info
@@ -157,6 +172,12 @@ class Server:
         if self.api is not None:
             await self.api.stop()
 
+        if self.worlds is not None:
+            for world in self.worlds.values():
+                await world.close()
+
+        await self.chunkio.close()
+
         if self.aiohttp is not None:
             await self.aiohttp.close()
 
@@ -164,7 +185,7 @@ class Server:
 
     async def close_connection(self, stream: Stream):  # Close a connection to a client
         try:
-            await stream.drain()
+            await stream.flush()
         except (ConnectionResetError, BrokenPipeError):
             pass
 
@@ -184,11 +205,20 @@ class Server:
         except KeyError:
             pass
 
+        try:
+            del self.cache.comp_thresh[stream.remote]
+        except KeyError:
+            pass
+
         try:
             del self.playerio.cache[self.cache.uuid[stream.remote]]
         except KeyError:
             pass
 
+        if self.worlds is not None and stream.remote in self.cache.uuid:
+            for world in self.worlds.values():  # the player's chunks don't have to stay loaded
+                world.remove_ticket(self.cache.uuid[stream.remote])
+
         try:
             del self.cache.uuid[stream.remote]
         except KeyError:
@@ -198,69 +228,151 @@ class Server:
 
         return False, stream
 
+    async def pack_packet(self, packet: Packet, comp_thresh: int) -> bytes:
+        # small packets are compressed inline, big ones (like chunk data) are compressed in the
+        # thread pool, zlib releases the GIL so this doesn't stall the event loop
+        data = Buffer.pack_packet_data(packet)
+
+        if comp_thresh >= 1 and len(data) - data.pos >= self.comp_offload_size:
+            return await asyncio.get_event_loop().run_in_executor(
+                self.thread_executor, Buffer.frame_packet, data, comp_thresh, self.comp_level
+            )
+
+        return Buffer.frame_packet(data, comp_thresh, self.comp_level)
+
     async def send_packet(self, stream: Stream, packet: Packet, comp_thresh=None):
         self.console.debug(f"OUT: state:-1 | id:0x{packet.id:02X} | packet:{type(packet).__name__}")
 
         if comp_thresh is None:
             comp_thresh = self.comp_thresh
 
-        stream.write(Buffer.pack_packet(packet, comp_thresh))
-        await stream.drain()
+        # packets are queued and written together at the end of the loop iteration,
+        # only wait if the client isn't keeping up with what's been sent to it
+        stream.write(await self.pack_packet(packet, comp_thresh))
+
+        if stream.outbound.backlogged:
+            await stream.flush()
+
+    async def send_cached_packet(
+        self, stream: Stream, key: object, packet_type: type, *args, comp_thresh=None, cache=None
+    ):
+        """Sends a packet which is the same for every client, it's only created and encoded once.
+
+        :param Stream stream: The stream to send the packet to.
+        :param object key: Identifies the packet's contents, used to invalidate it when they change.
+        :param type packet_type: The packet's class.
+        :param args: Arguments used to create the packet if it isn't cached yet.
+        :param int comp_thresh: The compression threshold, defaults to the server's.
+        :param dict cache: Where the packet is cached, defaults to the server's packet cache.
+        """
+
+        if comp_thresh is None:
+            comp_thresh = self.comp_thresh
+
+        if cache is None:
+            cache = self.packet_cache
+
+        cached = cache.setdefault(key, {})
+        data = cached.get((packet_type, comp_thresh))
+
+        if data is None:
+            data = cached[packet_type, comp_thresh] = await self.pack_packet(
+                packet_type(*args), comp_thresh
+            )
+
+        self.console.debug(
+            f"OUT: state:-1 | id:0x{packet_type.id:02X} | packet:{packet_type.__name__} (cached)"
+        )
+
+        stream.write(data)
+
+        if stream.outbound.backlogged:
+            await stream.flush()
+
+    def invalidate_packet_cache(self, *keys) -> None:
+        """Removes cached packets, should be called when what they were created from changes.
+
+        :param keys: The cache keys to invalidate, if none are given the whole cache is cleared.
+        """
+
+        if not keys:
+            self.packet_cache.clear()
+
+        for key in keys:
+            self.packet_cache.pop(key, None)
 
     async def broadcast_packet(
-        self, packet: Packet
-    ):  # should broadcast a packet to all connected clients in the play state
+        self,
+        packet: Packet,
+        world: str = None,
+        near: tuple = None,
+        uuids: set = None,
+        comp_thresh=None,
+    ):
+        """Broadcasts a packet to connected players, the packet is only encoded + compressed once.
+
+        :param Packet packet: The packet to broadcast.
+        :param str world: Only send to players in this world/dimension, like minecraft:overworld.
+        :param tuple near: Only send to players within a radius of a point, as (x, y, z, radius).
+        :param set uuids: Only send to players whose uuid.UUID is in this set.
+        :param int comp_thresh: The compression threshold, defaults to the server's.
+        """
+
         self.console.debug(f"BROADCAST:      id:0x{packet.id:02X} | packet:{type(packet).__name__}")
 
-        senders = []
+        if comp_thresh is None:
+            comp_thresh = self.comp_thresh
+
+        recipients = []
 
         for p in self.playerio.cache.values():
-            if p.stream is not None:
-                senders.append(self.send_packet(p.stream, packet))
+            if p.stream is None:
+                continue
 
-        await asyncio.gather(*senders)
+            if world is not None and p["Dimension"].data != world:
+                continue
 
-    async def handle_packet(
-        self, stream: Stream
-    ):  # Handle / respond to packets, this is called in a loop
-        packet_length = 0
-
-        # Basically an implementation of Buffer.unpack_varint()
-        # except designed to read directly from a a StreamReader
-        # and also to handle legacy server list ping packets
-        for i in range(3):
-            try:
-                read = await asyncio.wait_for(stream.read(1), 30)
-            except asyncio.TimeoutError:
-                self.console.debug("Closing due to timeout on read...")
-                raise StopHandling
+            if uuids is not None and p.uuid not in uuids:
+                continue
 
-            if read == b"":
-                self.console.debug("Closing due to invalid read....")
-                raise StopHandling
+            if near is not None:
+                x, y, z, radius = near
 
-            if i == 0 and read == b"\xFE":
-                self.console.warn("Legacy ping attempted, legacy ping is not supported.")
-                raise StopHandling
+                if (p.x - x) ** 2 + (p.y - y) ** 2 + (p.z - z) ** 2 > radius**2:
+                    continue
 
-            b = struct.unpack(">B", read)[0]
-            packet_length |= (b & 0x7F) << 7 * i
+            recipients.append(p.stream)
 
-            if not b & 0x80:
-                break
+        if not recipients:
+            return
+
+        data = await self.pack_packet(packet, comp_thresh)
+        flushers = []
+
+        for stream in recipients:
+            stream.write(data)  # only encryption, if any, is done per recipient
 
-        if packet_length & (1 << 31):
-            packet_length -= 1 << 32
+            if stream.outbound.backlogged:
+                flushers.append(stream.flush())
 
-        buf = Buffer(await stream.read(packet_length))
+        await asyncio.gather(*flushers)
 
+    async def handle_packet(
+        self, stream: Stream, buf: Buffer
+    ):  # Handle / respond to a packet, buf is a single frame split out by a FrameReader
         state = self.cache.states.get(stream.remote, 0)
 
-        try:
-            packet = buf.unpack_packet(state, PACKET_MAP)
+        try:  # clients send compressed packets once compression is enabled, which is during login
+            packet = buf.unpack_packet(
+                state, PACKET_MAP, self.cache.comp_thresh.get(stream.remote, -1)
+            )
         except InvalidPacketID:
             self.console.warn("Invalid packet ID received.")
             return stream
+        except InvalidPacketData as e:
+            raise StopHandling(e.msg)
+
+        del buf  # the frame is a view of the receive buffer, it'd be copied if kept while awaiting
 
         self.console.debug(
             f"IN : state: {state} | id:0x{packet.id:02X} | packet:{type(packet).__name__}"
@@ -289,14 +401,29 @@ class Server:
 
     async def handle_connection(self, reader, writer):  # Handle a connection from a client
         stream = Stream(reader, writer)
+        await self.handle_frames(stream, FrameReader(stream))
+
+    async def handle_frames(self, stream: Stream, frames: FrameReader):
+        # Handles a connection from a client, for both the streams and protocol connection engines
         self.console.debug(f"Connection received from {stream.remote[0]}:{stream.remote[1]}.")
 
         error_count = 0
 
         while True:
             try:
-                stream = await self.handle_packet(stream)
-            except StopHandling:
+                buf = frames.next_frame()
+
+                if buf is None:  # no complete frame is buffered, so wait for more data
+                    await frames.fill()
+                    continue
+
+                handling, buf = self.handle_packet(stream, buf), None  # see handle_packet()
+                stream = await handling
+                frames.switch_stream(stream)
+            except StopHandling as e:
+                if e.args:
+                    self.console.debug(e.args[0])
+
                 break
             except (ConnectionResetError, BrokenPipeError):
                 break
@@ -311,4 +438,5 @@ class Server:
             if error_count > 0:
                 error_count -= 0.5
 
+        frames.close()
         await self.close_connection(stream)
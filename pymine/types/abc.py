@@ -43,7 +43,21 @@ class AbstractChunkIO:
         raise NotImplementedError(cls.__name__)
 
     @classmethod
-    async def fetch_chunk_async(cls, world_path: str, chunk_x: int, chunk_z: int):  # -> Chunk
+    async def fetch_chunk_async(
+        cls, world_path: str, chunk_x: int, chunk_z: int, executor=None
+    ):  # -> Chunk
+        raise NotImplementedError(cls.__name__)
+
+    @classmethod
+    async def fetch_chunks_async(cls, world_path: str, chunk_coords: list, executor=None):
+        raise NotImplementedError(cls.__name__)
+
+    @classmethod
+    async def save_chunks_async(cls, world_path: str, chunks: list, executor=None) -> None:
+        raise NotImplementedError(cls.__name__)
+
+    @classmethod
+    async def close(cls) -> None:
         raise NotImplementedError(cls.__name__)
 
 
@@ -17,38 +17,60 @@
 from __future__ import annotations
 
 import immutables
+import logging
+import numpy
 import math
 
 from pymine.data.block_states import BLOCK_STATES
 from pymine.types.abc import AbstractPalette
-from pymine.types.registry import Registry
 import pymine.types.nbt as nbt
 
 
+def index_block_states() -> tuple:
+    """Builds lookup tables from the block states, so blocks can be encoded without scanning states.
+
+    :return: {(block name, frozenset of properties): global id}, {block name: default global id}
+    """
+
+    state_ids = {}
+    default_state_ids = {}
+
+    for name, block in BLOCK_STATES.data.items():
+        for state in block["states"]:
+            state_ids[name, frozenset(state.get("properties", {}).items())] = state["id"]
+
+            if state.get("default"):
+                default_state_ids[name] = state["id"]
+
+    return state_ids, default_state_ids
+
+
+STATE_IDS, DEFAULT_STATE_IDS = index_block_states()
+
+logger = logging.getLogger(__name__)
+
+# should be 14 or 15
+GLOBAL_BITS_PER_BLOCK = math.ceil(
+    math.log2(sum(len(b["states"]) for b in BLOCK_STATES.data.values()))
+)
+
+
 class DirectPalette(AbstractPalette):
     registry = BLOCK_STATES
 
     @staticmethod
     def get_bits_per_block():
-        return math.ceil(
-            math.log2(sum(len(b["states"]) for b in BLOCK_STATES.data.values()))
-        )  # should be 14 or 15
+        return GLOBAL_BITS_PER_BLOCK
 
     @staticmethod
     def encode(block: str, props: dict = None) -> int:
-        props = {} if props is None else props
-        block_data = BLOCK_STATES.encode(block)
-
-        for state in block_data["states"]:
-            if not props and state.get("default"):
-                return state["id"]
+        try:
+            if not props:
+                return DEFAULT_STATE_IDS[block]
 
-            state_props = state.get("properties")
-
-            if state_props and dict(state_props.items()) == dict(props):
-                return state["id"]
-
-        raise ValueError(f"{block} doesn't have a state with those properties.")
+            return STATE_IDS[block, frozenset(props.items())]
+        except KeyError:
+            raise ValueError(f"{block} doesn't have a state with those properties.")
 
     @staticmethod
     def decode(state: int) -> immutables.Map:
@@ -56,51 +78,104 @@ class DirectPalette(AbstractPalette):
 
 
 class IndirectPalette(AbstractPalette):
-    def __init__(self, registry: Registry, bits_per_block: int) -> None:
-        self.registry = registry
+    """A palette local to a chunk section, maps the section's block ids to global block state ids.
+
+    Blocks which aren't in the palette yet are added to it when they're encoded, so the section's
+    existing ids stay valid. Blocks this version doesn't know (like ones from newer versions) are
+    sent to clients as air, but their original palette entries are kept so they're saved as is.
+
+    :param global_ids: The global block state id of each of the palette's ids, in order.
+    :param int bits_per_block: Bits used per block, for the palette's ids.
+    :ivar numpy.ndarray global_ids: Maps the palette's ids to global ids, so a whole array of the
+        palette's ids can be converted with global_ids[ids].
+    :ivar dict unknown: {palette id: original palette entry} for the blocks which this version
+        doesn't know.
+    """
+
+    def __init__(self, global_ids: object, bits_per_block: int) -> None:
+        self.global_ids = numpy.asarray(global_ids, numpy.int32)
         self.bits_per_block = bits_per_block
+        self.unknown = {}
+
+        self._local_ids = {int(g): i for i, g in reversed(list(enumerate(self.global_ids)))}
+
+    def __len__(self) -> int:
+        return len(self.global_ids)
 
     def get_bits_per_block(self):
         return self.bits_per_block
 
     @classmethod
-    def from_nbt(cls, tag: nbt.TAG) -> IndirectPalette:
-        data = {}
-        reverse_data = {}
+    def from_nbt(cls, tag: nbt.TAG, bits_per_block: int) -> IndirectPalette:
+        global_ids = []
+        unknown = {}
 
         for i, b in enumerate(tag):
-            reverse_data[i] = {"name": b["Name"]}
+            props = b.get("Properties")
+            props = None if props is None else {k: v.data for k, v in props.items()}
+
+            try:
+                global_ids.append(DirectPalette.encode(b["Name"].data, props))
+            except ValueError:
+                logger.warning(f"Unknown block state {b['Name'].data} {props or {}}, sent as air.")
+                global_ids.append(DEFAULT_STATE_IDS["minecraft:air"])
+                unknown[i] = b
+
+        palette = cls(global_ids, bits_per_block)
+        palette.unknown = unknown
+
+        # the substituted air shouldn't be what's used when air is placed in the section
+        palette._local_ids = {
+            int(g): i for i, g in reversed(list(enumerate(palette.global_ids))) if i not in unknown
+        }
+
+        return palette
+
+    def to_nbt(self, ids: object = None) -> nbt.TAG_List:
+        """Creates a Palette tag for a region file.
+
+        :param ids: The palette ids to include in the tag, in order, defaults to all of them.
+        :return: The tag, unknown blocks are included as they were loaded.
+        """
+
+        tags = []
 
-            if b.get("Properties"):
-                reverse_data[i]["properties"] = {k: v for k, v in b["Properties"].items()}
+        for local_id in range(len(self.global_ids)) if ids is None else ids:
+            local_id = int(local_id)
 
-        for id_, b in reverse_data.items():
-            if b["name"] not in data:
-                data[b["name"]] = {"states": []}
+            if local_id in self.unknown:
+                tags.append(self.unknown[local_id])
+                continue
 
-            state_data = {"id": id_}
+            state = BLOCK_STATES.decode(int(self.global_ids[local_id]))
+            tag = nbt.TAG_Compound(None, [nbt.TAG_String("Name", state["name"])])
 
-            if b.get("properties"):
-                state_data["properties"] = b["properties"]
+            if state.get("properties"):
+                tag["Properties"] = nbt.TAG_Compound(
+                    "Properties", [nbt.TAG_String(k, v) for k, v in state["properties"].items()]
+                )
 
-            data[b["name"]]["states"].append(state_data)
+            tags.append(tag)
 
-        return cls(Registry(data, reverse_data))
+        return nbt.TAG_List("Palette", tags)
 
     def encode(self, block: str, props: dict = None) -> int:
-        props = {} if props is None else props
-        block_data = self.registry.encode(block)
+        global_id = DirectPalette.encode(block, props)
 
-        for state in block_data["states"]:
-            if not props and state.get("default"):
-                return state["id"]
+        try:
+            return self._local_ids[global_id]
+        except KeyError:
+            pass
 
-            state_props = state.get("properties")
+        # the palette grows instead, sections switch to the direct palette when they're sent if
+        # it's too big for the client, and region files always get a palette of just what's used
+        local_id = len(self.global_ids)
 
-            if state_props and dict(state_props.items()) == dict(props):
-                return state["id"]
+        self.global_ids = numpy.append(self.global_ids, numpy.int32(global_id))
+        self.bits_per_block = max(self.bits_per_block, (len(self.global_ids) - 1).bit_length())
+        self._local_ids[global_id] = local_id
 
-        raise ValueError(f"{block} doesn't have a state with those properties.")
+        return local_id
 
     def decode(self, state: int) -> immutables.Map:
-        return self.registry.decode(state)
+        return BLOCK_STATES.decode(int(self.global_ids[state]))
@@ -17,15 +17,23 @@
 from __future__ import annotations
 
 import immutables
+import numpy
 import struct
 import zlib
 import uuid
 import json
 
+from pymine.util.codec import (
+    encode_varint,
+    decode_varint,
+    encode_varint_array,
+    pack_long_array,
+    get_struct,
+)
 from pymine.types.block_palette import DirectPalette
 from pymine.types.chunk import ChunkSection, Chunk
 from pymine.data.registries import ITEM_REGISTRY
-from pymine.api.errors import InvalidPacketID
+from pymine.api.errors import InvalidPacketData, InvalidPacketID
 from pymine.types.abc import AbstractPalette
 from pymine.types.bitfield import BitField
 from pymine.types.packet import Packet
@@ -34,25 +42,70 @@ import pymine.data.misc as misc_data
 from pymine.data.tags import TAGS
 import pymine.types.nbt as nbt
 
+MAX_PACKET_SIZE = 2097152  # the maximum uncompressed size of a packet, same as the vanilla server
+
+# Space reserved in front of packet data for the frame header, a length varint + data length 0
+PACKET_HEADROOM = 6
+
+AIR_BLOCKS = ("minecraft:air", "minecraft:cave_air", "minecraft:void_air")
+AIR_STATES = tuple(DirectPalette.encode(block) for block in AIR_BLOCKS)
+
 
 class Buffer:
     """
     Base class for a buffer, contains methods
     for handling most basic types and for
     converting from/to a Buffer object itself.
+
+    The underlying data is kept in a growable bytearray so that appends are
+    amortized, reads go through a memoryview cursor so that they don't copy
+    more than they need to. A Buffer can also be used as a builder, write()
+    and the write_* methods append to the end of it and return the Buffer
+    itself so calls can be chained, packets are encoded into a single Buffer
+    this way (see Packet.encode_into). The pack_* classmethods return bytes
+    for a single value, the bigger ones are built with the write_* methods.
     """
 
     def __init__(self, buf: bytes = None) -> None:
-        self.buf = b"" if buf is None else buf
+        self.buf = bytearray() if buf is None else buf
         self.pos = 0
 
+        self._view = None
+
     def __len__(self):
         return len(self.buf)
 
-    def write(self, data: bytes) -> None:
+    @property
+    def view(self) -> memoryview:
+        """A memoryview of the underlying data, used for zero-copy reads."""
+
+        if isinstance(self.buf, memoryview):  # already a view, e.g. a frame in a receive buffer
+            return self.buf
+
+        if self._view is None or self._view.obj is not self.buf:
+            self._view = memoryview(self.buf)
+
+        return self._view
+
+    def _release_view(self) -> None:
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+
+    def write(self, data: bytes) -> Buffer:
         """Writes data to the buffer."""
 
-        self.buf += data
+        self._release_view()
+
+        if not isinstance(self.buf, bytearray):  # first write to a read-only buffer
+            self.buf = bytearray(self.buf)
+
+        try:
+            self.buf += data
+        except BufferError:  # a view from read_view() is still pinning the old storage
+            self.buf = self.buf + data
+
+        return self
 
     def read(self, length: int = None) -> bytes:
         """
@@ -60,15 +113,28 @@ class Buffer:
         then all remaining data from the buffer is sent.
         """
 
-        try:
-            if length is None:
-                length = len(self.buf)
-                return self.buf[self.pos :]
+        return self.read_view(length).tobytes()
 
-            return self.buf[self.pos : self.pos + length]
-        finally:
+    def read_view(self, length: int = None) -> memoryview:
+        """
+        Like read(), except a memoryview of the data is returned instead of a copy,
+        the view is only valid until the next write to the buffer.
+        """
+
+        start = self.pos
+
+        if length is None:
+            self.pos = len(self.buf)
+        else:
             self.pos += length
 
+        return self.view[start : self.pos]
+
+    def getvalue(self) -> bytes:
+        """Returns the entire contents of the buffer, regardless of the position."""
+
+        return bytes(self.buf)
+
     def unpack_byte(self) -> int:
         byte = self.buf[self.pos]
         self.pos += 1
@@ -84,7 +150,9 @@ class Buffer:
         self.pos = 0
 
     def unpack(self, f: str) -> object:
-        unpacked = struct.unpack(">" + f, self.read(struct.calcsize(f)))
+        s = get_struct(f)
+        unpacked = s.unpack_from(self.buf, self.pos)
+        self.pos += s.size
 
         if len(unpacked) == 1:
             return unpacked[0]
@@ -93,32 +161,83 @@ class Buffer:
 
     @classmethod
     def pack(cls, f: str, *data: object) -> bytes:
-        return struct.pack(">" + f, *data)
+        return get_struct(f).pack(*data)
+
+    def write_struct(self, f: str, *data: object) -> Buffer:
+        """Packs data with a struct format (like pack()) directly onto the end of the buffer."""
+
+        return self.write(get_struct(f).pack(*data))
 
     @classmethod
-    def pack_packet(cls, packet: Packet, comp_thresh: int = -1) -> bytes:
+    def pack_packet(cls, packet: Packet, comp_thresh: int = -1, comp_level: int = -1) -> bytes:
         """
         Packs a Packet object into bytes.
         """
 
-        data = cls.pack_varint(packet.id) + packet.encode()
+        return cls.frame_packet(cls.pack_packet_data(packet), comp_thresh, comp_level)
+
+    @classmethod
+    def pack_packet_data(cls, packet: Packet) -> Buffer:
+        """Packs the id and data of a Packet object into one Buffer, without the framing.
+
+        The packet is written after PACKET_HEADROOM bytes, the returned Buffer's position is where
+        it starts, so frame_packet() can put the frame header in front of it without copying it.
+        """
+
+        buf = cls(bytearray(PACKET_HEADROOM))
+        buf.pos = PACKET_HEADROOM
+
+        return packet.encode_into(buf.write_varint(packet.id))
+
+    @classmethod
+    def frame_packet(cls, data: Buffer, comp_thresh: int = -1, comp_level: int = -1) -> bytes:
+        """Frames (and compresses if needed) data packed by pack_packet_data().
+
+        :param Buffer data: The packet data is the rest of the buffer, from its position. If there's
+            room for the header before the position it's written there, and a memoryview of the
+            framed packet is returned instead of a copy. Plain bytes are copied once.
+        """
+
+        if not isinstance(data, Buffer):
+            data = cls(bytearray(PACKET_HEADROOM) + data)
+            data.pos = PACKET_HEADROOM
+
+        buf, start = data.buf, data.pos
+        length = len(buf) - start
 
         if comp_thresh >= 1:
-            if len(data) >= comp_thresh:
-                data = cls.pack_varint(len(data)) + zlib.compress(data)
-            else:
-                data = cls.pack_varint(0) + data
+            if length >= comp_thresh:
+                with memoryview(buf) as view:
+                    compressed = zlib.compress(view[start:], comp_level)
+
+                header = cls.pack_varint(length)
+
+                return (
+                    cls()
+                    .write_varint(len(header) + len(compressed))
+                    .write(header)
+                    .write(compressed)
+                    .buf
+                )
+
+            header = cls.pack_varint(length + 1) + b"\x00"  # uncompressed, so data length is 0
+        else:
+            header = cls.pack_varint(length)
 
-        return cls.pack_varint(len(data)) + data
+        if start < len(header) or not isinstance(buf, bytearray):  # no room, so it's copied
+            return cls().write(header).write(memoryview(buf)[start:]).buf
 
-    def unpack_packet(self, state: str, PACKET_MAP: object, comp_thresh: int = -1) -> Packet:
-        data = self.buf
+        data._release_view()
+        buf[start - len(header) : start] = header
 
-        if comp_thresh >= 0:
+        return memoryview(buf)[start - len(header) :]
+
+    def unpack_packet(self, state: str, PACKET_MAP: object, comp_thresh: int = -1) -> Packet:
+        if comp_thresh >= 1:
             uncomp_len = self.unpack_varint()
 
             if uncomp_len > 0:
-                data = zlib.decompress(self.read())
+                self.inflate(uncomp_len, comp_thresh)
 
         try:
             packet_class = PACKET_MAP[state][self.unpack_varint()]
@@ -127,6 +246,39 @@ class Buffer:
 
         return packet_class.decode(self)
 
+    def inflate(self, uncomp_len: int, comp_thresh: int = 0) -> Buffer:
+        """
+        Decompresses the rest of the buffer, the decompressed data replaces the buffer's contents.
+        Decompression stops at uncomp_len bytes, so data can't inflate past its declared length.
+        """
+
+        if not comp_thresh <= uncomp_len <= MAX_PACKET_SIZE:
+            raise InvalidPacketData(
+                f"Badly compressed packet, size of {uncomp_len} is outside of the allowed range "
+                f"[{comp_thresh}, {MAX_PACKET_SIZE}]"
+            )
+
+        decomp = zlib.decompressobj()
+
+        try:
+            with self.read_view() as compressed:
+                data = decomp.decompress(compressed, uncomp_len)
+
+            # the checksum may be left unread once max_length is reached, any more data is too much
+            if not decomp.eof and decomp.decompress(decomp.unconsumed_tail, 1):
+                raise InvalidPacketData("Badly compressed packet, data is larger than declared")
+        except zlib.error as e:
+            raise InvalidPacketData(f"Badly compressed packet, {e}")
+
+        if len(data) != uncomp_len or not decomp.eof:
+            raise InvalidPacketData("Badly compressed packet, data doesn't match declared size")
+
+        self._release_view()
+        self.buf = data
+        self.pos = 0
+
+        return self
+
     @classmethod
     def pack_optional(cls, packer: object, data: object = None) -> bytes:
         """Packs an optional field into bytes."""
@@ -136,6 +288,16 @@ class Buffer:
 
         return cls.pack("?", True) + packer(data)
 
+    def write_optional(self, writer: object, data: object = None) -> Buffer:
+        """Writes an optional field, writer is a write_* method of this buffer like write_chat."""
+
+        self.write_struct("?", data is not None)
+
+        if data is not None:
+            writer(data)
+
+        return self
+
     def unpack_optional(self, unpacker: object) -> object:
         """Unpacks an optional field from the buffer."""
 
@@ -148,57 +310,46 @@ class Buffer:
     def pack_varint(cls, num: int, max_bits: int = 32) -> bytes:
         """Packs a varint (Varying Integer) into bytes."""
 
-        num_max = (1 << (max_bits - 1)) - 1
-        num_min = -1 << (max_bits - 1)
-
-        if not (num_min <= num <= num_max):
-            raise ValueError(f"num doesn't fit in given range: {num_min} <= {num} < {num_max}")
-
-        if num < 0:
-            num += 1 << 32
-
-        out = b""
-
-        for i in range(10):
-            b = num & 0x7F
-            num >>= 7
-
-            out += cls.pack("B", (b | (0x80 if num > 0 else 0)))
-
-            if num == 0:
-                break
-
-        return out
+        return encode_varint(num, max_bits)
 
     def unpack_varint(self, max_bits: int = 32) -> int:
         """Unpacks a varint from the buffer."""
 
-        num = 0
+        num, self.pos = decode_varint(self.buf, self.pos, max_bits)
+        return num
 
-        for i in range(10):
-            b = self.unpack("B")
-            num |= (b & 0x7F) << 7 * i
+    def write_varint(self, num: int, max_bits: int = 32) -> Buffer:
+        """Packs a varint directly onto the end of the buffer."""
 
-            if not b & 0x80:
-                break
+        return self.write(encode_varint(num, max_bits))
 
-        if num & (1 << 31):
-            num -= 1 << 32
+    @classmethod
+    def pack_varlong(cls, num: int) -> bytes:
+        """Packs a varlong (Varying Long) into bytes."""
 
-        num_max = (1 << (max_bits - 1)) - 1
-        num_min = -1 << (max_bits - 1)
+        return encode_varint(num, 64)
 
-        if not (num_min <= num <= num_max):
-            raise ValueError(f"num doesn't fit in given range: {num_min} <= {num} < {num_max}")
+    def unpack_varlong(self) -> int:
+        """Unpacks a varlong from the buffer."""
 
+        num, self.pos = decode_varint(self.buf, self.pos, 64)
         return num
 
+    @classmethod
+    def pack_varint_array(cls, nums: list, max_bits: int = 32) -> bytes:
+        """Packs an array of varints into bytes, without a length prefix."""
+
+        return encode_varint_array(nums, max_bits)
+
     @classmethod
     def pack_optional_varint(cls, num):
         """Packs an optional varint into bytes."""
 
         return cls.pack_varint(0 if num is None else num + 1)
 
+    def write_optional_varint(self, num: int = None) -> Buffer:
+        return self.write_varint(0 if num is None else num + 1)
+
     def unpack_optional_varint(cls):
         num = cls.unpack_varint()
 
@@ -214,11 +365,17 @@ class Buffer:
         text = text.encode("utf-8")
         return cls.pack_varint(len(text), max_bits=16) + text
 
+    def write_string(self, text: str) -> Buffer:
+        """Packs a string directly onto the end of the buffer."""
+
+        text = text.encode("utf-8")
+        return self.write_varint(len(text), max_bits=16).write(text)
+
     def unpack_string(self) -> str:
         """Unpacks a string from the buffer."""
 
         length = self.unpack_varint(max_bits=16)
-        return self.read(length).decode("utf-8")
+        return str(self.read_view(length), "utf-8")
 
     @classmethod
     def pack_json(cls, obj: object) -> bytes:
@@ -226,6 +383,9 @@ class Buffer:
 
         return cls.pack_string(json.dumps(obj))
 
+    def write_json(self, obj: object) -> Buffer:
+        return self.write_string(json.dumps(obj))
+
     def unpack_json(self) -> object:
         """Unpacks serialized json data from the buffer."""
 
@@ -240,6 +400,9 @@ class Buffer:
 
         return tag.pack()
 
+    def write_nbt(self, tag: nbt.TAG = None) -> Buffer:
+        return self.write(self.pack_nbt(tag))
+
     def unpack_nbt(self):
         return nbt.unpack(self)
 
@@ -249,6 +412,9 @@ class Buffer:
 
         return uuid_.bytes
 
+    def write_uuid(self, uuid_: uuid.UUID) -> Buffer:
+        return self.write(uuid_.bytes)
+
     def unpack_uuid(self) -> uuid.UUID:
         """Unpacks a UUID from the buffer."""
 
@@ -263,6 +429,9 @@ class Buffer:
 
         return cls.pack_json(Chat(msg).msg)
 
+    def write_chat(self, msg: Chat) -> Buffer:
+        return self.write_json((msg if isinstance(msg, Chat) else Chat(msg)).msg)
+
     def unpack_chat(self) -> Chat:
         """Unpacks a Minecraft chat message from the buffer."""
 
@@ -286,6 +455,9 @@ class Buffer:
             ),
         )
 
+    def write_position(self, x: int, y: int, z: int) -> Buffer:
+        return self.write(self.pack_position(x, y, z))
+
     def unpack_position(self) -> tuple:
         """Unpacks a Minecraft position (x, y, z) from the buffer."""
 
@@ -307,16 +479,21 @@ class Buffer:
     def pack_slot(cls, item: str = None, count: int = 1, tag: nbt.TAG = None) -> bytes:
         """Packs an inventory/container slot into bytes."""
 
+        return cls().write_slot(item, count, tag).buf
+
+    def write_slot(self, item: str = None, count: int = 1, tag: nbt.TAG = None) -> Buffer:
+        """Packs an inventory/container slot directly onto the end of the buffer."""
+
         item_id = ITEM_REGISTRY.encode(item)  # needed to support recipes
 
         if item_id is None:
-            return cls.pack("?", False)
+            return self.write_struct("?", False)
 
         return (
-            cls.pack("?", True)
-            + cls.pack_varint(item_id)
-            + cls.pack("b", count)
-            + cls.pack_nbt(tag)
+            self.write_struct("?", True)
+            .write_varint(item_id)
+            .write_struct("b", count)
+            .write_nbt(tag)
         )
 
     def unpack_slot(self) -> dict:
@@ -339,6 +516,9 @@ class Buffer:
 
         return cls.pack("fff", x, y, z)
 
+    def write_rotation(self, x: float, y: float, z: float) -> Buffer:
+        return self.write_struct("fff", x, y, z)
+
     def unpack_rotation(self) -> tuple:
         """Unpacks a rotation (of an entity) from the buffer."""
 
@@ -350,6 +530,9 @@ class Buffer:
 
         return cls.pack_varint(misc_data.DIRECTIONS.index(direction))
 
+    def write_direction(self, direction: str) -> Buffer:
+        return self.write_varint(misc_data.DIRECTIONS.index(direction))
+
     def unpack_direction(self) -> str:
         """Unpacks a direction from the buffer."""
 
@@ -361,6 +544,9 @@ class Buffer:
 
         return cls.pack_varint(misc_data.POSES.index(pose))
 
+    def write_positione(self, pose: str) -> Buffer:
+        return self.write_varint(misc_data.POSES.index(pose))
+
     def unpack_positione(self) -> str:
         """Unpacks a pose from the buffer."""
 
@@ -368,11 +554,14 @@ class Buffer:
 
     @classmethod
     def pack_recipe_item(cls, item):
+        return cls().write_recipe_item(item).buf
+
+    def write_recipe_item(self, item) -> Buffer:
         if isinstance(item, (dict, immutables.Map)):
-            return cls.pack_slot(**item)
+            return self.write_slot(**item)
 
         if isinstance(item, str):
-            return cls.pack_slot(item)
+            return self.write_slot(item)
 
         raise TypeError(f"Invalid type {type(item)}.")
 
@@ -380,9 +569,15 @@ class Buffer:
     def pack_ingredient(cls, ingredient: dict) -> bytes:
         """Packs a recipe ingredient into bytes."""
 
-        return cls.pack_varint(len(ingredient)) + b"".join(
-            [cls.pack_recipe_item(slot) for slot in ingredient.values()]
-        )
+        return cls().write_ingredient(ingredient).buf
+
+    def write_ingredient(self, ingredient: dict) -> Buffer:
+        self.write_varint(len(ingredient))
+
+        for slot in ingredient.values():
+            self.write_recipe_item(slot)
+
+        return self
 
     @classmethod  # Note, recipes are sent as an array and actually require a varint length of recipe array before recipe array
     # recipe_id is the actual name of the recipe i.e. jungle_planks, oak_door, furnace, etc...
@@ -391,62 +586,49 @@ class Buffer:
     ) -> bytes:  # https://wiki.vg/Protocol#Declare_Recipes
         """Packs a recipe into bytes."""
 
+        return cls().write_recipe(recipe_id, recipe).buf
+
+    def write_recipe(self, recipe_id: str, recipe: dict) -> Buffer:
+        """Packs a recipe directly onto the end of the buffer."""
+
         type_ = recipe["type"]
-        out = cls.pack_string(type_) + cls.pack_string(recipe_id)
+        self.write_string(type_).write_string(recipe_id)
 
         if recipe.get("group") is None:
             recipe = {**recipe, "group": "null"}
 
         if type_ == "minecraft:crafting_shapeless":
-            print(recipe.get("ingredients"))
-            out += (
-                cls.pack_string(recipe["group"])
-                + cls.pack_varint(len(recipe["ingredients"]))
-                + b"".join(
-                    [
-                        cls.pack_ingredient(ingredient)
-                        for ingredient in recipe.get("ingredients", [])
-                    ]
-                )
-                + cls.pack_recipe_item(recipe["result"])
-            )
+            self.write_string(recipe["group"]).write_varint(len(recipe["ingredients"]))
+
+            for ingredient in recipe.get("ingredients", []):
+                self.write_ingredient(ingredient)
+
+            self.write_recipe_item(recipe["result"])
         elif type_ == "minecraft:crafting_shaped":
-            out += (
-                cls.pack_varint(len(recipe["pattern"][0]))
-                + cls.pack_varint(len(recipe["pattern"]))
-                + cls.pack_string(recipe["group"])
-                + b"".join(
-                    [
-                        cls.pack_ingredient(ingredient)
-                        for ingredient in recipe.get("ingredients", [])
-                    ]
-                )
-                + cls.pack_recipe_item(recipe["result"])
-            )
+            self.write_varint(len(recipe["pattern"][0]))
+            self.write_varint(len(recipe["pattern"]))
+            self.write_string(recipe["group"])
+
+            for ingredient in recipe.get("ingredients", []):
+                self.write_ingredient(ingredient)
+
+            self.write_recipe_item(recipe["result"])
         elif type_[10:] in ("smelting", "blasting", "campfire_cooking"):
-            print(recipe)
-
-            out += (
-                cls.pack_string(recipe["group"])
-                + cls.pack_ingredient(recipe["ingredient"])
-                + cls.pack_recipe_item(recipe["result"])
-                + cls.pack("f", recipe["experience"])
-                + cls.pack_varint(recipe["cookingtime"])
-            )
+            self.write_string(recipe["group"])
+            self.write_ingredient(recipe["ingredient"])
+            self.write_recipe_item(recipe["result"])
+            self.write_struct("f", recipe["experience"])
+            self.write_varint(recipe["cookingtime"])
         elif type_ == "minecraft:stonecutting":
-            out += (
-                cls.pack_string(recipe["group"])
-                + cls.pack_ingredient(recipe["ingredient"])
-                + cls.pack_recipe_item(recipe["result"])
-            )
+            self.write_string(recipe["group"])
+            self.write_ingredient(recipe["ingredient"])
+            self.write_recipe_item(recipe["result"])
         elif type_ == "minecraft:smithing":
-            out += (
-                cls.pack_ingredient(recipe["base"])
-                + cls.pack_ingredient(recipe["addition"])
-                + cls.pack_recipe_item(recipe["result"])
-            )
+            self.write_ingredient(recipe["base"])
+            self.write_ingredient(recipe["addition"])
+            self.write_recipe_item(recipe["result"])
 
-        return out
+        return self
 
     @classmethod
     def pack_villager(cls, kind: int, profession: int, level: int) -> bytes:
@@ -454,6 +636,9 @@ class Buffer:
 
         return cls.pack_varint(kind) + cls.pack_varint(profession) + cls.pack_varint(level)
 
+    def write_villager(self, kind: int, profession: int, level: int) -> Buffer:
+        return self.write_varint(kind).write_varint(profession).write_varint(level)
+
     def unpack_villager(self) -> dict:
         """Unpacks villager data from the buffer."""
 
@@ -497,22 +682,25 @@ class Buffer:
 
     @classmethod
     def pack_particle(cls, **particle) -> bytes:
+        return cls().write_particle(**particle).buf
+
+    def write_particle(self, **particle) -> Buffer:
         particle_id = particle["id"]
-        out = cls.pack_varint(particle_id)
+        self.write_varint(particle_id)
 
         if particle_id in (
             3,
             23,
         ):
-            out += cls.pack_varint(particle["block_state"])
+            self.write_varint(particle["block_state"])
         elif particle_id == 14:
-            out += cls.pack(
+            self.write_struct(
                 "ffff", particle["red"], particle["green"], particle["blue"], particle["scale"]
             )
         elif particle_id == 32:
-            out += cls.pack_slot(**particle["item"])
+            self.write_slot(**particle["item"])
 
-        return out
+        return self
 
     def unpack_particle(self) -> dict:
         particle = {}
@@ -535,56 +723,56 @@ class Buffer:
 
     @classmethod
     def pack_entity_metadata(cls, metadata: dict) -> bytes:
-        out = b""
+        return cls().write_entity_metadata(metadata).buf
+
+    def write_entity_metadata(self, metadata: dict) -> Buffer:
+        """Packs entity metadata directly onto the end of the buffer, every field is appended."""
 
         for index_and_type, value in metadata.items():
             index, type_ = index_and_type
 
-            out += cls.pack("B", index) + cls.pack_varint(type_)
+            self.write_struct("B", index).write_varint(type_)
 
             if type_ == 0:  # byte
-                out += cls.pack("b", value)
+                self.write_struct("b", value)
             elif type_ == 1:  # varint
-                out += cls.pack_varint(value)
+                self.write_varint(value)
             elif type_ == 2:  # float
-                out += cls.pack("f", value)
+                self.write_struct("f", value)
             elif type_ == 3:  # string
-                out += cls.pack_string(value)
+                self.write_string(value)
             elif type_ == 4:  # Chat
-                out += cls.pack_chat(value)
+                self.write_chat(value)
             elif type_ == 5:  # optional Chat
-                out += cls.pack_optional(cls.pack_chat, value)
+                self.write_optional(self.write_chat, value)
             elif type_ == 6:  # Slot
-                out += cls.pack_slot(**value)
+                self.write_slot(**value)
             elif type_ == 7:  # bool
-                out += cls.pack("?", value)
+                self.write_struct("?", value)
             elif type_ == 8:  # rotation
-                out += cls.pack_rotation(*value)
+                self.write_rotation(*value)
             elif type_ == 9:  # position
-                out += cls.pack_position(*value)
+                self.write_position(*value)
             elif type_ == 10:  # optional position
-                if value is not None:
-                    out += cls.pack_bool("?", True) + cls.pack_position(*value)
-                else:
-                    out += cls.pack_bool("?", False)
+                self.write_optional(lambda position: self.write_position(*position), value)
             elif type_ == 11:  # direction
-                out += cls.pack_direction(value)
+                self.write_direction(value)
             elif type_ == 12:  # optional uuid
-                out += cls.pack_optional(cls.pack_uuid, value)
-            elif type_ == 13:  # optional block id
-                out += cls.pack_optional(cls.pack_optional, value)
+                self.write_optional(self.write_uuid, value)
+            elif type_ == 13:  # optional block id, 0 is absent (air)
+                self.write_varint(0 if value is None else value)
             elif type_ == 14:  # NBT
-                out += cls.pack_nbt(value)
+                self.write_nbt(value)
             elif type_ == 15:  # particle
-                out += cls.pack_particle(value)
+                self.write_particle(**value)
             elif type_ == 16:  # villager data
-                out += cls.pack_villager(*value)
+                self.write_villager(*value)
             elif type_ == 17:  # optional varint
-                out += cls.pack_optional_varint(value)
+                self.write_optional_varint(value)
             elif type_ == 18:  # pose
-                out += cls.pack_positione(value)
+                self.write_positione(value)
 
-        return out + b"\xFE"
+        return self.write(b"\xFE")
 
     # 0 = add/subtract amount, 1 = add/subtract amount percent of the current value, 2 = multiply by percent amount
     @classmethod
@@ -622,119 +810,102 @@ class Buffer:
 
     @classmethod
     def pack_block_palette(cls, palette: AbstractPalette) -> bytes:
+        return cls().write_block_palette(palette).buf
+
+    def write_block_palette(self, palette: AbstractPalette) -> Buffer:
         if palette is DirectPalette:
-            return b""
-
-        return cls.pack_varint(
-            len(palette.registry.data)
-        ) + b"".join(  # map indirect ids to the global palette
-            [
-                cls.pack_varint(DirectPalette.encode(palette.decode(state_id)))
-                for state_id in range(len(palette.registry.data))
-            ]
+            return self
+
+        # map indirect ids to the global palette
+        return self.write_varint(len(palette.global_ids)).write(
+            self.pack_varint_array(palette.global_ids)
         )
 
     @classmethod
     def pack_chunk_section_blocks(cls, section: ChunkSection) -> bytes:
         if section.block_states is None:
             return cls.pack_varint(0)  # length is 0
+        elif section.packed_blocks is not None and section.packed_blocks[0] == section.version:
+            return section.packed_blocks[1]  # the section hasn't changed since it was last packed
         else:
+            section.block_states.compact()  # this is as expensive as packing, so it's done here
+
             palette = section.palette
             bits_per_block = palette.get_bits_per_block()
+            states = section.block_states.array()
 
-            # pack bits per block and palette
-            out = cls.pack("b", bits_per_block) + cls.pack_block_palette(palette)
+            # the client only supports indirect palettes of up to 8 bits per block
+            if palette is not DirectPalette and bits_per_block > 8:
+                states = palette.global_ids[states]
+                palette = DirectPalette
+                bits_per_block = palette.get_bits_per_block()
 
-            data = [0] * int((16 * 16 * 16) * bits_per_block / 64)
-            individual_value_mask = (1 << bits_per_block) - 1
-
-            # create the long array from the block states
-            for y in range(16):
-                for z in range(16):
-                    for x in range(16):
-                        block_num = (((y * 16) + z) * 16) + x
-                        start_long = (block_num * bits_per_block) // 64
-                        start_offset = (block_num * bits_per_block) % 64
-                        end_long = ((block_num + 1) * bits_per_block - 1) // 64
+            if palette is DirectPalette:
+                air = AIR_STATES
+            else:
+                air = numpy.flatnonzero(numpy.isin(palette.global_ids, AIR_STATES))
+
+            # the amount of non-air blocks in the section, used by the client for lighting and such
+            block_count = 4096 - int(numpy.count_nonzero(numpy.isin(states, air)))
+
+            # create the long array from the block states, as big endian longs
+            data = pack_long_array(states, bits_per_block).astype(">u8")
+
+            # pack block count, bits per block, palette, and the long array into one buffer
+            out = (
+                cls()
+                .write_struct("h", block_count)
+                .write_struct("B", bits_per_block)
+                .write_block_palette(palette)
+                .write_varint(len(data))
+                .write(memoryview(data.view(numpy.uint8)))
+                .buf
+            )
 
-                        value = section.block_states[y][z][x] & individual_value_mask
+            section.packed_blocks = (section.version, out)
 
-                        data[start_long] |= value << start_offset
+            return out
 
-                        if start_long != end_long:
-                            data[end_long] = value >> (64 - start_offset)
+    def write_chunk_section_blocks(self, section: ChunkSection) -> Buffer:
+        """Writes a section's blocks, sections are packed once per change so they're copied in."""
 
-            # pack and return the block state long array
-            return cls.pack_varint(len(data)) + b"".join([cls.pack("q", q) for q in data])
+        return self.write(self.pack_chunk_section_blocks(section))
 
     @classmethod
     def pack_chunk_light(cls, chunk: Chunk) -> bytes:
-        out = cls.pack_varint(chunk.x) + cls.pack_varint(chunk.z) + cls.pack("?", True)
+        return cls().write_chunk_light(chunk).buf
+
+    def write_chunk_light(self, chunk: Chunk) -> Buffer:
+        """Packs the data of an update light packet for the chunk onto the end of the buffer."""
 
-        sky_light_mask = 0
-        block_light_mask = 0
-        empty_sky_light_mask = 0
-        empty_block_light_mask = 0
+        self.write_varint(chunk.x).write_varint(chunk.z)
+        self.write_struct("?", True)  # trust edges
 
-        sky_light_arrays = []
-        block_light_arrays = []
+        # sky light, block light, empty sky light, and empty block light masks
+        # bit 0 is the section below the world (y=-1) and bit 17 is the one above it
+        masks = [0, 0, 0, 0]
+        arrays = ([], [])  # sky light arrays, block light arrays
 
-        for section_y in range(-1, 17, 1):
+        for section_y in range(-1, 17):
             section = chunk.get(section_y)
 
             if section is None:
                 continue
 
-            print("Section y/index:", section_y)
-
-            if section.sky_light is not None and len(section.sky_light.nonzero()) > 0:
-                sky_light_mask |= 1 << section_y
-
-                sky_light_array = b""
-
-                for y in range(16):
-                    for z in range(16):
-                        for x in range(0, 16, 2):
-                            sky_light_array += cls.pack(
-                                "B",
-                                (section.sky_light[y][z][x] << 4)
-                                | (section.sky_light[y][z][x + 1]),
-                            )
-
-                print("Sky light array length:", len(sky_light_array))
+            for i, light in enumerate((section.sky_light, section.block_light)):
+                if light is None:
+                    continue
 
-                sky_light_arrays.append(cls.pack_varint(len(sky_light_array)) + sky_light_array)
+                if light.any():
+                    masks[i] |= 1 << (section_y + 1)
+                    arrays[i].append(light)
+                else:  # sections with no light at all are marked as empty instead of being sent
+                    masks[i + 2] |= 1 << (section_y + 1)
 
-            if section.block_light is not None and len(section.block_light.nonzero()) > 0:
-                block_light_mask |= 1 << section_y
+        for mask in masks:
+            self.write_varint(mask)
 
-                block_light_array = b""
-
-                for y in range(16):
-                    for z in range(16):
-                        for x in range(0, 16, 2):
-                            block_light_array += cls.pack(
-                                "B",
-                                (section.block_light[y][z][x] << 4)
-                                | (section.block_light[y][z][x + 1]),
-                            )
-
-                print("Block light array length:", len(block_light_array))
-
-                block_light_arrays.append(
-                    cls.pack_varint(len(block_light_array)) + block_light_array
-                )
-
-        print("Sky light mask:", sky_light_mask)
-        print("Block light mask:", block_light_mask)
-
-        out = (
-            cls.pack_varint(sky_light_mask)
-            + cls.pack_varint(block_light_mask)
-            + cls.pack_varint(empty_sky_light_mask)
-            + cls.pack_varint(empty_block_light_mask)
-            + b"".join(sky_light_arrays)
-            + b"".join(block_light_arrays)
-        )
+        for light in arrays[0] + arrays[1]:
+            self.write_varint(2048).write(light.packed())
 
-        return out  # [:len(out) - 4095]
+        return self
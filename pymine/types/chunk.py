@@ -16,13 +16,299 @@
 
 from __future__ import annotations
 
-import struct
 import numpy
 
 from pymine.types.block_palette import IndirectPalette, DirectPalette
+from pymine.util.codec import pack_long_array, unpack_long_array, pack_nibbles, unpack_nibbles
 from pymine.types.abc import AbstractPalette
 import pymine.types.nbt as nbt
 
+SECTION_SHAPE = (16, 16, 16)  # y, z, x
+
+
+def tag_nbytes(tag: nbt.TAG) -> int:
+    """Roughly how much memory a tag uses, tags which weren't parsed yet count as their packed data.
+
+    Parsed tags count as their data plus a rough estimate of the overhead of the python objects.
+    """
+
+    if tag.__class__ is nbt.TAG_Lazy:
+        return len(tag.payload)
+
+    if isinstance(tag, nbt.TAG_Compound):  # dict's values(), so lazy tags aren't parsed
+        size = sum(tag_nbytes(t) + len(k) for k, t in dict.items(tag))
+    elif isinstance(tag, nbt.TAG_List):
+        size = sum(tag_nbytes(t) for t in tag)
+    elif isinstance(tag, nbt.TAG_Array):
+        size = tag.data.nbytes
+    elif isinstance(tag, nbt.TAG_Byte_Array):
+        size = len(tag)
+    elif isinstance(tag, nbt.TAG_String):
+        size = len(tag.data)
+    else:  # numbers
+        size = 8
+
+    return size + 64
+
+
+class PalettedArray:
+    """A 16x16x16 array of block states which is stored compactly, similar to the protocol.
+
+    A section made of one block is stored as just that value, one with up to 256 different
+    values is stored as uint8 indices into a palette, and anything else is stored directly as
+    uint16 (or int32). The mode switches automatically on writes, it's indexed like a numpy array.
+
+    :param int value: The value every block in the array starts out as.
+    :ivar int value: The value of every block, when the array is in single value mode.
+    :ivar numpy.ndarray palette: The values which indices refer to, when in indirect mode.
+    :ivar numpy.ndarray data: The indices (indirect mode) or values (direct mode) of the blocks.
+    """
+
+    def __init__(self, value: int = 0) -> None:
+        self.value = value
+        self.palette = None
+        self.data = None
+
+        self._lookup = None  # {value: index in palette}
+
+    def __repr__(self) -> str:
+        return f"PalettedArray(mode={self.mode})"
+
+    @property
+    def mode(self) -> str:
+        if self.data is None:
+            return "single"
+
+        return "direct" if self.palette is None else "indirect"
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.data, self.palette) if a is not None)
+
+    @classmethod
+    def from_array(cls, array: numpy.ndarray) -> PalettedArray:
+        """Creates a PalettedArray from a (16, 16, 16) array, in whichever mode fits it best."""
+
+        values, indices = numpy.unique(numpy.asarray(array), return_inverse=True)
+
+        if len(values) == 1:
+            return cls(int(values[0]))
+
+        states = cls()
+
+        if len(values) <= 256:
+            states._set_palette(values)
+            states.data = indices.astype(numpy.uint8).reshape(SECTION_SHAPE)
+        else:
+            dtype = cls._direct_dtype(values[-1])
+            states.data = numpy.asarray(array).astype(dtype).reshape(SECTION_SHAPE)
+
+        return states
+
+    @staticmethod
+    def _direct_dtype(max_value: int) -> type:
+        return numpy.uint16 if max_value <= 0xFFFF else numpy.int32
+
+    def compact(self) -> None:
+        """Switches to the mode which fits the current values best.
+
+        Writes only ever switch to a mode which can hold more different values, so an array which
+        was in direct mode stays in it after its blocks are replaced by fewer different ones.
+        """
+
+        if self.data is not None:
+            compact = PalettedArray.from_array(self.array())
+            self.value, self.palette, self.data = compact.value, compact.palette, compact.data
+            self._lookup = compact._lookup
+
+    def _set_palette(self, values: object) -> None:
+        self.palette = numpy.asarray(values, numpy.int32)
+        self._lookup = {int(v): i for i, v in enumerate(self.palette)}
+
+    def array(self) -> numpy.ndarray:
+        """Returns the whole array as a regular int32 numpy array."""
+
+        if self.data is None:
+            return numpy.full(SECTION_SHAPE, self.value, numpy.int32)
+
+        if self.palette is None:
+            return self.data.astype(numpy.int32)
+
+        return self.palette[self.data]
+
+    def __array__(self, dtype=None, copy=None) -> numpy.ndarray:
+        array = self.array()
+        return array if dtype is None else array.astype(dtype)
+
+    def __getitem__(self, key) -> object:
+        if self.data is None:
+            index = key if isinstance(key, tuple) else (key,)
+
+            # integer keys select one value or a row / plane of it, only that much is created
+            if len(index) <= len(SECTION_SHAPE) and all(
+                isinstance(i, (int, numpy.integer)) and not isinstance(i, bool) and -n <= i < n
+                for i, n in zip(index, SECTION_SHAPE)
+            ):
+                if len(index) == len(SECTION_SHAPE):
+                    return self.value
+
+                return numpy.full(SECTION_SHAPE[len(index) :], self.value, numpy.int32)
+
+            # a full array, so the result is writable like in the other modes
+            return numpy.full(SECTION_SHAPE, self.value, numpy.int32)[key]
+
+        if self.palette is None:
+            return self.data[key]
+
+        return self.palette[self.data[key]]
+
+    def __setitem__(self, key, value) -> None:
+        value = numpy.asarray(value)
+        values, indices = numpy.unique(value, return_inverse=True)
+
+        if self.data is None:  # single value mode
+            if len(values) == 1 and values[0] == self.value:
+                return
+
+            self._set_palette((self.value,))
+            self.data = numpy.zeros(SECTION_SHAPE, numpy.uint8)
+
+        if self.palette is not None:  # indirect mode
+            new = [int(v) for v in values if int(v) not in self._lookup]
+
+            if len(self.palette) + len(new) <= 256:
+                if new:
+                    self._set_palette((*self.palette, *new))
+
+                lookup = numpy.array([self._lookup[int(v)] for v in values], numpy.uint8)
+                self.data[key] = lookup[indices].reshape(value.shape)
+
+                return
+
+            # too many different values for the palette, switch to direct mode
+            self.data = self.palette[self.data].astype(
+                self._direct_dtype(max(int(self.palette.max()), int(values[-1])))
+            )
+            self.palette = self._lookup = None
+
+        if values[-1] > 0xFFFF and self.data.dtype != numpy.int32:
+            self.data = self.data.astype(numpy.int32)
+
+        self.data[key] = value
+
+
+class NibbleArray:
+    """A 16x16x16 array of 4 bit values (like light levels), stored packed two values per byte.
+
+    Arrays where every value is the same, like the sky light in the open or the block light
+    underground, aren't stored at all. The packed layout is the same as the protocol and the
+    region format use, so the array can be sent and saved without repacking it. Reads and writes
+    go through an unpacked copy of the values, which is only packed again once the packed values
+    are needed, so changing light block by block doesn't repack the whole array every time.
+
+    :param int value: The value everything in the array starts out as.
+    :ivar int value: The value of everything in the array, if data is None.
+    :ivar numpy.ndarray data: The packed values, 2048 bytes, see packed.
+    """
+
+    def __init__(self, value: int = 0) -> None:
+        self.value = value
+        self.data = None
+
+        self._unpacked = None  # the values as a (16, 16, 16) uint8 array, see _unpack
+        self._changed = False  # whether _unpacked was written to since it was last packed
+
+    def __repr__(self) -> str:
+        self._pack()
+        return f"NibbleArray(value={self.value})" if self.data is None else "NibbleArray()"
+
+    def __getstate__(self) -> dict:  # the unpacked copy is cheap to recreate
+        self._pack()
+        return {**self.__dict__, "_unpacked": None}
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.data, self._unpacked) if a is not None)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> NibbleArray:
+        """Creates a NibbleArray from 2048 bytes of packed values, like a BlockLight tag."""
+
+        data = numpy.frombuffer(data, numpy.uint8)
+        first = int(data[0])
+
+        # a uniform array is made of bytes which each hold the same value twice
+        if first & 0x0F == first >> 4 and (data == first).all():
+            return cls(first & 0x0F)
+
+        array = cls()
+        array.data = data.copy()
+
+        return array
+
+    def _unpack(self) -> numpy.ndarray:
+        if self._unpacked is None:
+            if self.data is None:
+                self._unpacked = numpy.full(SECTION_SHAPE, self.value, numpy.uint8)
+            else:
+                self._unpacked = unpack_nibbles(self.data).reshape(SECTION_SHAPE)
+
+        return self._unpacked
+
+    def _pack(self) -> None:
+        """Packs the unpacked copy if it changed, and drops it until it's needed again."""
+
+        if self._changed:
+            array = self._unpacked
+            first = array.flat[0]
+
+            if (array == first).all():
+                self.value = int(first)
+                self.data = None
+            else:
+                self.data = numpy.frombuffer(pack_nibbles(array), numpy.uint8).copy()
+
+            self._changed = False
+
+        self._unpacked = None
+
+    def any(self) -> bool:
+        """Whether any of the values aren't 0."""
+
+        if self._changed:
+            return bool(self._unpacked.any())
+
+        return self.value != 0 if self.data is None else bool(self.data.any())
+
+    def packed(self) -> bytes:
+        """Returns the values packed two per byte, the first of each pair goes in the low nibble."""
+
+        self._pack()
+
+        if self.data is None:
+            return bytes((self.value | self.value << 4,)) * 2048
+
+        return self.data.tobytes()
+
+    def array(self) -> numpy.ndarray:
+        """Returns the whole array as a regular uint8 numpy array."""
+
+        return self._unpack().copy()
+
+    def __array__(self, dtype=None, copy=None) -> numpy.ndarray:
+        array = self.array()
+        return array if dtype is None else array.astype(dtype)
+
+    def __getitem__(self, key) -> object:
+        value = self._unpack()[key]
+
+        # copied, so changing the result can't change the array without going through __setitem__
+        return value.copy() if isinstance(value, numpy.ndarray) else value
+
+    def __setitem__(self, key, value) -> None:
+        self._unpack()[key] = value
+        self._changed = True
+
 
 class ChunkSection:
     """Represents a 16x16x16 area of chunks"""
@@ -35,9 +321,37 @@ class ChunkSection:
         self.block_light = None
         self.sky_light = None
 
+        self.version = 0  # incremented when the blocks or light change, used to invalidate caches
+        self.dirty = False  # whether the section changed since it was loaded / saved
+        self.packed_blocks = None  # (version, bytes) of the section packed for PlayChunkData
+
     def __repr__(self):
         return f"ChunkSection(y={self.y})"
 
+    def __getstate__(self) -> dict:  # cached packets aren't worth pickling
+        return {**self.__dict__, "packed_blocks": None}
+
+    @property
+    def nbytes(self) -> int:
+        """Roughly how much memory the section's blocks, light, and cached packed data use."""
+
+        arrays = (self.block_states, self.block_light, self.sky_light)
+        size = sum(a.nbytes for a in arrays if a is not None)
+
+        if isinstance(self.palette, IndirectPalette):
+            size += self.palette.global_ids.nbytes
+
+        if self.packed_blocks is not None:
+            size += len(self.packed_blocks[1])
+
+        return size
+
+    def mark_changed(self) -> None:
+        """Should be called after block_states, block_light, or sky_light are modified."""
+
+        self.version += 1
+        self.dirty = True
+
     def __getitem__(self, coords):
         return (
             (None if self.block_states is None else self.block_states[coords]),
@@ -55,79 +369,75 @@ class ChunkSection:
     def new(cls, *args, **kwargs):
         section = cls(*args, **kwargs)
 
-        #                                     y   z   x
-        section.block_states = numpy.zeros((16, 16, 16), numpy.int32)
-        section.block_light = numpy.zeros((16, 16, 16), numpy.int16)
-        section.sky_light = numpy.zeros((16, 16, 16), numpy.int16)
+        section.block_states = PalettedArray(0)
+        section.block_light = NibbleArray(0)
+        section.sky_light = NibbleArray(0)
 
         return section
 
     @classmethod
-    def from_nbt(cls, tag: nbt.TAG) -> ChunkSection:
+    def from_nbt(cls, tag: nbt.TAG, data_version: int = 2586) -> ChunkSection:
         if tag.get("BlockStates") is not None:
-            # this is a calculation one would use to serialize a chunk section
-            # we need this to solve for bits_per_block as we don't have that
-            # but we *do* have the length of the array from the nbt data
-            # that we read earlier
-            # long_array_len = ((16*16*16)*bits_per_block) / 64
-            # this simplifies to 64*bits_per_block which is easy to solve
-            # for bits_per_block so we get the below
-            bits_per_block = len(tag["BlockStates"]) // 64  # probably 4
-
-            individual_value_mask = (1 << bits_per_block) - 1
-
             if tag.get("Palette") is None:
                 palette = DirectPalette
+                bits_per_block = DirectPalette.get_bits_per_block()
             else:
+                # the array's length can't be used here, as 11 and 12 bits per block both
+                # make arrays of the same length
+                bits_per_block = max(4, (len(tag["Palette"]) - 1).bit_length())
                 palette = IndirectPalette.from_nbt(tag["Palette"], bits_per_block)
 
             section = cls(tag["Y"].data, palette)
 
-            section.block_states = numpy.ndarray((16, 16, 16), numpy.int32)
-
-            # yoinked most of the logic for chunk deserialization from https://wiki.vg/Chunk_Format
-            # however, that is for deserialization of a chunk packet, not the nbt data so it's a bit
-            # different but most of the logic still applies and this is needed for that
-            state_bytes = b"".join([struct.pack(">q", n) for n in tag["BlockStates"]])
-
-            # populate block_states array
-            for y in range(16):
-                for z in range(16):
-                    for x in range(16):
-                        block_num = (((y * 16) + z) * 16) + x
-                        start_long = (block_num * bits_per_block) // 64
-                        start_offset = (block_num * bits_per_block) % 64
-                        end_long = ((block_num + 1) * bits_per_block - 1) // 64
-
-                        if start_long == end_long:
-                            data = state_bytes[start_long] >> start_offset
-                        else:
-                            data = state_bytes[start_long] >> start_offset | state_bytes[
-                                end_long
-                            ] << (64 - start_offset)
-
-                        section.block_states[y, z, x] = data & individual_value_mask
+            # before 20w17a (data version 2529) block states were packed across long boundaries
+            section.block_states = PalettedArray.from_array(
+                unpack_long_array(tag["BlockStates"], bits_per_block, 4096, data_version < 2529)
+            )
         else:
-            section = cls(tag["Y"], None)
+            section = cls(tag["Y"].data, None)
 
         # the light arrays (SkyLight and BlockLight) are byte arrays (8 bits), and four bits are used per block
 
         if tag.get("BlockLight") is None:
             section.block_light = None
         else:
-            section.block_light = numpy.asarray(
-                [n for n in ((b & 0x0F, b >> 4 & 0x0F) for b in tag["BlockLight"])], numpy.int16
-            ).reshape(16, 16, 16)
+            section.block_light = NibbleArray.from_bytes(tag["BlockLight"])
 
         if tag.get("SkyLight") is None:
             section.sky_light = None
         else:
-            section.sky_light = numpy.asarray(
-                [n for n in ((b & 0x0F, b >> 4 & 0x0F) for b in tag["SkyLight"])], numpy.int16
-            ).reshape(16, 16, 16)
+            section.sky_light = NibbleArray.from_bytes(tag["SkyLight"])
 
         return section
 
+    def to_nbt(self, data_version: int = 2586) -> nbt.TAG_Compound:
+        """Creates the section's tag for a region file, the reverse of from_nbt."""
+
+        tag = nbt.TAG_Compound(None, [nbt.TAG_Byte("Y", self.y)])
+
+        if self.block_states is not None:
+            # region files always store a palette of just the blocks in the section
+            ids, states = numpy.unique(self.block_states.array(), return_inverse=True)
+            bits_per_block = max(4, (len(ids) - 1).bit_length())
+
+            if isinstance(self.palette, IndirectPalette):  # keeps the blocks it doesn't know
+                tag["Palette"] = self.palette.to_nbt(ids)
+            else:  # the states are already global ids
+                tag["Palette"] = IndirectPalette(ids, bits_per_block).to_nbt()
+
+            tag["BlockStates"] = nbt.TAG_Long_Array(
+                "BlockStates",
+                pack_long_array(states, bits_per_block, data_version < 2529).view(numpy.int64),
+            )
+
+        if self.block_light is not None:
+            tag["BlockLight"] = nbt.TAG_Byte_Array("BlockLight", self.block_light.packed())
+
+        if self.sky_light is not None:
+            tag["SkyLight"] = nbt.TAG_Byte_Array("SkyLight", self.sky_light.packed())
+
+        return tag
+
 
 class Chunk:
     def __init__(self, tag: nbt.TAG_Compound, timestamp: int) -> None:
@@ -139,10 +449,18 @@ class Chunk:
 
         self.timestamp = timestamp
 
+        self.version = 0  # incremented when chunk data like biomes change, see full_version
+        self._dirty = False
+
         self.sections = {}  # indexes go below 0 so a dict it is
 
+        self._encoded = {}  # encoded data (like packets) for the chunk, see the encoded property
+        self._encoded_version = None
+
         for section_tag in self.data["Sections"]:
-            self.sections[section_tag["Y"].data] = ChunkSection.from_nbt(section_tag)
+            self.sections[section_tag["Y"].data] = ChunkSection.from_nbt(
+                section_tag, self.data_version
+            )
 
         # delete data which are stored as attributes of this class
         del self.data["Sections"]  # stored in .sections
@@ -152,6 +470,102 @@ class Chunk:
     def __repr__(self):
         return f"Chunk(x={self.x}, z={self.z})"
 
+    def __getstate__(self) -> dict:  # encoded data is cheap to recreate compared to sending it
+        return {**self.__dict__, "_encoded": {}, "_encoded_version": None}
+
+    @property
+    def nbytes(self) -> int:
+        """Roughly how much memory the chunk's data, sections, and cached encoded data use."""
+
+        size = tag_nbytes(self.data) + sum(section.nbytes for section in self.sections.values())
+
+        return size + self._encoded_size()
+
+    @property
+    def encoded_nbytes(self) -> int:
+        """How much memory the cached encoded data, including the sections' packed blocks, uses.
+
+        Unlike the rest of nbytes, this changes without the chunk changing as packets are cached.
+        """
+
+        sections = self.sections.values()
+        size = sum(len(s.packed_blocks[1]) for s in sections if s.packed_blocks is not None)
+
+        return size + self._encoded_size()
+
+    def _encoded_size(self) -> int:
+        size = 0
+
+        for value in self._encoded.values():
+            for data in value.values() if isinstance(value, dict) else (value,):
+                if isinstance(data, (bytes, bytearray, memoryview)):
+                    size += len(data)
+
+        return size
+
+    @property
+    def full_version(self) -> tuple:
+        """Changes whenever the chunk or any of its sections change."""
+
+        return (self.version, *((y, s.version) for y, s in self.sections.items()))
+
+    @property
+    def dirty(self) -> bool:
+        """Whether the chunk or any of its sections changed since it was loaded / saved."""
+
+        return self._dirty or any(s.dirty for s in self.sections.values())
+
+    @property
+    def encoded(self) -> dict:
+        """A cache for encoded data of the chunk, it's emptied whenever the chunk changes."""
+
+        full_version = self.full_version
+
+        if self._encoded_version != full_version:
+            self._encoded = {}
+            self._encoded_version = full_version
+
+        return self._encoded
+
+    def mark_changed(self) -> None:
+        """Should be called after chunk data, like the biomes or heightmaps, is modified."""
+
+        self.version += 1
+        self._dirty = True
+
+    def mark_saved(self, full_version: tuple) -> None:
+        """Clears the dirty flags, except for parts which changed since full_version was taken."""
+
+        if full_version[0] == self.version:
+            self._dirty = False
+
+        section_versions = dict(full_version[1:])
+
+        for y, section in self.sections.items():
+            if section_versions.get(y) == section.version:
+                section.dirty = False
+
+    def to_nbt(self) -> nbt.TAG_Compound:
+        """Creates the chunk's tag for a region file, the reverse of __init__."""
+
+        sections = [self.sections[y].to_nbt(self.data_version) for y in sorted(self.sections)]
+
+        return nbt.TAG_Compound(
+            "",
+            [
+                nbt.TAG_Int("DataVersion", self.data_version),
+                nbt.TAG_Compound(
+                    "Level",
+                    [
+                        *self.data.values(),
+                        nbt.TAG_Int("xPos", self.x),
+                        nbt.TAG_Int("zPos", self.z),
+                        nbt.TAG_List("Sections", sections),
+                    ],
+                ),
+            ],
+        )
+
     def __getitem__(self, key):
         if isinstance(key, str):
             return self.data[key]
@@ -164,9 +578,6 @@ class Chunk:
         else:
             self.sections[key] = value
 
-    def __del__(self):
-        pass  # should dump the chunk to the disk in the future, or perhaps have an explicit save() method?
-
     def get(self, key, default=None):
         try:
             return self[key]
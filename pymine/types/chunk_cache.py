@@ -0,0 +1,179 @@
+# A flexible and fast Minecraft server software written completely in Python.
+# Copyright (C) 2021 PyMine
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from collections import OrderedDict, Counter
+
+from pymine.types.chunk import Chunk
+
+
+class ChunkCache:
+    """The loaded chunks of a world.
+
+    Tickets pin chunks, like the ones in view of a player, pinned chunks are never evicted. The
+    rest are evicted least recently used first, once the cache holds more than max_chunks chunks
+    or more than max_bytes bytes. Pinned chunks count towards those limits too, but the cache
+    grows past them instead of evicting pinned chunks, so it scales with the amount of players.
+
+    :param int max_chunks: The max amount of chunks to keep loaded.
+    :param int max_bytes: The max amount of memory the chunks should take up, see Chunk.nbytes.
+    :ivar int hits: The amount of lookups which found the chunk in the cache.
+    :ivar int misses: The amount of lookups which didn't.
+    :ivar int evictions: The amount of chunks evicted from the cache.
+    :ivar int resident_bytes: Roughly how much memory the cached chunks take up.
+    """
+
+    def __init__(self, max_chunks: int, max_bytes: int) -> None:
+        self.max_chunks = max_chunks
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.resident_bytes = 0
+
+        self._pinned = {}  # {chunk coords: chunk}
+        self._unpinned = OrderedDict()  # {chunk coords: chunk}, least recently used first
+        # {chunk coords: (Chunk.nbytes, Chunk.full_version, Chunk.encoded_nbytes) when measured}
+        self._sizes = {}
+
+        self._tickets = {}  # {owner: set of chunk coords}
+        self._pins = Counter()  # {chunk coords: amount of tickets which include it}
+
+    def __len__(self) -> int:
+        return len(self._pinned) + len(self._unpinned)
+
+    def __contains__(self, key: tuple) -> bool:
+        return key in self._pinned or key in self._unpinned
+
+    def values(self) -> list:
+        return [*self._pinned.values(), *self._unpinned.values()]
+
+    def stats(self) -> dict:
+        return {
+            "chunks": len(self),
+            "pinned": len(self._pinned),
+            "tickets": len(self._tickets),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "resident_bytes": self.resident_bytes,
+        }
+
+    def _measure(self, key: tuple, chunk: Chunk, new: bool = False) -> None:
+        # measuring the whole chunk walks its Level data, so that's only done when it's cached or
+        # after it changed, otherwise only the cached encoded data can have grown or been replaced
+        full_version, encoded = chunk.full_version, chunk.encoded_nbytes
+        old = self._sizes.get(key)
+
+        if new or old is None or old[1] != full_version:
+            size = chunk.nbytes
+        elif old[2] != encoded:
+            size = old[0] + encoded - old[2]
+        else:
+            return
+
+        self.resident_bytes += size - (0 if old is None else old[0])
+        self._sizes[key] = size, full_version, encoded
+
+    def get(self, key: tuple) -> Chunk:
+        """Returns the cached chunk, or None if it isn't cached."""
+
+        chunk = self._pinned.get(key)
+
+        if chunk is None:
+            chunk = self._unpinned.get(key)
+
+            if chunk is None:
+                self.misses += 1
+                return None
+
+            self._unpinned.move_to_end(key)
+
+        self.hits += 1
+        self._measure(key, chunk)  # cached packets may have been added since it was cached
+
+        return chunk
+
+    def put(self, key: tuple, chunk: Chunk) -> list:
+        """Caches a chunk, returns the chunks which were evicted to make room as (coords, Chunk)."""
+
+        if key in self._pins:
+            self._pinned[key] = chunk
+        else:
+            self._unpinned[key] = chunk
+            self._unpinned.move_to_end(key)
+
+        self._measure(key, chunk, True)
+
+        return self.evict()
+
+    def evict(self) -> list:
+        """Evicts unpinned chunks until the cache is within its limits, returns (coords, Chunk)."""
+
+        evicted = []
+
+        while self._unpinned and (
+            len(self) > self.max_chunks or self.resident_bytes > self.max_bytes
+        ):
+            key, chunk = self._unpinned.popitem(False)
+            self.resident_bytes -= self._sizes.pop(key, (0,))[0]
+
+            evicted.append((key, chunk))
+
+        self.evictions += len(evicted)
+
+        return evicted
+
+    def set_ticket(self, owner: object, chunk_coords: object) -> list:
+        """Pins the chunks at chunk_coords for owner (like a player), replacing its previous ticket.
+
+        Chunks which are no longer pinned by any ticket can be evicted again, those evicted right
+        away are returned as (coords, Chunk).
+        """
+
+        new = set(chunk_coords)
+        old = self._tickets.get(owner, set())
+
+        if new:
+            self._tickets[owner] = new
+        else:
+            self._tickets.pop(owner, None)
+
+        for key in new - old:
+            self._pins[key] += 1
+
+            chunk = self._unpinned.pop(key, None)
+
+            if chunk is not None:
+                self._pinned[key] = chunk
+
+        for key in old - new:
+            self._pins[key] -= 1
+
+            if self._pins[key] == 0:
+                del self._pins[key]
+
+                chunk = self._pinned.pop(key, None)
+
+                if chunk is not None:  # it was in use very recently, so it goes at the end
+                    self._unpinned[key] = chunk
+
+        return self.evict()
+
+    def remove_ticket(self, owner: object) -> list:
+        """Removes owner's ticket, returns the chunks which were evicted because of it."""
+
+        return self.set_ticket(owner, ())
@@ -18,7 +18,11 @@ from __future__ import annotations
 
 from mutf8 import encode_modified_utf8, decode_modified_utf8
 import struct
+import numpy
 import gzip
+import zlib
+import sys
+import re
 
 __all__ = (
     "TAG",
@@ -35,26 +39,139 @@ __all__ = (
     "TAG_Compound",
     "TAG_Int_Array",
     "TAG_Long_Array",
+    "TAG_Lazy",
     "TYPES",
     "unpack",
+    "pack",
+    "from_plain",
+    "from_snbt",
+    "to_snbt",
 )
 
 TYPES = []
+READERS = []  # the reader of each tag's data, indexed by the tag's id, see read_string
+WRITERS = []  # the writer of each tag's data, indexed by the tag's id, see write_string
+
+
+def unpack(
+    buf, root_is_full: bool = True, lazy: bool = False, paths: list = None, plain: bool = False
+) -> TAG_Compound:
+    """Unpacks a compound tag from the buffer, it may be gzipped.
+
+    :param Buffer buf: The buffer to read from.
+    :param bool root_is_full: Whether the root tag has a type ID and name (it does in files).
+    :param bool lazy: Parse lists, compounds, and int / long arrays only once they're accessed
+        (see TAG_Lazy), which saves time and memory when most of the data isn't used.
+    :param list paths: Only parse these paths, like ["Level/Sections", "Level/xPos"], everything
+        else is skipped over, without creating tags for it.
+    :param bool plain: Return (value, schema) instead, where value is made of dicts, lists, and
+        plain values instead of tags, and schema holds the types to pack it again, see from_plain.
+    """
 
+    if buf.buf[buf.pos : buf.pos + 2] == b"\x1f\x8b":  # gzip's magic number
+        try:
+            data = gzip.decompress(buf.buf[buf.pos :])
+            buf.buf = data
+            buf.reset()
+        except BaseException:
+            pass
 
-def unpack(buf, root_is_full: bool = True) -> TAG_Compound:
-    try:
-        data = gzip.decompress(buf.buf[buf.pos :])
-        buf.buf = data
-        buf.reset()
-    except BaseException:
-        pass
+    name = None
 
     if root_is_full:
         buf.read(1)
-        return TAG_Compound(TAG.unpack_name(buf), TAG_Compound.unpack_data(buf))
+        name = TAG.unpack_name(buf)
+
+    if plain:
+        value, schema, buf.pos = read_plain(buf.buf, buf.pos, TAG_Compound.id)
+        return value, schema
+
+    if paths is not None:
+        data, buf.pos = read_compound_paths(buf.buf, buf.pos, path_tree(paths))
+    elif lazy:
+        data, buf.pos = read_compound_lazy(buf.buf, buf.pos)
+    else:
+        data = TAG_Compound.unpack_data(buf)
+
+    return TAG_Compound(name, data)
+
+
+def pack(tag: TAG, compression: str = None, file: object = None) -> bytes:
+    """Packs a tag with its type ID and name (like the root tag of a file) into a single buffer.
+
+    :param TAG tag: The tag to pack.
+    :param str compression: Either "gzip" (like level.dat and playerdata files) or "zlib" (like
+        region files), the data is compressed while it's packed instead of afterwards.
+    :param file: A binary file to write the packed data to as it's packed, None is returned then.
+    """
+
+    out = Writer(compression, file)
+
+    if tag.id == TAG_End.id:
+        out.append(0)
+    else:
+        out.append(tag.id)
+        write_string(out, tag.name)
+        write_data(out, tag)
+
+    return out.finish()
+
+
+class Writer(bytearray):
+    """A growable buffer tags are packed into, see pack.
+
+    When the data is compressed or written to a file, it's flushed every flush_size bytes, so the
+    uncompressed data is never held in memory all at once.
+
+    :param str compression: None, "gzip", or "zlib".
+    :param file: A binary file to write the flushed data to, instead of returning it from finish.
+    :param int flush_size: How much uncompressed data to buffer before flushing it.
+    :ivar int limit: The size at which the buffer is flushed, see write_compound.
+    """
+
+    def __init__(self, compression: str = None, file: object = None, flush_size: int = 65536):
+        super().__init__()
+
+        if compression is None:
+            self.compressor = None
+        elif compression == "gzip":
+            self.compressor = zlib.compressobj(wbits=31)  # 31 = gzip header and trailer
+        elif compression == "zlib":
+            self.compressor = zlib.compressobj()
+        else:
+            raise ValueError(f"Unsupported compression: {compression}")
+
+        self.file = file
+        self.flushed = []
+
+        if self.compressor is None and file is None:  # nothing to do with the data until the end
+            self.limit = sys.maxsize
+        else:
+            self.limit = flush_size
+
+    def flush(self) -> None:
+        data = bytes(self) if self.compressor is None else self.compressor.compress(self)
+        del self[:]
+
+        if self.file is None:
+            self.flushed.append(data)
+        elif data:
+            self.file.write(data)
+
+    def finish(self) -> bytes:
+        if self.limit == sys.maxsize:
+            return bytes(self)
 
-    return TAG_Compound(None, TAG_Compound.unpack_data(buf))
+        self.flush()
+
+        if self.compressor is not None:
+            self.flushed.append(self.compressor.flush())
+
+            if self.file is not None:
+                self.file.write(self.flushed.pop())
+
+        if self.file is None:
+            return b"".join(self.flushed)
 
 
 class BufferUtil:
@@ -80,10 +197,11 @@ class TAG:
     :ivar name
     """
 
+    __slots__ = ()  # each kind of tag has its own, tags based on list / dict can't inherit any
+
     id = None
 
     def __init__(self, name: str = None) -> None:
-        self.id = self.__class__.id
         self.name = "" if name is None else name
 
     def pack_id(self) -> bytes:
@@ -99,17 +217,27 @@ class TAG:
 
     @staticmethod
     def unpack_name(buf) -> str:
-        return decode_modified_utf8(buf.read(buf.unpack("H")))
+        name, buf.pos = read_string(buf.buf, buf.pos)
+        return name
 
     def pack_data(self) -> bytes:
-        raise NotImplementedError(self.__class__.__name__)
+        if self.id is None:
+            raise NotImplementedError(self.__class__.__name__)
+
+        out = Writer()
+        write_data(out, self)
+        return bytes(out)
 
     @classmethod
-    def unpack_data(cls, buf) -> NotImplemented:
-        raise NotImplementedError(cls.__name__)
+    def unpack_data(cls, buf) -> object:
+        if cls.id is None:
+            raise NotImplementedError(cls.__name__)
+
+        data, buf.pos = READERS[cls.id](buf.buf, buf.pos)
+        return data
 
     def pack(self) -> bytes:
-        return self.pack_id() + self.pack_name() + self.pack_data()
+        return pack(self)
 
     @classmethod
     def unpack(cls, buf) -> TAG:
@@ -126,6 +254,8 @@ class TAG:
 
 
 class TAG_End(TAG):
+    __slots__ = ("name",)
+
     id = 0
 
     def __init__(self, *args) -> None:
@@ -138,13 +268,6 @@ class TAG_End(TAG):
     def unpack_name(buf) -> None:
         return None
 
-    def pack_data(self) -> bytes:
-        return b""
-
-    @staticmethod
-    def unpack_data(buf) -> None:
-        pass
-
     def pretty(self, indent: int = 0) -> str:
         return ("    " * indent) + "TAG_End(): 0"
 
@@ -157,6 +280,8 @@ class TAG_Byte(TAG):
     :int id: The type ID of the TAG.
     """
 
+    __slots__ = ("name", "data")
+
     id = 1
 
     def __init__(self, name: str, data: int) -> None:
@@ -164,13 +289,6 @@ class TAG_Byte(TAG):
 
         self.data = data
 
-    def pack_data(self) -> bytes:
-        return BufferUtil.pack("b", self.data)
-
-    @staticmethod
-    def unpack_data(buf) -> int:
-        return buf.unpack("b")
-
 
 class TAG_Short(TAG):
     """Used to represent a TAG_Short, stores a single short (2 byte int).
@@ -180,6 +298,8 @@ class TAG_Short(TAG):
     :int id: The type ID of the TAG.
     """
 
+    __slots__ = ("name", "data")
+
     id = 2
 
     def __init__(self, name: str, data: int) -> None:
@@ -187,13 +307,6 @@ class TAG_Short(TAG):
 
         self.data = data
 
-    def pack_data(self) -> bytes:
-        return BufferUtil.pack("h", self.data)
-
-    @staticmethod
-    def unpack_data(buf) -> int:
-        return buf.unpack("h")
-
 
 class TAG_Int(TAG):
     """Used to represent a TAG_Int, stores an integer (4 bytes).
@@ -203,6 +316,8 @@ class TAG_Int(TAG):
     :int id: The type ID of the TAG.
     """
 
+    __slots__ = ("name", "data")
+
     id = 3
 
     def __init__(self, name: str, data: int) -> None:
@@ -210,13 +325,6 @@ class TAG_Int(TAG):
 
         self.data = data
 
-    def pack_data(self) -> bytes:
-        return BufferUtil.pack("i", self.data)
-
-    @staticmethod
-    def unpack_data(buf) -> int:
-        return buf.unpack("i")
-
 
 class TAG_Long(TAG):
     """Used to represent a TAG_Long, stores a long long (8 byte int).
@@ -226,6 +334,8 @@ class TAG_Long(TAG):
     :int id: The type ID of the TAG.
     """
 
+    __slots__ = ("name", "data")
+
     id = 4
 
     def __init__(self, name: str, data: int) -> None:
@@ -233,13 +343,6 @@ class TAG_Long(TAG):
 
         self.data = data
 
-    def pack_data(self) -> bytes:
-        return BufferUtil.pack("q", self.data)
-
-    @staticmethod
-    def unpack_data(buf) -> int:
-        return buf.unpack("q")
-
 
 class TAG_Float(TAG):
     """Used to represent a TAG_Float, stores a float (4 bytes).
@@ -249,6 +352,8 @@ class TAG_Float(TAG):
     :int id: The type ID of the TAG.
     """
 
+    __slots__ = ("name", "data")
+
     id = 5
 
     def __init__(self, name: str, data: float) -> None:
@@ -256,13 +361,6 @@ class TAG_Float(TAG):
 
         self.data = data
 
-    def pack_data(self) -> bytes:
-        return BufferUtil.pack("f", self.data)
-
-    @staticmethod
-    def unpack_data(buf) -> float:
-        return buf.unpack("f")
-
 
 class TAG_Double(TAG):
     """Used to represent a TAG_Double, stores a double (8 byte float).
@@ -272,6 +370,8 @@ class TAG_Double(TAG):
     :int id: The type ID of the TAG.
     """
 
+    __slots__ = ("name", "data")
+
     id = 6
 
     def __init__(self, name: str, data: float) -> None:
@@ -279,13 +379,6 @@ class TAG_Double(TAG):
 
         self.data = data
 
-    def pack_data(self) -> bytes:
-        return BufferUtil.pack("d", self.data)
-
-    @staticmethod
-    def unpack_data(buf) -> float:
-        return buf.unpack("d")
-
 
 class TAG_Byte_Array(TAG, bytearray):
     """Used to represent a TAG_Byte_Array, stores an array of bytes.
@@ -295,6 +388,8 @@ class TAG_Byte_Array(TAG, bytearray):
     :int id: The type ID of the TAG.
     """
 
+    __slots__ = ("name",)
+
     id = 7
 
     def __init__(self, name: str, data: bytearray) -> None:
@@ -306,12 +401,8 @@ class TAG_Byte_Array(TAG, bytearray):
 
         bytearray.__init__(self, data)
 
-    def pack_data(self) -> bytes:
-        return BufferUtil.pack("i", len(self)) + bytes(self)
-
-    @staticmethod
-    def unpack_data(buf) -> bytearray:
-        return bytearray(buf.read(buf.unpack("i")))
+    def __reduce_ex__(self, protocol: int) -> tuple:  # bytearray's doesn't pass the name
+        return self.__class__, (self.name, bytes(self))
 
     def pretty(self, indent: int = 0) -> str:
         return f'{" " * 4 * indent}TAG_Byte_Array("{self.name}"): [{", ".join([str(v) for v in self])}]'
@@ -325,6 +416,8 @@ class TAG_String(TAG):
     :int id: The type ID of the TAG.
     """
 
+    __slots__ = ("name", "data")
+
     id = 8
 
     def __init__(self, name: str, data: str) -> None:
@@ -332,14 +425,6 @@ class TAG_String(TAG):
 
         self.data = data
 
-    def pack_data(self) -> bytes:
-        mutf8_text = encode_modified_utf8(self.data)
-        return BufferUtil.pack("H", len(mutf8_text)) + mutf8_text
-
-    @staticmethod
-    def unpack_data(buf) -> str:
-        return decode_modified_utf8(buf.read(buf.unpack("H")))
-
     def pretty(self, indent: int = 0) -> str:
         return f'{" " * 4 * indent}{self.__class__.__name__}("{self.name}"): {self.data}'
 
@@ -352,34 +437,14 @@ class TAG_List(TAG, list):
     :int id: The type ID of the TAG.
     """
 
+    __slots__ = ("name",)
+
     id = 9
 
     def __init__(self, name: str, data: list) -> None:
         TAG.__init__(self, name)
         list.__init__(self, data)
 
-    def pack_data(self) -> bytes:
-        if len(self) > 0:
-            return (
-                BufferUtil.pack("b", self[0].id)
-                + BufferUtil.pack("i", len(self))
-                + b"".join([t.pack_data() for t in self])
-            )
-
-        return BufferUtil.pack("b", 0) + BufferUtil.pack("i", 0)
-
-    @staticmethod
-    def unpack_data(buf) -> list:
-        tag = TYPES[buf.unpack("b")]
-        length = buf.unpack("i")
-
-        out = []
-
-        for _ in range(length):
-            out.append(tag(None, tag.unpack_data(buf)))
-
-        return out
-
     def pretty(self, indent: int = 0) -> str:
         tab = " " * 4 * indent
         nl = ",\n"
@@ -395,6 +460,8 @@ class TAG_Compound(TAG, dict):
     :int id: The type ID of the TAG.
     """
 
+    __slots__ = ("name",)
+
     id = 10
 
     def __init__(self, name: str, data: list) -> None:
@@ -405,6 +472,21 @@ class TAG_Compound(TAG, dict):
     def data(self):
         return self.values()
 
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+
+        if value.__class__ is TAG_Lazy:  # parse it now that it's needed, see unpack
+            value = value.load()
+            dict.__setitem__(self, key, value)
+
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
     def __setitem__(self, key, value):
         value.name = key
         dict.__setitem__(self, key, value)
@@ -415,84 +497,117 @@ class TAG_Compound(TAG, dict):
         for k, v in self.items():
             v.name = k
 
-    def pack_data(self) -> bytes:
-        return b"".join([tag.pack() for tag in self.values()]) + b"\x00"
+    def pretty(self, indent: int = 0) -> str:
+        tab = " " * 4 * indent
+        nl = ",\n"
 
-    @staticmethod
-    def unpack_data(buf) -> list:
-        out = []
+        return f'{tab}TAG_Compound("{self.name}"): [\n{nl.join([t.pretty(indent + 1) for t in self.values()])}\n{tab}]'
 
-        while True:
-            tag = TYPES[buf.unpack("b")]
 
-            if tag is TAG_End:
-                break
+class TAG_Array(TAG):
+    """Base class for TAG_Int_Array and TAG_Long_Array, they're backed by numpy arrays.
 
-            out.append(tag(tag.unpack_name(buf), tag.unpack_data(buf)))
+    :param str name: The name of the TAG.
+    :param object data: The numbers, a list or anything else numpy can make an array of.
+    :ivar numpy.ndarray data: The numbers, with the dtype of the kind of tag.
+    """
 
-        return out
+    __slots__ = ("name", "data")
 
-    def pretty(self, indent: int = 0) -> str:
-        tab = " " * 4 * indent
-        nl = ",\n"
+    dtype = None
 
-        return f'{tab}TAG_Compound("{self.name}"): [\n{nl.join([t.pretty(indent + 1) for t in self.values()])}\n{tab}]'
+    def __init__(self, name: str, data: object) -> None:
+        super().__init__(name)
+
+        # always copied, arrays from unpack would otherwise reference the whole buffer
+        self.data = numpy.array(data, self.dtype)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __iter__(self):
+        return iter(self.data.tolist())
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+
+    def __eq__(self, other: object) -> bool:  # compared by value, like the lists they used to be
+        if isinstance(other, (TAG_Array, list, tuple, numpy.ndarray)):
+            return numpy.array_equal(self.data, numpy.asarray(other))
+
+        return NotImplemented
+
+    __hash__ = None
+
+    def __array__(self, dtype=None, copy=None) -> numpy.ndarray:
+        return self.data.astype(self.data.dtype if dtype is None else dtype, copy=bool(copy))
+
+    def pretty(self, indent: int = 0) -> str:
+        values = ", ".join([str(v) for v in self])
+        return f'{" " * 4 * indent}{self.__class__.__name__}("{self.name}"): [{values}]'
 
 
-class TAG_Int_Array(TAG, list):
-    """Represents a TAG_Int_Array, a list of ints (4 bytes each).
+class TAG_Int_Array(TAG_Array):
+    """Represents a TAG_Int_Array, an array of ints (4 bytes each).
 
     :param str name: The name of the TAG.
-    :param list data: A list of ints (4 bytes each).
+    :param object data: A list / numpy array of ints (4 bytes each).
     :int id: The type ID of the TAG.
     """
 
+    __slots__ = ()
+
     id = 11
+    dtype = numpy.int32
 
-    def __init__(self, name: str, data: list) -> None:
-        TAG.__init__(self, name)
-        list.__init__(self, data)
 
-    def pack_data(self) -> bytes:
-        return BufferUtil.pack("i", len(self)) + b"".join(
-            [BufferUtil.pack("i", num) for num in self]
-        )
+class TAG_Long_Array(TAG_Array):
+    """Represents a TAG_Long_Array, an array of long longs (8 byte ints).
 
-    @staticmethod
-    def unpack_data(buf) -> list:
-        return [buf.unpack("i") for _ in range(buf.unpack("i"))]
+    :param str name: The name of the TAG.
+    :param object data: A list / numpy array of long longs (8 byte ints).
+    :int id: The type ID of the TAG.
+    """
 
-    def pretty(self, indent: int = 0) -> str:
-        return (
-            f'{" " * 4 * indent}TAG_Int_Array("{self.name}"): [{", ".join([str(v) for v in self])}]'
-        )
+    __slots__ = ()
 
+    id = 12
+    dtype = numpy.int64
+
+
+class TAG_Lazy(TAG):
+    """A tag which hasn't been parsed yet, it's parsed when it's accessed from its compound.
 
-class TAG_Long_Array(TAG, list):
-    """Represents a TAG_Long_Array, a list of long longs (8 byte ints).
+    Lazy tags are packed by copying their original data, so they don't need to be parsed to be
+    saved again. Iterating over a compound's values returns lazy tags as they are.
 
     :param str name: The name of the TAG.
-    :param list value: A list of long longs (8 byte ints).
-    :int id: The type ID of the TAG.
+    :param int tag_id: The type ID of the tag it stands in for.
+    :param bytes payload: The tag's packed data.
     """
 
-    id = 12
+    __slots__ = ("name", "id", "payload")
 
-    def __init__(self, name: str, data: list) -> None:
-        TAG.__init__(self, name)
-        list.__init__(self, data)
+    def __init__(self, name: str, tag_id: int, payload: bytes) -> None:
+        super().__init__(name)
 
-    def pack_data(self) -> bytes:
-        return BufferUtil.pack("i", len(self)) + b"".join(
-            [BufferUtil.pack("q", num) for num in self]
-        )
+        self.id = tag_id
+        self.payload = payload
 
-    @staticmethod
-    def unpack_data(buf) -> list:
-        return [buf.unpack("q") for _ in range(buf.unpack("i"))]
+    def load(self) -> TAG:
+        if self.id == TAG_Compound.id:  # compounds are lazy all the way down
+            return TAG_Compound(self.name, read_compound_lazy(self.payload, 0)[0])
+
+        return TYPES[self.id](self.name, READERS[self.id](self.payload, 0)[0])
+
+    def pack_data(self) -> bytes:
+        return self.payload  # see write_data
 
     def pretty(self, indent: int = 0) -> str:
-        return f'{" " * 4 * indent}TAG_Long_Array("{self.name}"): [{", ".join([str(v) for v in self])}]'
+        return self.load().pretty(indent)
 
 
 TYPES.extend(
@@ -512,3 +627,652 @@ TYPES.extend(
         TAG_Long_Array,
     ]
 )
+
+
+# The readers below decode a tag's data from data (bytes-like) at pos, and return it and the
+# position after it. They're used instead of Buffer methods, as NBT is mostly tiny reads.
+
+_SHORT_LENGTH = struct.Struct(">H")
+_INT_LENGTH = struct.Struct(">i")
+
+
+def read_struct(fmt: str) -> object:
+    s = struct.Struct(fmt)
+    unpack_from = s.unpack_from
+    size = s.size
+
+    def read(data, pos: int) -> tuple:
+        return unpack_from(data, pos)[0], pos + size
+
+    return read
+
+
+def read_end(data, pos: int) -> tuple:
+    return None, pos
+
+
+def read_string(data, pos: int) -> tuple:
+    length = _SHORT_LENGTH.unpack_from(data, pos)[0]
+    end = pos + 2 + length
+    raw = bytes(data[pos + 2 : end])
+
+    try:  # ascii is encoded the same way in modified utf-8, and decoding it is much faster
+        return raw.decode("ascii"), end
+    except UnicodeDecodeError:
+        return decode_modified_utf8(raw), end
+
+
+def read_byte_array(data, pos: int) -> tuple:
+    end = pos + 4 + max(_INT_LENGTH.unpack_from(data, pos)[0], 0)
+    return bytearray(data[pos + 4 : end]), end
+
+
+def read_array(dtype: str) -> object:
+    itemsize = numpy.dtype(dtype).itemsize
+
+    def read(data, pos: int) -> tuple:  # TAG_Array converts the whole array at once
+        length = max(_INT_LENGTH.unpack_from(data, pos)[0], 0)
+        return numpy.frombuffer(data, dtype, length, pos + 4), pos + 4 + length * itemsize
+
+    return read
+
+
+def read_list(data, pos: int) -> tuple:
+    tag_id = data[pos]
+    length = _INT_LENGTH.unpack_from(data, pos + 1)[0]
+    pos += 5
+
+    tag = TYPES[tag_id]
+    read = READERS[tag_id]
+    out = []
+
+    for _ in range(length):
+        value, pos = read(data, pos)
+        out.append(tag(None, value))
+
+    return out, pos
+
+
+def read_compound(data, pos: int) -> tuple:
+    out = []
+
+    while True:
+        tag_id = data[pos]
+
+        if tag_id == 0:  # TAG_End
+            return out, pos + 1
+
+        name, pos = read_string(data, pos + 1)
+        value, pos = READERS[tag_id](data, pos)
+
+        out.append(TYPES[tag_id](name, value))
+
+
+READERS.extend(
+    [
+        read_end,
+        read_struct(">b"),
+        read_struct(">h"),
+        read_struct(">i"),
+        read_struct(">q"),
+        read_struct(">f"),
+        read_struct(">d"),
+        read_byte_array,
+        read_string,
+        read_list,
+        read_compound,
+        read_array(">i4"),
+        read_array(">i8"),
+    ]
+)
+
+
+def write_data(out: Writer, tag: TAG) -> None:
+    if tag.__class__ is TAG_Lazy:  # it's written as it was read
+        out += tag.payload
+    else:
+        WRITERS[tag.id](out, tag)
+
+
+def write_struct(fmt: str) -> object:
+    pack_ = struct.Struct(fmt).pack
+
+    def write(out: Writer, tag: TAG) -> None:
+        out += pack_(tag.data)
+
+    return write
+
+
+def write_end(out: Writer, tag: TAG) -> None:
+    pass
+
+
+def write_string(out: Writer, text: str) -> None:
+    if text.isascii() and "\x00" not in text:  # modified utf-8 only differs for these
+        raw = text.encode("ascii")
+    else:
+        raw = encode_modified_utf8(text)
+
+    out += _SHORT_LENGTH.pack(len(raw))
+    out += raw
+
+
+def write_string_tag(out: Writer, tag: TAG_String) -> None:
+    write_string(out, tag.data)
+
+
+def write_byte_array(out: Writer, tag: TAG_Byte_Array) -> None:
+    out += _INT_LENGTH.pack(len(tag))
+    out += tag
+
+
+def write_array(dtype: str) -> object:
+    def write(
+        out: Writer, tag: TAG
+    ) -> None:  # the whole array is converted and byteswapped at once
+        out += _INT_LENGTH.pack(len(tag))
+        out += numpy.asarray(tag.data, dtype).tobytes()
+
+    return write
+
+
+def write_list(out: Writer, tag: TAG_List) -> None:
+    if len(tag) == 0:
+        out += b"\x00\x00\x00\x00\x00"  # TAG_End and a length of 0
+        return
+
+    tag_id = tag[0].id
+    write = WRITERS[tag_id]
+
+    out.append(tag_id)
+    out += _INT_LENGTH.pack(len(tag))
+
+    for item in tag:
+        write(out, item)
+
+
+def write_compound(out: Writer, tag: TAG_Compound) -> None:
+    for child in tag.values():  # lazy tags aren't loaded by values()
+        out.append(child.id)
+        write_string(out, child.name)
+        write_data(out, child)
+
+        if len(out) >= out.limit:
+            out.flush()
+
+    out.append(0)  # TAG_End
+
+
+WRITERS.extend(
+    [
+        write_end,
+        write_struct(">b"),
+        write_struct(">h"),
+        write_struct(">i"),
+        write_struct(">q"),
+        write_struct(">f"),
+        write_struct(">d"),
+        write_byte_array,
+        write_string_tag,
+        write_list,
+        write_compound,
+        write_array(">i4"),
+        write_array(">i8"),
+    ]
+)
+
+
+def skip_fixed(size: int) -> object:
+    return lambda data, pos: pos + size
+
+
+def skip_string(data, pos: int) -> int:
+    return pos + 2 + _SHORT_LENGTH.unpack_from(data, pos)[0]
+
+
+def skip_array(itemsize: int) -> object:
+    return lambda data, pos: pos + 4 + max(_INT_LENGTH.unpack_from(data, pos)[0], 0) * itemsize
+
+
+def skip_list(data, pos: int) -> int:
+    tag_id = data[pos]
+    length = max(_INT_LENGTH.unpack_from(data, pos + 1)[0], 0)
+    pos += 5
+
+    if tag_id in _SIZES:
+        return pos + length * _SIZES[tag_id]
+
+    skip = SKIPPERS[tag_id]
+
+    for _ in range(length):
+        pos = skip(data, pos)
+
+    return pos
+
+
+def skip_compound(data, pos: int) -> int:
+    while True:
+        tag_id = data[pos]
+
+        if tag_id == 0:
+            return pos + 1
+
+        pos = SKIPPERS[tag_id](data, skip_string(data, pos + 1))
+
+
+_SIZES = {0: 0, 1: 1, 2: 2, 3: 4, 4: 8, 5: 4, 6: 8}  # the sizes of tags with a fixed size
+
+# like READERS, except these only return the position after a tag's data
+SKIPPERS = [
+    skip_fixed(0),
+    skip_fixed(1),
+    skip_fixed(2),
+    skip_fixed(4),
+    skip_fixed(8),
+    skip_fixed(4),
+    skip_fixed(8),
+    skip_array(1),
+    skip_string,
+    skip_list,
+    skip_compound,
+    skip_array(4),
+    skip_array(8),
+]
+
+# lists, compounds, and int / long arrays are expensive to parse, anything else is parsed right away
+_LAZY_IDS = frozenset((9, 10, 11, 12))
+
+
+def read_compound_lazy(data, pos: int) -> tuple:
+    out = []
+
+    while True:
+        tag_id = data[pos]
+
+        if tag_id == 0:
+            return out, pos + 1
+
+        name, pos = read_string(data, pos + 1)
+
+        if tag_id in _LAZY_IDS:
+            end = SKIPPERS[tag_id](data, pos)
+            out.append(TAG_Lazy(name, tag_id, bytes(data[pos:end])))
+            pos = end
+        else:
+            value, pos = READERS[tag_id](data, pos)
+            out.append(TYPES[tag_id](name, value))
+
+
+def path_tree(paths: list) -> dict:
+    """Turns paths like ["a/b", "a/c"] into a tree like {"a": {"b": None, "c": None}}."""
+
+    tree = {}
+
+    for path in paths:
+        node = tree
+        *parents, last = path.split("/")
+
+        for name in parents:
+            node = node.setdefault(name, {})
+
+            if node is None:  # a parent of this path is already parsed completely
+                break
+        else:
+            node[last] = None
+
+    return tree
+
+
+def read_compound_paths(data, pos: int, tree: dict) -> tuple:
+    """Reads only the tags in tree (see path_tree) from a compound, the rest are skipped."""
+
+    out = []
+
+    while True:
+        tag_id = data[pos]
+
+        if tag_id == 0:
+            return out, pos + 1
+
+        name, pos = read_string(data, pos + 1)
+
+        if name not in tree:
+            pos = SKIPPERS[tag_id](data, pos)
+        elif tree[name] is None or tag_id != TAG_Compound.id:
+            value, pos = READERS[tag_id](data, pos)
+            out.append(TYPES[tag_id](name, value))
+        else:
+            value, pos = read_compound_paths(data, pos, tree[name])
+            out.append(TAG_Compound(name, value))
+
+
+def read_plain(data, pos: int, tag_id: int) -> tuple:
+    """Reads a tag's data as a plain value and its schema, see unpack, returns (value, schema, pos).
+
+    The schema of a compound is a dict of the schemas of its tags, the schema of a list is a tuple
+    of the type ID of its items and their schemas (only for lists / compounds, else None), and the
+    schema of anything else is its type ID.
+    """
+
+    if tag_id == TAG_Compound.id:
+        value = {}
+        schema = {}
+
+        while True:
+            child_id = data[pos]
+
+            if child_id == 0:
+                return value, schema, pos + 1
+
+            name, pos = read_string(data, pos + 1)
+            value[name], schema[name], pos = read_plain(data, pos, child_id)
+
+    if tag_id == TAG_List.id:
+        item_id = data[pos]
+        length = _INT_LENGTH.unpack_from(data, pos + 1)[0]
+        pos += 5
+
+        value = []
+
+        if item_id == TAG_List.id or item_id == TAG_Compound.id:
+            schemas = []
+
+            for _ in range(length):
+                item, item_schema, pos = read_plain(data, pos, item_id)
+
+                if schemas and item_schema == schemas[-1]:  # items are usually alike, share it
+                    item_schema = schemas[-1]
+
+                value.append(item)
+                schemas.append(item_schema)
+
+            return value, (item_id, schemas), pos
+
+        for _ in range(length):
+            item, _, pos = read_plain(data, pos, item_id)
+            value.append(item)
+
+        return value, (item_id, None), pos
+
+    value, pos = READERS[tag_id](data, pos)
+
+    if tag_id == TAG_Int_Array.id or tag_id == TAG_Long_Array.id:  # copied, with native byte order
+        value = value.astype(TYPES[tag_id].dtype)
+
+    return value, tag_id, pos
+
+
+def from_plain(value: object, schema: object, name: str = None) -> TAG:
+    """Turns a plain value and its schema from unpack(..., plain=True) back into tags.
+
+    :param object value: The plain value, like a dict.
+    :param object schema: The value's schema.
+    :param str name: The name of the returned tag.
+    """
+
+    if schema.__class__ is dict:
+        return TAG_Compound(name, [from_plain(v, schema[k], k) for k, v in value.items()])
+
+    if schema.__class__ is tuple:
+        item_id, schemas = schema
+
+        if schemas is None:
+            return TAG_List(name, [TYPES[item_id](None, v) for v in value])
+
+        return TAG_List(name, [from_plain(v, s) for v, s in zip(value, schemas)])
+
+    return TYPES[schema](name, value)
+
+
+_SNBT_SPACE = re.compile(r"\s*")
+_SNBT_TOKEN = re.compile(r"[0-9A-Za-z_\-.+]+")  # unquoted keys / values
+
+# the kinds of numbers an unquoted value can be, it's a string if it isn't one of these
+_SNBT_NUMBERS = (
+    (re.compile(r"[-+]?(?:[0-9]+[.]?|[0-9]*[.][0-9]+)(?:e[-+]?[0-9]+)?f", re.I), TAG_Float),
+    (re.compile(r"[-+]?(?:0|[1-9][0-9]*)b", re.I), TAG_Byte),
+    (re.compile(r"[-+]?(?:0|[1-9][0-9]*)l", re.I), TAG_Long),
+    (re.compile(r"[-+]?(?:0|[1-9][0-9]*)s", re.I), TAG_Short),
+    (re.compile(r"[-+]?(?:0|[1-9][0-9]*)"), TAG_Int),
+    (re.compile(r"[-+]?(?:[0-9]+[.]?|[0-9]*[.][0-9]+)(?:e[-+]?[0-9]+)?d", re.I), TAG_Double),
+    (re.compile(r"[-+]?(?:[0-9]+[.]|[0-9]*[.][0-9]+)(?:e[-+]?[0-9]+)?", re.I), TAG_Double),
+)
+
+_SNBT_BITS = {TAG_Byte: 8, TAG_Short: 16, TAG_Int: 32, TAG_Long: 64}
+_SNBT_ARRAYS = {"B": TAG_Byte_Array, "I": TAG_Int_Array, "L": TAG_Long_Array}
+_SNBT_SUFFIXES = {TAG_Byte: "b", TAG_Short: "s", TAG_Long: "L", TAG_Float: "f", TAG_Double: "d"}
+
+
+def from_snbt(text: str, name: str = "") -> TAG:
+    """Parses SNBT, the text form of NBT used by commands and data packs, like {a: 1b, b: [1, 2]}.
+
+    :param str text: The SNBT.
+    :param str name: The name of the returned tag.
+    :raises ValueError: If the text isn't valid SNBT.
+    """
+
+    tag, pos = parse_snbt(text, _SNBT_SPACE.match(text).end())
+
+    if _SNBT_SPACE.match(text, pos).end() != len(text):
+        raise ValueError(f"Unexpected trailing data at {pos} in SNBT")
+
+    tag.name = name
+    return tag
+
+
+def to_snbt(tag: TAG, indent: int = None) -> str:
+    """Formats a tag as SNBT, see from_snbt.
+
+    :param TAG tag: The tag to format, its name isn't included.
+    :param int indent: Spread lists and compounds over lines, indented by this many spaces.
+    """
+
+    out = []
+    format_snbt(out, tag, indent, "")
+    return "".join(out)
+
+
+def parse_snbt(text: str, pos: int) -> tuple:
+    """Parses the SNBT value at pos (which isn't whitespace), returns (tag, pos)."""
+
+    char = text[pos : pos + 1]
+
+    if char == "{":
+        return parse_snbt_compound(text, pos + 1)
+
+    if char == "[":
+        if text[pos + 2 : pos + 3] == ";" and text[pos + 1] in _SNBT_ARRAYS:
+            return parse_snbt_array(text, pos + 3, _SNBT_ARRAYS[text[pos + 1]])
+
+        return parse_snbt_list(text, pos + 1)
+
+    if char == '"' or char == "'":
+        value, pos = parse_snbt_string(text, pos)
+        return TAG_String(None, value), pos
+
+    match = _SNBT_TOKEN.match(text, pos)
+
+    if match is None:
+        raise ValueError(f"Expected a value at {pos} in SNBT")
+
+    return parse_snbt_token(match.group()), match.end()
+
+
+def parse_snbt_token(token: str) -> TAG:
+    for pattern, tag in _SNBT_NUMBERS:
+        if pattern.fullmatch(token):
+            number = token[:-1] if token[-1].isalpha() else token
+
+            if tag is TAG_Float or tag is TAG_Double:
+                return tag(None, float(number))
+
+            value = int(number)
+            limit = 1 << (_SNBT_BITS[tag] - 1)
+
+            if -limit <= value < limit:
+                return tag(None, value)
+
+            break  # out of range numbers are strings, like in Minecraft
+
+    if token == "true" or token == "false":
+        return TAG_Byte(None, int(token == "true"))
+
+    return TAG_String(None, token)
+
+
+def parse_snbt_string(text: str, pos: int) -> tuple:
+    """Parses the quoted string at pos, returns (str, pos)."""
+
+    quote = text[pos]
+    parts = []
+    pos += 1
+
+    while True:
+        end = text.find(quote, pos)
+
+        if end == -1:
+            raise ValueError(f"Unterminated string at {pos} in SNBT")
+
+        escape = text.find("\\", pos, end)
+
+        if escape == -1:
+            parts.append(text[pos:end])
+            return "".join(parts), end + 1
+
+        parts.append(text[pos:escape])
+        parts.append(text[escape + 1 : escape + 2])  # an escaped quote or backslash
+        pos = escape + 2
+
+
+def parse_snbt_items(text: str, pos: int, close: str, parse_item: object) -> tuple:
+    """Parses comma separated items up to close, returns (items, pos)."""
+
+    items = []
+    pos = _SNBT_SPACE.match(text, pos).end()
+
+    if text[pos : pos + 1] == close:
+        return items, pos + 1
+
+    while True:
+        item, pos = parse_item(text, pos)
+        items.append(item)
+
+        pos = _SNBT_SPACE.match(text, pos).end()
+        char = text[pos : pos + 1]
+
+        if char == close:
+            return items, pos + 1
+
+        if char != ",":
+            raise ValueError(f"Expected ',' or '{close}' at {pos} in SNBT")
+
+        pos = _SNBT_SPACE.match(text, pos + 1).end()
+
+
+def parse_snbt_entry(text: str, pos: int) -> tuple:
+    """Parses a key: value entry of a compound, returns (tag, pos)."""
+
+    if text[pos : pos + 1] in ('"', "'"):
+        key, pos = parse_snbt_string(text, pos)
+    else:
+        match = _SNBT_TOKEN.match(text, pos)
+
+        if match is None:
+            raise ValueError(f"Expected a key at {pos} in SNBT")
+
+        key, pos = match.group(), match.end()
+
+    pos = _SNBT_SPACE.match(text, pos).end()
+
+    if text[pos : pos + 1] != ":":
+        raise ValueError(f"Expected ':' at {pos} in SNBT")
+
+    tag, pos = parse_snbt(text, _SNBT_SPACE.match(text, pos + 1).end())
+    tag.name = key
+
+    return tag, pos
+
+
+def parse_snbt_compound(text: str, pos: int) -> tuple:
+    tags, pos = parse_snbt_items(text, pos, "}", parse_snbt_entry)
+    return TAG_Compound(None, tags), pos
+
+
+def parse_snbt_list(text: str, pos: int) -> tuple:
+    start = pos
+    tags, pos = parse_snbt_items(text, pos, "]", parse_snbt)
+
+    if any(tag.id != tags[0].id for tag in tags):
+        raise ValueError(f"Items of different types in the list at {start} in SNBT")
+
+    return TAG_List(None, tags), pos
+
+
+def parse_snbt_array(text: str, pos: int, array: type) -> tuple:
+    start = pos
+    tags, pos = parse_snbt_items(text, pos, "]", parse_snbt)
+
+    if not all(tag.id in (TAG_Byte.id, TAG_Short.id, TAG_Int.id, TAG_Long.id) for tag in tags):
+        raise ValueError(f"Non integer items in the array at {start} in SNBT")
+
+    if array is TAG_Byte_Array:  # stored unsigned
+        return TAG_Byte_Array(None, bytes([tag.data & 0xFF for tag in tags])), pos
+
+    return array(None, [tag.data for tag in tags]), pos
+
+
+def format_snbt_string(text: str) -> str:
+    return '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def format_snbt(out: list, tag: TAG, indent: int, prefix: str) -> None:
+    """Appends tag as SNBT to out, prefix is the indentation of the line the tag is on."""
+
+    if tag.__class__ is TAG_Lazy:
+        tag = tag.load()
+
+    cls = tag.__class__
+
+    if cls is TAG_Compound or cls is TAG_List:
+        if len(tag) == 0:
+            out.append("{}" if cls is TAG_Compound else "[]")
+            return
+
+        inner = prefix if indent is None else prefix + " " * indent
+        colon = ":" if indent is None else ": "
+
+        out.append("{" if cls is TAG_Compound else "[")
+
+        for i, item in enumerate(tag.values() if cls is TAG_Compound else tag):
+            if i:
+                out.append(",")
+
+            if indent is not None:
+                out.append("\n" + inner)
+
+            if cls is TAG_Compound:
+                key = item.name
+                out.append(key if _SNBT_TOKEN.fullmatch(key) else format_snbt_string(key))
+                out.append(colon)
+
+            format_snbt(out, item, indent, inner)
+
+        if indent is not None:
+            out.append("\n" + prefix)
+
+        out.append("}" if cls is TAG_Compound else "]")
+    elif cls is TAG_String:
+        out.append(format_snbt_string(tag.data))
+    elif cls is TAG_Float:
+        # the shortest text which parses back to the same 32 bit float
+        out.append(str(numpy.float32(tag.data)) + "f")
+    elif cls is TAG_Double:
+        out.append(f"{float(tag.data)!r}d")
+    elif cls is TAG_Byte_Array:
+        out.append("[B;" + ",".join([f"{b - 256 if b > 127 else b}b" for b in tag]) + "]")
+    elif cls is TAG_Int_Array:
+        out.append("[I;" + ",".join([str(v) for v in tag]) + "]")
+    elif cls is TAG_Long_Array:
+        out.append("[L;" + ",".join([f"{v}L" for v in tag]) + "]")
+    else:
+        out.append(f"{int(tag.data)}{_SNBT_SUFFIXES.get(cls, '')}")
@@ -32,3 +32,12 @@ class Packet:
     def __init__(self) -> None:
         self.id: int = self.__class__.id
         self.to: int = self.__class__.to
+
+    def encode_into(self, buf: object) -> object:
+        """Appends the packet's data to buf (a Buffer) and returns buf, see Buffer.pack_packet_data.
+
+        Packets which are big or sent often override this to write their fields into buf directly,
+        others only define encode(), which returns their data as bytes.
+        """
+
+        return buf.write(self.encode())
@@ -14,8 +14,87 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+from __future__ import annotations
+
 from cryptography.hazmat.primitives.ciphers import Cipher
 from asyncio import StreamWriter, StreamReader
+from asyncio.streams import FlowControlMixin
+import asyncio
+import weakref
+
+from pymine.api.errors import StopHandling
+from pymine.types.buffer import Buffer
+
+# Extra space kept at the end of receive buffers, update_into() needs a block - 1 bytes more room
+CIPHER_SLACK = 15
+
+
+class OutboundQueue:
+    """Per-connection queue of outgoing data, coalesces writes from one loop iteration into one.
+
+    :param asyncio.Transport transport: The transport to write to.
+    :param asyncio.AbstractEventLoop loop: The event loop.
+    :param int high_water: Amount of buffered bytes after which senders should wait for the client.
+    :param int low_water: Amount of buffered bytes at which senders may continue.
+    :ivar list pending: Data which hasn't been written to the transport yet, in order.
+    :ivar int size: Total length of the pending data.
+    :ivar _CipherContext encryptor: Encrypts each batch before writing, set by EncryptedStream.
+    """
+
+    def __init__(
+        self,
+        transport: asyncio.Transport,
+        loop: asyncio.AbstractEventLoop,
+        high_water: int = 1 << 20,
+        low_water: int = 1 << 18,
+    ) -> None:
+        self.transport = transport
+        self.loop = loop
+        self.high_water = high_water
+
+        self.pending = []
+        self.size = 0
+
+        self.encryptor = None
+        self._scheduled = False
+
+        transport.set_write_buffer_limits(high_water, low_water)
+
+    @property
+    def backlogged(self) -> bool:
+        """Whether there is more data queued and buffered than the high watermark."""
+
+        return self.size + self.transport.get_write_buffer_size() > self.high_water
+
+    def put(self, data: bytes) -> None:
+        """Queues data to be written at the end of the current loop iteration."""
+
+        self.pending.append(data)
+        self.size += len(data)
+
+        if not self._scheduled:
+            self._scheduled = True
+            self.loop.call_soon(self.write)
+
+    def write(self) -> None:
+        """Writes all pending data to the transport at once."""
+
+        self._scheduled = False
+
+        if not self.pending:
+            return
+
+        pending = self.pending
+        self.pending = []
+        self.size = 0
+
+        if self.transport.is_closing():
+            return
+
+        if self.encryptor is None:
+            self.transport.writelines(pending)
+        else:  # the whole batch is encrypted with one call to the cipher
+            self.transport.write(self.encryptor.update(b"".join(pending)))
 
 
 class Stream(StreamWriter):
@@ -24,6 +103,7 @@ class Stream(StreamWriter):
     :param StreamReader reader: An asyncio.StreamReader instance.
     :param StreamWriter writer: An asyncio.StreamWriter instance.
     :ivar tuple remote: A tuple which stores the remote client's address and port.
+    :ivar OutboundQueue outbound: The outgoing data queue, shared with streams which wrap this one.
     """
 
     def __init__(self, reader: StreamReader, writer: StreamWriter) -> None:
@@ -31,6 +111,47 @@ class Stream(StreamWriter):
 
         self.remote = self.get_extra_info("peername")
 
+        self.outbound = getattr(writer, "outbound", None)
+
+        if self.outbound is None:
+            self.outbound = OutboundQueue(self._transport, self._loop)
+
+    def __del__(self):
+        # connections are closed explicitly by the server, not when a replaced Stream is collected
+        pass
+
+    @classmethod
+    def from_transport(cls, transport: asyncio.Transport, protocol: ConnectionProtocol) -> Stream:
+        """Creates a Stream facade for a connection handled by a ConnectionProtocol."""
+
+        stream = cls.__new__(cls)
+        StreamWriter.__init__(stream, transport, protocol, None, protocol._loop)
+        stream.remote = stream.get_extra_info("peername")
+        stream.outbound = OutboundQueue(transport, protocol._loop)
+
+        return stream
+
+    def write(self, data: bytes) -> None:
+        self.outbound.put(data)
+
+    def writelines(self, data: list) -> None:
+        for d in data:
+            self.outbound.put(d)
+
+    async def flush(self) -> None:
+        """Writes all queued data to the transport now and waits until the client has caught up.
+
+        This acts as a barrier, it should be used where everything sent so far must be out
+        before continuing, for example before closing the connection or switching compression.
+        """
+
+        self.outbound.write()
+        await self.drain()
+
+    def close(self) -> None:
+        self.outbound.write()
+        super().close()
+
     def read(self, n: int = -1) -> bytes:
         return self._reader.read(n)
 
@@ -49,8 +170,8 @@ class EncryptedStream(Stream):
 
     :param Stream stream: The original, stream-compatible object.
     :param Cipher cipher: The cipher object, used to encrypt + decrypt data.
-    :ivar _CipherContext decryptor: Description of parameter `_CipherContext`.
-    :ivar _CipherContext encryptor: Description of parameter `_CipherContext`.
+    :ivar _CipherContext decryptor: Decrypts incoming data, used in place by the FrameReader.
+    :ivar _CipherContext encryptor: Encrypts outgoing data, used by the shared OutboundQueue.
     """
 
     def __init__(self, stream: Stream, cipher: Cipher) -> None:
@@ -59,6 +180,9 @@ class EncryptedStream(Stream):
         self.decryptor = cipher.decryptor()
         self.encryptor = cipher.encryptor()
 
+        self.outbound.write()  # anything queued before this point is sent unencrypted
+        self.outbound.encryptor = self.encryptor
+
     async def read(self, n: int = -1) -> bytes:
         return self.decryptor.update(await super().read(n))
 
@@ -71,8 +195,279 @@ class EncryptedStream(Stream):
     async def readuntil(self, separator: bytes = b"\n") -> bytes:
         return self.decryptor.update(await super().readuntil(separator))
 
-    def write(self, data: bytes) -> None:
-        return super().write(self.encryptor.update(data))
 
-    def writelines(self, data: bytes) -> None:
-        return super().writelines(self.encryptor.update(data))
+class FrameReader:
+    """Reads chunks from a stream into a reusable receive buffer and splits them into frames.
+
+    Frames are handed out as Buffers over views of the receive buffer, so they aren't copied.
+    Before the receive buffer is compacted or grown, any frame which is still held on to is
+    copied out of it, so handlers may keep frames around.
+
+    :param Stream stream: The stream to read from, this is updated by the connection handler.
+    :param float timeout: Seconds without any received data before the connection is closed.
+    :param int chunk_size: Max amount of bytes to read from the stream per wakeup.
+    :ivar bytearray recv_buf: The receive buffer, shared between all reads.
+    :ivar int start: Position in the receive buffer of the first byte which hasn't been consumed.
+    :ivar int end: Position in the receive buffer after the last byte which has been received.
+    """
+
+    def __init__(self, stream: Stream, timeout: float = 30, chunk_size: int = 65536) -> None:
+        self.stream = stream
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+
+        self.recv_buf = bytearray(chunk_size)
+        self.start = 0
+        self.end = 0
+
+        self._frames = []  # weak references to the frames handed out since the last reserve()
+
+        self.first = True  # whether a frame has been read yet, used to detect legacy pings
+        self.timed_out = False
+
+        self._loop = asyncio.get_event_loop()
+        self._last_recv = self._loop.time()
+        self._timer = self._loop.call_later(timeout, self._check_timeout)
+
+    def _check_timeout(self) -> None:
+        # one timer per connection which reschedules itself, instead of a wait_for() per read
+        idle = self._loop.time() - self._last_recv
+
+        if idle < self.timeout:
+            self._timer = self._loop.call_later(self.timeout - idle, self._check_timeout)
+            return
+
+        self.timed_out = True
+        self.stream.close()  # causes the pending read to return b""
+
+    def close(self) -> None:
+        """Cancels the idle timer, should be called once the connection is done."""
+
+        self._timer.cancel()
+
+    def switch_stream(self, stream: Stream) -> None:
+        """Switches to a new stream, decrypting any data which was already received if needed."""
+
+        if stream is self.stream:
+            return
+
+        encrypted = isinstance(self.stream, EncryptedStream)
+        self.stream = stream
+
+        if not encrypted:
+            self.decrypt(self.start, self.end)
+
+    def decrypt(self, start: int, end: int) -> None:
+        """Decrypts a range of the receive buffer in place, if the stream is encrypted."""
+
+        if isinstance(self.stream, EncryptedStream) and end > start:
+            with memoryview(self.recv_buf) as view:
+                self.stream.decryptor.update_into(view[start:end], view[start:])
+
+    def _release_frames(self) -> None:
+        # frames which are still alive get their own copy, the receive buffer can be reused after
+        for ref in self._frames:
+            frame = ref()
+
+            if frame is not None and isinstance(frame.buf, memoryview):
+                frame.buf = frame.buf.tobytes()
+
+        self._frames.clear()
+
+    def reserve(self, size: int) -> memoryview:
+        """Makes sure there's room for size more bytes, returns a view of the free space."""
+
+        self._release_frames()
+
+        if self.start > 0:  # move unconsumed data to the front so the buffer doesn't grow forever
+            length = self.end - self.start
+            self.recv_buf[:length] = self.recv_buf[self.start : self.end]
+            self.start, self.end = 0, length
+
+        free = len(self.recv_buf) - self.end - CIPHER_SLACK
+
+        if free < size:
+            try:
+                self.recv_buf.extend(bytes(size - free))
+            except BufferError:  # a view of the receive buffer is still alive, so leave it be
+                self.recv_buf = self.recv_buf[: self.end] + bytes(size + CIPHER_SLACK)
+
+        return memoryview(self.recv_buf)[self.end : -CIPHER_SLACK]
+
+    def received(self, nbytes: int) -> None:
+        """Marks nbytes written into the reserved space as received."""
+
+        self.end += nbytes
+        self._last_recv = self._loop.time()
+
+    async def fill(self) -> None:
+        """Reads the next chunk of data from the stream into the receive buffer."""
+
+        # raw data, it's decrypted below if needed
+        data = await self.stream._reader.read(self.chunk_size)
+
+        if data == b"":
+            if self.timed_out:
+                raise StopHandling("Closing due to timeout on read...")
+
+            raise StopHandling("Closing due to invalid read...")
+
+        with self.reserve(len(data)) as view:
+            view[: len(data)] = data
+
+        self.decrypt(self.end, self.end + len(data))
+
+        self.received(len(data))
+
+    def next_frame(self) -> Buffer:
+        """Splits the next complete frame out of the receive buffer in place, or returns None."""
+
+        buf = self.recv_buf
+        pos = self.start
+        end = self.end
+
+        if pos >= end:
+            return None
+
+        if self.first and buf[pos] == 0xFE:
+            raise StopHandling("Legacy ping attempted, legacy ping is not supported.")
+
+        # Basically an implementation of Buffer.unpack_varint(), frame lengths are at most 3 bytes
+        length = 0
+
+        for i in range(3):
+            if pos >= end:
+                return None
+
+            b = buf[pos]
+            pos += 1
+
+            length |= (b & 0x7F) << 7 * i
+
+            if not b & 0x80:
+                break
+        else:
+            raise StopHandling("Closing due to invalid packet length...")
+
+        if end - pos < length:
+            return None
+
+        self.first = False
+        self.start = pos + length
+
+        frame = Buffer(memoryview(buf)[pos : self.start])
+        self._frames.append(weakref.ref(frame))
+
+        return frame
+
+
+class ProtocolFrameReader(FrameReader):
+    """A FrameReader which is fed directly by a ConnectionProtocol instead of reading from a stream.
+
+    :param ConnectionProtocol protocol: The protocol which receives data for the connection.
+    :param int max_buffered: Amount of unconsumed bytes after which reading from the socket is
+        paused.
+    """
+
+    def __init__(self, protocol: ConnectionProtocol, max_buffered: int = 1 << 21, **kwargs) -> None:
+        super().__init__(protocol.stream, **kwargs)
+
+        self.protocol = protocol
+        self.max_buffered = max_buffered
+
+        self._waiter = None
+        self._paused = False
+
+    def received(self, nbytes: int) -> None:
+        self.decrypt(self.end, self.end + nbytes)
+
+        super().received(nbytes)
+
+        if not self._paused and self.end - self.start > self.max_buffered:
+            self._paused = True
+            self.protocol.transport.pause_reading()
+
+        self.wakeup()
+
+    def wakeup(self) -> None:
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def fill(self) -> None:
+        if self._paused:
+            self._paused = False
+            self.protocol.transport.resume_reading()
+
+        if self.protocol.closed:  # fill() is only called when there's no complete frame left
+            if self.timed_out:
+                raise StopHandling("Closing due to timeout on read...")
+
+            raise StopHandling("Closing due to invalid read...")
+
+        self._waiter = self._loop.create_future()
+
+        try:
+            await self._waiter
+        finally:
+            self._waiter = None
+
+
+class ConnectionProtocol(FlowControlMixin, asyncio.BufferedProtocol):
+    """A connection engine built on asyncio.BufferedProtocol, an alternative to streams.
+
+    Data is received directly into the receive buffer of a ProtocolFrameReader, frames are split
+    out of it in place and dispatched to the packet handlers by the server. Handlers are passed
+    a Stream facade, so writing, EncryptedStream, and everything else which uses a Stream keeps
+    working.
+
+    :param server: The server instance.
+    :ivar asyncio.Transport transport: The transport for the connection.
+    :ivar Stream stream: The Stream facade for the connection.
+    :ivar ProtocolFrameReader frames: The frame reader, which also holds the receive buffer.
+    :ivar bool closed: Whether the connection has been lost.
+    """
+
+    def __init__(self, server) -> None:
+        super().__init__(asyncio.get_event_loop())
+
+        self.server = server
+
+        self.transport = None
+        self.stream = None
+        self.frames = None
+        self.closed = False
+
+        self._close_waiter = self._loop.create_future()
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self.transport = transport
+        self.stream = Stream.from_transport(transport, self)
+        self.frames = ProtocolFrameReader(self)
+
+        self._loop.create_task(self.server.handle_frames(self.stream, self.frames))
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        return self.frames.reserve(max(sizehint, self.frames.chunk_size))
+
+    def buffer_updated(self, nbytes: int) -> None:
+        self.frames.received(nbytes)
+
+    def eof_received(self) -> bool:
+        self.closed = True
+        self.frames.wakeup()
+
+        return False  # the transport closes itself
+
+    def connection_lost(self, exc: Exception) -> None:
+        super().connection_lost(exc)
+
+        self.closed = True
+
+        if self.frames is not None:
+            self.frames.wakeup()
+
+        if not self._close_waiter.done():
+            self._close_waiter.set_result(None)
+
+    def _get_close_waiter(self, stream: Stream) -> asyncio.Future:
+        return self._close_waiter
@@ -14,19 +14,22 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from collections import OrderedDict
 import aiofile
+import asyncio
 import time
 import os
 
 from pymine.data.default_nbt.level import new_level_nbt
+from pymine.types.chunk_cache import ChunkCache
 from pymine.types.buffer import Buffer
 from pymine.types.chunk import Chunk
 import pymine.types.nbt as nbt
 
 
 class World:
-    def __init__(self, server, name: str, path: str, chunk_cache_max: int) -> None:
+    def __init__(
+        self, server, name: str, path: str, chunk_cache_max: int, chunk_cache_max_bytes: int
+    ) -> None:
         self.server = server
 
         self.name = name
@@ -34,8 +37,11 @@ class World:
 
         self.data = None  # data from the level.dat
 
-        self._chunk_cache_max = chunk_cache_max
-        self._chunk_cache = OrderedDict()
+        self.chunk_cache = ChunkCache(chunk_cache_max, chunk_cache_max_bytes)
+
+        self._unsaved = {}  # changed chunks which were evicted from the cache, until they're saved
+        self._save_needed = asyncio.Event()
+        self._save_task = None
 
         self._cached_name = None
 
@@ -62,15 +68,30 @@ class World:
 
     async def init(self):
         self.data = await self.load_level_data()
+        self._save_task = asyncio.create_task(self.save_loop())
         return self  # for fluent style chaining
 
+    async def close(self) -> None:
+        """Stops saving in the background and saves every changed chunk."""
+
+        if self._save_task is not None:
+            self._save_task.cancel()
+
+            try:
+                await self._save_task
+            except asyncio.CancelledError:
+                pass
+
+        await self.save()
+
     # loads the level.dat for the current world
     async def load_level_data(self):
         file = os.path.join(self.path, "level.dat")
 
         if os.path.isfile(file):
             async with aiofile.async_open(file, "rb") as level_data_file:
-                return nbt.TAG_Compound.unpack(Buffer(await level_data_file.read()))
+                # level.dat is gzipped, most of it (like the game rules) is rarely needed
+                return nbt.unpack(Buffer(await level_data_file.read()), lazy=True)["Data"]
 
         return new_level_nbt(
             (2586, self.server.meta.version, 19133),
@@ -81,32 +102,133 @@ class World:
 
     # caches a chunk and returns sed chunk
     def cache_chunk(self, chunk: Chunk, key: tuple) -> Chunk:
-        self._chunk_cache[key] = chunk
+        self.handle_evicted(self.chunk_cache.put(key, chunk))
+        return chunk
+
+    def handle_evicted(self, evicted: list) -> None:
+        for key, chunk in evicted:
+            if chunk.dirty:  # it's kept around until it's saved, see save_loop
+                self._unsaved[key] = chunk
+                self._save_needed.set()
+
+    def set_ticket(self, owner: object, chunk_coords: list) -> None:
+        """Keeps the chunks at chunk_coords loaded for owner (like a player), see ChunkCache."""
+
+        self.handle_evicted(self.chunk_cache.set_ticket(owner, chunk_coords))
+
+    def remove_ticket(self, owner: object) -> None:
+        self.handle_evicted(self.chunk_cache.remove_ticket(owner))
+
+    # returns a chunk if it's loaded, evicted chunks that haven't been saved yet are cached again
+    def get_cached_chunk(self, key: tuple) -> Chunk:
+        chunk = self.chunk_cache.get(key)
 
-        if len(self._chunk_cache) > self._chunk_cache_max:
-            self._chunk_cache.popitem(False)
+        if chunk is None:
+            chunk = self._unsaved.pop(key, None)
+
+            if chunk is not None:
+                self.cache_chunk(chunk, key)
 
         return chunk
 
+    async def save(self, evicted_only: bool = False) -> None:
+        """Saves the chunks which changed since they were loaded / saved.
+
+        :param bool evicted_only: Whether to only save chunks which were evicted from the cache.
+        """
+
+        unsaved = dict(self._unsaved)
+        chunks = list(unsaved.values())
+
+        if not evicted_only:
+            chunks.extend(chunk for chunk in self.chunk_cache.values() if chunk.dirty)
+
+        if chunks:
+            await self.server.chunkio.save_chunks_async(
+                self.path, chunks, self.server.process_executor
+            )
+
+        for key, chunk in unsaved.items():
+            if self._unsaved.get(key) is chunk and not chunk.dirty:
+                del self._unsaved[key]
+
+    async def save_loop(self) -> None:
+        """Saves evicted chunks soon after they're evicted, and every changed chunk periodically."""
+
+        loop = asyncio.get_running_loop()
+        autosave_at = loop.time() + self.server.conf["autosave_interval"]
+
+        while True:
+            # evictions don't push the autosave back, chunks which stay loaded would never be saved
+            try:
+                await asyncio.wait_for(self._save_needed.wait(), max(0, autosave_at - loop.time()))
+            except asyncio.TimeoutError:
+                pass
+            else:
+                await asyncio.sleep(1)  # wait for more evictions, so they're saved in batches
+
+            self._save_needed.clear()
+
+            evicted_only = loop.time() < autosave_at
+
+            if not evicted_only:
+                autosave_at = loop.time() + self.server.conf["autosave_interval"]
+
+            try:
+                await self.save(evicted_only)
+            except Exception as e:
+                self.server.console.error(
+                    f"Failed to save chunks of {self.name}: {self.server.console.f_traceback(e)}"
+                )
+
     async def fetch_chunk(self, chunk_x: int, chunk_z: int) -> Chunk:
         key = (chunk_x, chunk_z)
 
-        try:  # try to fetch chunk from cache
-            return self._chunk_cache[key]
-        except KeyError:
-            pass
+        chunk = self.get_cached_chunk(key)  # try to fetch chunk from cache
+
+        if chunk is not None:
+            return chunk
 
         try:  # try to fetch from disk
             return self.cache_chunk(
-                await self.server.chunkio.fetch_chunk_async(self.path, *key), key
-            )
-        except FileNotFoundError:  # fall back to generate chunk
-            return self.cache_chunk(
-                self.server.generator.generate_chunk(
-                    self.data["RandomSeed"].data, self.cached_name, chunk_x, chunk_z
+                await self.server.chunkio.fetch_chunk_async(
+                    self.path, *key, self.server.process_executor
                 ),
                 key,
             )
+        except FileNotFoundError:  # fall back to generate chunk
+            return self.cache_chunk(self.generate_chunk(chunk_x, chunk_z), key)
+
+    def generate_chunk(self, chunk_x: int, chunk_z: int) -> Chunk:
+        chunk = self.server.generator.generate_chunk(
+            self.data["RandomSeed"].data, self.cached_name, chunk_x, chunk_z
+        )
+
+        chunk.mark_changed()  # generated chunks haven't been saved yet
+
+        return chunk
+
+    async def fetch_chunks(self, chunk_coords: list):
+        """Fetches many chunks at once, chunks are yielded as soon as they're loaded, in any order.
+
+        Cached chunks come first, the rest are read from the disk concurrently and decoded in the
+        process pool (see ChunkIO), and chunks which aren't saved yet are generated.
+        """
+
+        missing = []
+
+        for key in chunk_coords:
+            chunk = self.get_cached_chunk(key)
+
+            if chunk is None:
+                missing.append(key)
+            else:
+                yield chunk
+
+        async for key, chunk in self.server.chunkio.fetch_chunks_async(
+            self.path, missing, self.server.process_executor
+        ):
+            if chunk is None:  # fall back to generate chunk
+                chunk = self.generate_chunk(*key)
 
-    async def fetch_chunks(self, chunk_coords: list) -> list:
-        raise NotImplementedError
+            yield self.cache_chunk(chunk, key)
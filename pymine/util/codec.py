@@ -0,0 +1,213 @@
+# A flexible and fast Minecraft server software written completely in Python.
+# Copyright (C) 2021 PyMine
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import struct
+import numpy
+
+__all__ = (
+    "get_struct",
+    "encode_varint",
+    "decode_varint",
+    "encode_varint_array",
+    "pack_long_array",
+    "unpack_long_array",
+    "pack_nibbles",
+    "unpack_nibbles",
+)
+
+# precompiled big endian struct.Struct objects, indexed by their format without the leading ">"
+STRUCTS = {
+    f: struct.Struct(">" + f) for f in ("?", "b", "B", "h", "H", "i", "I", "q", "Q", "f", "d")
+}
+
+
+def get_struct(f: str) -> struct.Struct:
+    """Returns a cached big endian struct.Struct object for the given format."""
+
+    try:
+        return STRUCTS[f]
+    except KeyError:
+        s = STRUCTS[f] = struct.Struct(">" + f)
+        return s
+
+
+def check_range(num: int, max_bits: int) -> None:
+    num_max = (1 << (max_bits - 1)) - 1
+    num_min = -1 << (max_bits - 1)
+
+    if not (num_min <= num <= num_max):
+        raise ValueError(f"num doesn't fit in given range: {num_min} <= {num} < {num_max}")
+
+
+def encode_varint(num: int, max_bits: int = 32) -> bytes:
+    """Encodes a varint / varlong (max_bits > 32) into bytes."""
+
+    if 0 <= num < 0x80:  # single byte, by far the most common case
+        return bytes((num,))
+
+    if not (-1 << (max_bits - 1)) <= num < (1 << (max_bits - 1)):
+        check_range(num, max_bits)  # raises the ValueError
+
+    # negative numbers are sent as their unsigned two's complement value
+    num &= 0xFFFFFFFF if max_bits <= 32 else 0xFFFFFFFFFFFFFFFF
+
+    out = bytearray()
+
+    while num >= 0x80:
+        out.append((num & 0x7F) | 0x80)
+        num >>= 7
+
+    out.append(num)
+
+    return bytes(out)
+
+
+def decode_varint(buf: bytes, pos: int, max_bits: int = 32) -> tuple:
+    """Decodes a varint / varlong from buf at pos, returns the number and the new position."""
+
+    num = buf[pos]
+    pos += 1
+
+    if num < 0x80:  # single byte, can't be negative or out of range
+        return num, pos
+
+    num &= 0x7F
+
+    for i in range(1, 10):
+        b = buf[pos]
+        pos += 1
+
+        num |= (b & 0x7F) << 7 * i
+
+        if not b & 0x80:
+            break
+
+    if max_bits <= 32:
+        if num & (1 << 31):
+            num -= 1 << 32
+    elif num & (1 << 63):
+        num -= 1 << 64
+
+    check_range(num, max_bits)
+
+    return num, pos
+
+
+def encode_varint_array(nums: object, max_bits: int = 32) -> bytes:
+    """Encodes an array of varints / varlongs into bytes in one go, using numpy."""
+
+    nums = numpy.asarray(nums, numpy.int64)
+
+    if len(nums) == 0:
+        return b""
+
+    check_range(int(nums.min()), max_bits)
+    check_range(int(nums.max()), max_bits)
+
+    if max_bits <= 32:
+        nums = (nums & 0xFFFFFFFF).astype(numpy.uint64)
+    else:
+        nums = nums.astype(numpy.uint64)  # wraps negative numbers around to their two's complement
+
+    # amount of bytes needed for each number
+    lengths = numpy.ones(nums.shape, numpy.int64)
+
+    for i in range(1, 10):
+        lengths += nums >= (1 << (7 * i))
+
+    if lengths.max() == 1:  # every number fits into one byte
+        return nums.astype(numpy.uint8).tobytes()
+
+    offsets = numpy.cumsum(lengths) - lengths
+    out = numpy.empty(int(lengths.sum()), numpy.uint8)
+
+    for i in range(int(lengths.max())):
+        mask = lengths > i
+        more = (lengths[mask] > i + 1).astype(numpy.uint64) << numpy.uint64(7)
+        out[offsets[mask] + i] = ((nums[mask] >> numpy.uint64(7 * i)) & numpy.uint64(0x7F)) | more
+
+    return out.tobytes()
+
+
+def pack_long_array(values: object, bits: int, spanning: bool = False) -> numpy.ndarray:
+    """Packs values of the given bit size into longs, see unpack_long_array about spanning."""
+
+    values = numpy.asarray(values).ravel().astype(numpy.uint64)
+
+    if spanning:  # lay out every value's bits back to back, then pack the bits into longs
+        shifts = numpy.arange(bits, dtype=numpy.uint64)
+        stream = ((values[:, None] >> shifts) & numpy.uint64(1)).astype(numpy.uint8).ravel()
+        stream = numpy.pad(stream, (0, -len(stream) % 64))
+
+        return numpy.packbits(stream, bitorder="little").view("<u8").astype(numpy.uint64)
+
+    per_long = 64 // bits
+
+    padded = numpy.zeros(-(-len(values) // per_long) * per_long, numpy.uint64)
+    padded[: len(values)] = values & numpy.uint64((1 << bits) - 1)
+
+    shifts = numpy.arange(per_long, dtype=numpy.uint64) * numpy.uint64(bits)
+
+    return numpy.bitwise_or.reduce(padded.reshape(-1, per_long) << shifts, axis=1)
+
+
+def unpack_long_array(
+    longs: object, bits: int, count: int = 4096, spanning: bool = False
+) -> numpy.ndarray:
+    """Unpacks count values of the given bit size from an array of longs, like BlockStates.
+
+    Since 1.16 (20w17a) values never span two longs, the leftover bits of each long are padding,
+    before that values are packed back to back and may span two longs, set spanning for that layout.
+    """
+
+    longs = numpy.asarray(longs, numpy.int64).view(numpy.uint64)
+    mask = numpy.uint64((1 << bits) - 1)
+
+    if not spanning:
+        shifts = numpy.arange(64 // bits, dtype=numpy.uint64) * numpy.uint64(bits)
+        return ((longs[:, None] >> shifts) & mask).ravel()[:count]
+
+    starts = numpy.arange(count, dtype=numpy.uint64) * numpy.uint64(bits)
+    index = (starts >> numpy.uint64(6)).astype(numpy.intp)
+    offset = starts & numpy.uint64(63)
+
+    values = longs[index] >> offset
+
+    # values which span two longs get their high bits from the start of the next long
+    spans = offset + numpy.uint64(bits) > 64
+    values[spans] |= longs[index[spans] + 1] << (numpy.uint64(64) - offset[spans])
+
+    return values & mask
+
+
+def pack_nibbles(values: object) -> bytes:
+    """Packs an array of 4 bit values into bytes, the first of each pair goes in the low nibble."""
+
+    values = numpy.asarray(values).ravel().astype(numpy.uint8) & 0x0F
+
+    return (values[0::2] | (values[1::2] << 4)).tobytes()
+
+
+def unpack_nibbles(data: bytes) -> numpy.ndarray:
+    """Unpacks bytes into an array of 4 bit values, the low nibble of each byte comes first."""
+
+    data = numpy.frombuffer(data, numpy.uint8)
+
+    nibbles = numpy.empty(len(data) * 2, numpy.uint8)
+    nibbles[0::2] = data & 0x0F
+    nibbles[1::2] = data >> 4
+
+    return nibbles
@@ -0,0 +1,210 @@
+# Micro-benchmarks for the Buffer codecs, run with: python tests/bench_buffer.py
+# LegacyBuffer is the implementation the codec layer replaced, it's kept here for comparison.
+
+import struct
+import timeit
+import random
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from pymine.util.codec import pack_long_array, pack_nibbles
+from pymine.types.buffer import Buffer
+import numpy
+
+NUMBER = 20_000
+
+
+class LegacyBuffer:
+    def __init__(self, buf: bytes = None) -> None:
+        self.buf = b"" if buf is None else buf
+        self.pos = 0
+
+    def read(self, length: int = None) -> bytes:
+        try:
+            if length is None:
+                length = len(self.buf)
+                return self.buf[self.pos :]
+
+            return self.buf[self.pos : self.pos + length]
+        finally:
+            self.pos += length
+
+    def reset(self) -> None:
+        self.pos = 0
+
+    def unpack(self, f: str) -> object:
+        unpacked = struct.unpack(">" + f, self.read(struct.calcsize(f)))
+
+        if len(unpacked) == 1:
+            return unpacked[0]
+
+        return unpacked
+
+    @classmethod
+    def pack(cls, f: str, *data: object) -> bytes:
+        return struct.pack(">" + f, *data)
+
+    @classmethod
+    def pack_varint(cls, num: int, max_bits: int = 32) -> bytes:
+        num_max = (1 << (max_bits - 1)) - 1
+        num_min = -1 << (max_bits - 1)
+
+        if not (num_min <= num <= num_max):
+            raise ValueError(f"num doesn't fit in given range: {num_min} <= {num} < {num_max}")
+
+        if num < 0:
+            num += 1 << 32
+
+        out = b""
+
+        for i in range(10):
+            b = num & 0x7F
+            num >>= 7
+
+            out += cls.pack("B", (b | (0x80 if num > 0 else 0)))
+
+            if num == 0:
+                break
+
+        return out
+
+    def unpack_varint(self, max_bits: int = 32) -> int:
+        num = 0
+
+        for i in range(10):
+            b = self.unpack("B")
+            num |= (b & 0x7F) << 7 * i
+
+            if not b & 0x80:
+                break
+
+        if num & (1 << 31):
+            num -= 1 << 32
+
+        num_max = (1 << (max_bits - 1)) - 1
+        num_min = -1 << (max_bits - 1)
+
+        if not (num_min <= num <= num_max):
+            raise ValueError(f"num doesn't fit in given range: {num_min} <= {num} < {num_max}")
+
+        return num
+
+
+def legacy_pack_long_array(block_states, bits_per_block: int) -> bytes:
+    data = [0] * int((16 * 16 * 16) * bits_per_block / 64)
+    individual_value_mask = (1 << bits_per_block) - 1
+
+    for y in range(16):
+        for z in range(16):
+            for x in range(16):
+                block_num = (((y * 16) + z) * 16) + x
+                start_long = (block_num * bits_per_block) // 64
+                start_offset = (block_num * bits_per_block) % 64
+                end_long = ((block_num + 1) * bits_per_block - 1) // 64
+
+                value = int(block_states[y][z][x]) & individual_value_mask
+
+                data[start_long] |= value << start_offset
+
+                if start_long != end_long:
+                    data[end_long] = value >> (64 - start_offset)
+
+    return b"".join([LegacyBuffer.pack("Q", q & 0xFFFFFFFFFFFFFFFF) for q in data])
+
+
+def legacy_pack_nibbles(light) -> bytes:
+    out = b""
+
+    for y in range(16):
+        for z in range(16):
+            for x in range(0, 16, 2):
+                out += LegacyBuffer.pack("B", (light[y][z][x] << 4) | (light[y][z][x + 1]))
+
+    return out
+
+
+def bench(name: str, legacy, new, number: int = NUMBER) -> None:
+    t_legacy = timeit.timeit(legacy, number=number)
+    t_new = timeit.timeit(new, number=number)
+
+    print(
+        f"{name:<24} legacy: {t_legacy:.4f}s  new: {t_new:.4f}s  speedup: {t_legacy / t_new:.1f}x"
+    )
+
+
+def bench_decode(name: str, data: bytes, decode) -> None:
+    legacy_buf, new_buf = LegacyBuffer(data), Buffer(data)
+
+    def run(buf):
+        buf.reset()
+
+        for _ in range(64):
+            decode(buf)
+
+    bench(name, lambda: run(legacy_buf), lambda: run(new_buf), NUMBER // 64)
+
+
+def main():
+    nums = [random.randint(0, 1 << 21) for _ in range(1024)]
+    biomes = [random.randint(0, 80) for _ in range(1024)]
+
+    bench(
+        "pack_varint",
+        lambda: LegacyBuffer.pack_varint(3749146),
+        lambda: Buffer.pack_varint(3749146),
+    )
+    bench(
+        "pack('q')",
+        lambda: LegacyBuffer.pack("q", 1234567890456),
+        lambda: Buffer.pack("q", 1234567890456),
+    )
+
+    bench_decode(
+        "unpack_varint",
+        b"".join([Buffer.pack_varint(n) for n in nums]),
+        lambda b: b.unpack_varint(),
+    )
+    bench_decode("unpack('q')", struct.pack(">64q", *range(64)), lambda b: b.unpack("q"))
+
+    bench(
+        "varint array (1024)",
+        lambda: b"".join([LegacyBuffer.pack_varint(n) for n in nums]),
+        lambda: Buffer.pack_varint_array(nums),
+        number=200,
+    )
+    bench(
+        "biome array (1024)",
+        lambda: b"".join([LegacyBuffer.pack_varint(n) for n in biomes]),
+        lambda: Buffer.pack_varint_array(biomes),
+        number=200,
+    )
+
+    # a section like the ones in 1.16 region files, direct palette and 4 bit indirect palette ids
+    block_states = numpy.random.randint(0, 1 << 15, (16, 16, 16), numpy.int32)
+    indirect_states = numpy.random.randint(0, 16, (16, 16, 16), numpy.int32)
+    light = numpy.random.randint(0, 16, (16, 16, 16), numpy.int16)
+
+    bench(
+        "section blocks (15 bits)",
+        lambda: legacy_pack_long_array(block_states, 15),
+        lambda: pack_long_array(block_states, 15).astype(">u8").tobytes(),
+        number=20,
+    )
+    bench(
+        "section blocks (4 bits)",
+        lambda: legacy_pack_long_array(indirect_states, 4),
+        lambda: pack_long_array(indirect_states, 4).astype(">u8").tobytes(),
+        number=20,
+    )
+    bench(
+        "section light",
+        lambda: legacy_pack_nibbles(light),
+        lambda: pack_nibbles(light),
+        number=20,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -121,3 +121,135 @@ def test_json():
     for key, value in buf.unpack_json().items():
         assert key in data
         assert data[key] == value
+
+
+def test_builder():
+    buf = Buffer().write(Buffer.pack("i", 123)).write(Buffer.pack_varint(300))
+    assert buf.buf == b"\x00\x00\x00{\xac\x02"
+
+    buf.write(b"\x01\x02")
+    view = buf.read_view(4)
+    assert view == b"\x00\x00\x00{"
+
+    buf.write(b"\x03")  # writing while a view is held shouldn't corrupt the view or buffer
+    assert view == b"\x00\x00\x00{"
+    assert buf.unpack_varint() == 300
+    assert buf.read() == b"\x01\x02\x03"
+
+    # the write_* methods append the same data as the pack_* ones return
+    buf = Buffer().write_struct("ib", 123, -1).write_varint(300).write_string("héllo")
+    buf.write_slot("minecraft:stone", 3)
+
+    assert buf.buf == (
+        Buffer.pack("ib", 123, -1)
+        + Buffer.pack_varint(300)
+        + Buffer.pack_string("héllo")
+        + Buffer.pack_slot("minecraft:stone", 3)
+    )
+
+
+def test_entity_metadata():
+    import uuid
+
+    metadata = {
+        (0, 0): 5,
+        (1, 1): 300,
+        (2, 3): "name",
+        (3, 5): None,
+        (4, 7): True,
+        (5, 10): (1, 2, 3),
+        (6, 12): uuid.UUID(int=7),
+        (7, 13): None,
+        (8, 17): 4,
+    }
+
+    buf = Buffer(Buffer.pack_entity_metadata(metadata))
+
+    assert (buf.unpack("B"), buf.unpack_varint(), buf.unpack("b")) == (0, 0, 5)
+    assert (buf.unpack("B"), buf.unpack_varint(), buf.unpack_varint()) == (1, 1, 300)
+    assert (buf.unpack("B"), buf.unpack_varint(), buf.unpack_string()) == (2, 3, "name")
+    assert (buf.unpack("B"), buf.unpack_varint(), buf.unpack("?")) == (3, 5, False)
+    assert (buf.unpack("B"), buf.unpack_varint(), buf.unpack("?")) == (4, 7, True)
+    assert (buf.unpack("B"), buf.unpack_varint(), buf.unpack("?")) == (5, 10, True)
+    assert buf.unpack_position() == (1, 2, 3)
+    assert (buf.unpack("B"), buf.unpack_varint(), buf.unpack("?")) == (6, 12, True)
+    assert buf.unpack_uuid() == uuid.UUID(int=7)
+    assert (buf.unpack("B"), buf.unpack_varint(), buf.unpack_varint()) == (7, 13, 0)
+    assert (buf.unpack("B"), buf.unpack_varint(), buf.unpack_optional_varint()) == (8, 17, 4)
+    assert buf.read() == b"\xfe"
+
+
+@pytest.mark.parametrize(
+    "var_long", (0, 1, 127, 128, -1, VAR_INT_MAX + 1, (1 << 63) - 1, -(1 << 63))
+)
+def test_varlong(var_long):
+    buf = Buffer(Buffer.pack_varlong(var_long))
+    assert buf.unpack_varlong() == var_long
+    assert buf.pos == len(buf)
+
+
+def test_varint_array():
+    nums = [0, 1, 127, 128, 255, 300, 3749146, -1, VAR_INT_MAX, VAR_INT_MIN]
+    buf = Buffer(Buffer.pack_varint_array(nums))
+
+    assert buf.buf == b"".join([Buffer.pack_varint(n) for n in nums])
+    assert [buf.unpack_varint() for _ in nums] == nums
+
+    with pytest.raises(ValueError):
+        Buffer.pack_varint_array([VAR_INT_MAX + 1])
+
+
+def test_packet():
+    from pymine.net.packets.status.status import StatusStatusPingPong
+    from pymine.net.packet_map import PACKET_MAP
+
+    packet = StatusStatusPingPong(1234567890456)
+
+    buf = Buffer(Buffer.pack_packet(packet))
+    assert buf.unpack_varint() == len(buf) - buf.pos  # the length prefix
+
+    assert buf.unpack_packet(1, PACKET_MAP).payload == 1234567890456
+
+    # the packet is encoded into one buffer, and framed in place in front of its data
+    data = Buffer.pack_packet_data(packet)
+    framed = Buffer.frame_packet(data)
+    assert framed.obj is data.buf
+    assert bytes(framed) == bytes(Buffer.pack_packet(packet))
+
+    for comp_thresh in (1, 256):  # compressed, and too small to be compressed
+        buf = Buffer(Buffer.frame_packet(Buffer.pack_packet_data(packet), comp_thresh))
+        assert buf.unpack_varint() == len(buf) - buf.pos
+        assert buf.unpack_packet(1, PACKET_MAP, comp_thresh).payload == 1234567890456
+
+    # plain bytes are framed too, they're just copied
+    assert bytes(Buffer.frame_packet(bytes(data.buf[data.pos :]))) == bytes(framed)
+
+
+def test_inflate():
+    from pymine.api.errors import InvalidPacketData
+    import zlib
+
+    data = Buffer.pack_string("a" * 4096)
+
+    buf = Buffer(Buffer.pack_varint(len(data)) + zlib.compress(data))
+    buf.inflate(buf.unpack_varint(), 256)
+    assert buf.unpack_string() == "a" * 4096
+
+    # larger than declared, like a zip bomb would be
+    buf = Buffer(Buffer.pack_varint(1024) + zlib.compress(bytes(1 << 20)))
+    with pytest.raises(InvalidPacketData):
+        buf.inflate(buf.unpack_varint(), 256)
+
+    # smaller than declared
+    buf = Buffer(Buffer.pack_varint(1024) + zlib.compress(bytes(512)))
+    with pytest.raises(InvalidPacketData):
+        buf.inflate(buf.unpack_varint(), 256)
+
+    # declared size is below the compression threshold
+    buf = Buffer(Buffer.pack_varint(16) + zlib.compress(bytes(16)))
+    with pytest.raises(InvalidPacketData):
+        buf.inflate(buf.unpack_varint(), 256)
+
+    buf = Buffer(Buffer.pack_varint(1024) + b"not zlib data")
+    with pytest.raises(InvalidPacketData):
+        buf.inflate(buf.unpack_varint(), 256)
@@ -0,0 +1,353 @@
+import random
+import pickle
+import numpy
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import pytest
+from pymine.util.codec import pack_long_array, unpack_long_array, pack_nibbles, unpack_nibbles
+from pymine.types.block_palette import DirectPalette
+from pymine.types.chunk import PalettedArray, NibbleArray, ChunkSection, Chunk
+from pymine.types.buffer import Buffer
+import pymine.types.nbt as nbt
+
+
+def pack_longs(values: list, bits: int, spanning: bool) -> list:  # simple reference implementation
+    longs = []
+
+    if spanning:
+        total = 0
+
+        for i, v in enumerate(values):
+            total |= v << (i * bits)
+
+        for i in range(-(-len(values) * bits // 64)):
+            longs.append((total >> (i * 64)) & 0xFFFFFFFFFFFFFFFF)
+    else:
+        per_long = 64 // bits
+
+        for i in range(0, len(values), per_long):
+            longs.append(sum(v << (j * bits) for j, v in enumerate(values[i : i + per_long])))
+
+    # longs are stored signed in nbt
+    return [(l - (1 << 64)) if l & (1 << 63) else l for l in longs]
+
+
+@pytest.mark.parametrize("bits", [1, 4, 5, 11, 12, 15])
+@pytest.mark.parametrize("spanning", [False, True])
+def test_unpack_long_array(bits, spanning):
+    values = [random.randrange(1 << bits) for _ in range(4096)]
+    longs = pack_longs(values, bits, spanning)
+
+    assert unpack_long_array(longs, bits, 4096, spanning).tolist() == values
+
+
+@pytest.mark.parametrize("bits", [4, 5, 8, 14, 15])
+def test_pack_long_array(bits):
+    values = [random.randrange(1 << bits) for _ in range(4096)]
+    longs = pack_long_array(values, bits)
+
+    assert len(longs) == -(-4096 // (64 // bits))
+    assert longs.view(numpy.int64).tolist() == pack_longs(values, bits, False)
+    assert unpack_long_array(longs, bits).tolist() == values
+
+
+@pytest.mark.parametrize("bits", [4, 5, 13, 15])
+def test_pack_long_array_spanning(bits):
+    values = [random.randrange(1 << bits) for _ in range(4096)]
+    longs = pack_long_array(values, bits, True)
+
+    assert longs.view(numpy.int64).tolist() == pack_longs(values, bits, True)
+    assert unpack_long_array(longs, bits, 4096, True).tolist() == values
+
+
+def test_section_from_nbt():
+    palette = [nbt.TAG_Compound("", [nbt.TAG_String("Name", f"minecraft:{i}")]) for i in range(20)]
+    states = [random.randrange(20) for _ in range(4096)]
+    light = bytearray(random.randrange(256) for _ in range(2048))
+
+    section = ChunkSection.from_nbt(
+        nbt.TAG_Compound(
+            "",
+            [
+                nbt.TAG_Byte("Y", 3),
+                nbt.TAG_List("Palette", palette),
+                nbt.TAG_Long_Array("BlockStates", pack_longs(states, 5, False)),
+                nbt.TAG_Byte_Array("BlockLight", light),
+            ],
+        )
+    )
+
+    assert section.y == 3
+    assert section.palette.get_bits_per_block() == 5
+    assert section.block_states.array().ravel().tolist() == states
+    assert section.block_states[1, 2, 3] == states[(1 * 16 + 2) * 16 + 3]
+    assert section.sky_light is None
+
+    expected_light = [n for b in light for n in (b & 0x0F, b >> 4)]
+    assert section.block_light.array().ravel().tolist() == expected_light
+    assert unpack_nibbles(bytes(light)).tolist() == expected_light
+
+
+def test_pack_chunk():
+    chunk = Chunk.new(3, -4, 0)
+
+    chunk.sections[0] = section = ChunkSection.new(0, DirectPalette)
+    section.block_states[0] = DirectPalette.encode("minecraft:bedrock")
+    section.block_states[1] = DirectPalette.encode("minecraft:dirt")
+    section.sky_light[2:] = 15
+
+    buf = Buffer(Buffer.pack_chunk_section_blocks(section))
+
+    assert buf.unpack("h") == 512  # two layers of non-air blocks
+    assert buf.unpack("B") == 15
+    longs = [buf.unpack("q") for _ in range(buf.unpack_varint())]
+    assert unpack_long_array(longs, 15).tolist() == numpy.ravel(section.block_states).tolist()
+
+    buf = Buffer(Buffer.pack_chunk_light(chunk))
+
+    assert (buf.unpack_varint(), buf.unpack_varint(), buf.unpack("?")) == (3, -4, True)
+    assert buf.unpack_varint() == 0b10  # sky light, section 0 is bit 1
+    assert buf.unpack_varint() == 0  # block light
+    assert buf.unpack_varint() == 0  # empty sky light
+    assert buf.unpack_varint() == 0b10  # empty block light
+
+    assert buf.unpack_varint() == 2048
+    assert unpack_nibbles(buf.read(2048)).tolist() == numpy.ravel(section.sky_light).tolist()
+    assert section.sky_light.packed() == bytes(buf.buf[-2048:])
+
+    from pymine.net.packets.play.chunk import PlayChunkData
+
+    # the packet is written into the buffer it's given, after what's there already
+    packet = PlayChunkData(chunk, True)
+    buf = packet.encode_into(Buffer().write(b"\x20"))
+
+    assert bytes(buf.buf) == b"\x20" + bytes(packet.encode())
+    assert buf.read(1) == b"\x20" and buf.unpack("ii?") == (3, -4, True)
+    assert buf.unpack_varint() == 0b1  # only section 0 has blocks
+
+
+def test_chunk_versions():
+    chunk = Chunk.new(0, 0, 0)
+    chunk.sections[0] = section = ChunkSection.new(0, DirectPalette)
+
+    packed = Buffer.pack_chunk_section_blocks(section)
+    assert Buffer.pack_chunk_section_blocks(section) is packed  # cached
+
+    chunk.encoded["test"] = True
+    assert not chunk.dirty
+
+    section.block_states[0] = DirectPalette.encode("minecraft:bedrock")
+    section.mark_changed()
+
+    assert chunk.dirty
+    assert "test" not in chunk.encoded
+    assert Buffer.pack_chunk_section_blocks(section) != packed
+
+    chunk.encoded["test"] = True
+    chunk.mark_changed()  # like when the biomes change
+
+    assert "test" not in chunk.encoded
+
+
+def test_chunk_nbytes():
+    chunk = Chunk.new(0, 0, 0)
+    size = chunk.nbytes
+
+    chunk.data["Extra"] = nbt.TAG_Compound(
+        "Extra", [nbt.TAG_Long_Array("Longs", numpy.zeros(10000, numpy.int64))]
+    )
+    assert chunk.nbytes >= size + 80000
+
+    # tags which weren't parsed yet count as their packed data
+    loaded = Chunk(nbt.unpack(Buffer(nbt.pack(chunk.to_nbt())), lazy=True), 0)
+    assert dict.__getitem__(loaded.data, "Extra").__class__ is nbt.TAG_Lazy
+    assert 80000 <= loaded.nbytes <= chunk.nbytes
+
+
+@pytest.mark.parametrize("data_version", [2586, 2230])
+def test_chunk_to_nbt(data_version):
+    chunk = Chunk.new(3, -4, 0)
+    chunk.data_version = data_version
+
+    chunk.sections[0] = section = ChunkSection.new(0, DirectPalette)
+    section.block_states[0] = DirectPalette.encode("minecraft:bedrock")
+    section.block_states[1:3] = DirectPalette.encode("minecraft:grass_block", {"snowy": "true"})
+    section.sky_light[3:] = 15
+
+    chunk.sections[-1] = light_only = ChunkSection(-1, None)
+    light_only.sky_light = NibbleArray(15)
+
+    tag = nbt.TAG_Compound.unpack(Buffer(chunk.to_nbt().pack()))
+    loaded = Chunk(tag, 0)
+
+    assert (loaded.x, loaded.z, loaded.data_version) == (3, -4, data_version)
+    assert sorted(loaded.sections) == [-1, 0]
+    assert loaded.sections[-1].block_states is None
+    assert loaded.sections[-1].sky_light.value == 15
+
+    palette = loaded.sections[0].palette
+    assert len(palette) == 3  # air, bedrock, and grass
+    assert (
+        palette.global_ids[loaded.sections[0].block_states.array()].tolist()
+        == section.block_states.array().tolist()
+    )
+    assert palette.decode(palette.encode("minecraft:grass_block", {"snowy": "true"}))["properties"]
+    assert loaded.sections[0].sky_light.packed() == section.sky_light.packed()
+    assert loaded.sections[0].block_light.value == 0
+
+    assert loaded.to_nbt().pack() == chunk.to_nbt().pack()
+    assert loaded["Biomes"] == chunk["Biomes"]
+
+
+def test_paletted_array():
+    states = PalettedArray(0)
+    expected = numpy.zeros((16, 16, 16), numpy.int32)
+    assert states.mode == "single"
+
+    states[0] = expected[0] = 7
+    states[1, 2, 3] = expected[1, 2, 3] = 9
+    assert states.mode == "indirect"
+    assert states.data.dtype == numpy.uint8
+
+    values = (numpy.arange(256, dtype=numpy.int32) % 200 + 20000).reshape(16, 16)
+    states[5] = expected[5] = values
+    assert states.mode == "indirect"
+
+    states[6] = expected[6] = numpy.arange(256).reshape(16, 16) + 30000  # too many for a palette
+    assert states.mode == "direct"
+    assert states.data.dtype == numpy.uint16
+
+    assert states[1, 2, 3] == 9
+    assert states[5].tolist() == values.tolist()
+    assert states.array().tolist() == expected.tolist()
+
+    assert PalettedArray.from_array(expected).array().tolist() == expected.tolist()
+    assert PalettedArray.from_array(numpy.full((16, 16, 16), 4)).mode == "single"
+
+    states[:] = 4  # direct mode only goes back to single mode once compacted
+    assert states.mode == "direct"
+    states.compact()
+    assert states.mode == "single" and states.value == 4
+
+    states[0, 0] = 5
+    states.compact()
+    assert states.mode == "indirect" and states[0, 0, 0] == 5
+
+    # reads in single value mode give writable arrays
+    single = PalettedArray(3)
+    layer = single[0]
+    layer += 1
+    assert layer.tolist() == [[4] * 16] * 16 and single[0, 0, 0] == 3
+
+    # integer keys don't create the whole array, the results match the other modes
+    full = numpy.full((16, 16, 16), 3, numpy.int32)
+    assert single[-1, 15, numpy.int64(2)] == 3 and single.data is None
+    assert single[2, 5].tolist() == full[2, 5].tolist()
+    assert single[1:3, 0].tolist() == full[1:3, 0].tolist()
+    assert single[[0, 1], [2, 3], [4, 5]].tolist() == [3, 3]
+
+    with pytest.raises(IndexError):
+        single[16, 0, 0]
+
+
+def test_nibble_array():
+    light = NibbleArray(15)
+    assert light.packed() == b"\xff" * 2048
+    assert light.any() and light.data is None
+
+    light[3:] = 0
+    assert light.data is None  # only packed once the packed values are needed
+    assert light[2, 5, 5] == 15 and light[3, 5, 5] == 0
+    assert light.packed() == pack_nibbles(light.array())
+    assert light.data is not None
+
+    light[:3] = 0
+    assert not light.any()
+    light.packed()
+    assert light.data is None and light.value == 0
+
+    assert NibbleArray.from_bytes(b"\x77" * 2048).value == 7
+    assert NibbleArray.from_bytes(light.packed()).data is None
+
+    light[1, 2, 3] += 4
+    light[1, 2] += 1
+    assert light[1, 2, 3] == 5 and light[1, 2, 4] == 1 and light.any()
+
+    pickled = pickle.loads(pickle.dumps(light))
+    assert pickled.array().tolist() == light.array().tolist()
+
+
+def test_block_palettes():
+    from pymine.types.block_palette import IndirectPalette, BLOCK_STATES
+
+    for state_id in random.sample(range(len(BLOCK_STATES.data_reversed)), 500):
+        block = DirectPalette.decode(state_id)
+        assert DirectPalette.encode(block["name"], block["properties"]) == state_id
+
+    assert DirectPalette.encode("minecraft:grass_block") == 9  # the default state
+    assert DirectPalette.encode("minecraft:grass_block", {"snowy": "true"}) == 8
+
+    with pytest.raises(ValueError):
+        DirectPalette.encode("minecraft:grass_block", {"snowy": "maybe"})
+
+    palette = IndirectPalette.from_nbt(
+        nbt.TAG_List(
+            "Palette",
+            [
+                nbt.TAG_Compound("", [nbt.TAG_String("Name", "minecraft:air")]),
+                nbt.TAG_Compound(
+                    "",
+                    [
+                        nbt.TAG_String("Name", "minecraft:grass_block"),
+                        nbt.TAG_Compound("Properties", [nbt.TAG_String("snowy", "true")]),
+                    ],
+                ),
+                nbt.TAG_Compound("", [nbt.TAG_String("Name", "minecraft:not_a_block")]),
+            ],
+        ),
+        4,
+    )
+
+    assert palette.global_ids.tolist() == [0, 8, 0]
+    assert palette.encode("minecraft:grass_block", {"snowy": "true"}) == 1
+    assert palette.decode(1)["name"] == "minecraft:grass_block"
+
+    # blocks which aren't in the palette yet are added to it
+    stone = DirectPalette.encode("minecraft:stone")
+    assert palette.encode("minecraft:stone") == 3
+    assert palette.encode("minecraft:stone") == 3
+    assert palette.global_ids.tolist() == [0, 8, 0, stone]
+
+    # unknown blocks are air on the wire, but are saved as they were loaded
+    section = ChunkSection(0, palette)
+    section.block_states = PalettedArray(0)
+    section.block_states[0] = 2
+    section.block_states[1] = 3
+
+    saved = section.to_nbt()
+    assert [b["Name"].data for b in saved["Palette"]] == [
+        "minecraft:air",
+        "minecraft:not_a_block",
+        "minecraft:stone",
+    ]
+
+    loaded = ChunkSection.from_nbt(saved)
+    assert loaded.palette.global_ids[loaded.block_states[0, 0, 0]] == 0
+    assert loaded.to_nbt().pack() == saved.pack()
+
+    # palettes with more than 8 bits per block are sent as direct palettes
+    section = ChunkSection(0, IndirectPalette([0, 8], 9))
+    section.block_states = PalettedArray(0)
+    section.block_states[0] = 1
+
+    buf = Buffer(Buffer.pack_chunk_section_blocks(section))
+
+    assert buf.unpack("h") == 256
+    assert buf.unpack("B") == DirectPalette.get_bits_per_block()
+    longs = [buf.unpack("q") for _ in range(buf.unpack_varint())]
+    assert unpack_long_array(longs, DirectPalette.get_bits_per_block())[:257].tolist() == [
+        8
+    ] * 256 + [0]
@@ -0,0 +1,97 @@
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from pymine.types.chunk import Chunk, ChunkSection
+from pymine.types.block_palette import DirectPalette
+from pymine.types.chunk_cache import ChunkCache
+import pymine.types.chunk as chunk_module
+
+
+def new_chunk(x: int, z: int) -> Chunk:
+    chunk = Chunk.new(x, z, 0)
+
+    chunk.sections[0] = ChunkSection.new(0, DirectPalette)
+    chunk.sections[0].block_states[0] = DirectPalette.encode("minecraft:bedrock")  # 4 KiB
+
+    return chunk
+
+
+def test_lru_eviction():
+    cache = ChunkCache(3, 1 << 30)
+
+    for x in range(3):
+        assert cache.put((x, 0), new_chunk(x, 0)) == []
+
+    assert cache.get((0, 0)) is not None  # (1, 0) is the least recently used now
+    assert cache.get((5, 0)) is None
+
+    evicted = cache.put((3, 0), new_chunk(3, 0))
+
+    assert [key for key, chunk in evicted] == [(1, 0)]
+    assert (1, 0) not in cache and (0, 0) in cache
+    assert (cache.hits, cache.misses, cache.evictions) == (1, 1, 1)
+
+
+def test_byte_budget():
+    cache = ChunkCache(100, 3 * new_chunk(0, 0).nbytes)
+
+    for x in range(3):
+        cache.put((x, 0), new_chunk(x, 0))
+
+    assert cache.resident_bytes == 3 * new_chunk(0, 0).nbytes
+
+    chunk = cache.get((0, 0))
+    chunk.encoded["data"] = {"packet": bytes(100)}  # cached packets count too
+    assert cache.get((0, 0)) is chunk
+
+    assert [key for key, chunk in cache.evict()] == [(1, 0)]
+    assert len(cache) == 2
+
+
+def test_measure_on_change(monkeypatch):
+    cache = ChunkCache(100, 1 << 30)
+    chunk = new_chunk(0, 0)
+    cache.put((0, 0), chunk)
+
+    size = chunk.nbytes
+    assert cache.resident_bytes == size
+
+    walks = []
+    monkeypatch.setattr(chunk_module, "tag_nbytes", lambda tag: walks.append(tag) or 0)
+
+    # hits don't walk the Level data again, only the cached encoded data is measured
+    chunk.encoded["data"] = {"packet": bytes(100)}
+    assert cache.get((0, 0)) is chunk and cache.resident_bytes == size + 100
+
+    chunk.encoded["data"] = {"packet": bytes(40)}
+    assert cache.get((0, 0)) is chunk and cache.resident_bytes == size + 40
+    assert walks == []
+
+    chunk.sections[0].block_states[1] = DirectPalette.encode("minecraft:stone")
+    chunk.sections[0].mark_changed()  # changed, so it's measured again
+
+    assert cache.get((0, 0)) is chunk and walks != []
+    assert cache.resident_bytes == chunk.nbytes
+
+
+def test_tickets():
+    cache = ChunkCache(2, 1 << 30)
+
+    cache.set_ticket("a", [(0, 0), (1, 0)])
+    cache.set_ticket("b", [(1, 0), (2, 0)])
+
+    for x in range(4):
+        cache.put((x, 0), new_chunk(x, 0))
+
+    # pinned chunks are never evicted, even though there are more than 2 cached
+    assert len(cache) == 3 and (3, 0) not in cache
+    assert cache.stats()["pinned"] == 3
+
+    evicted = cache.remove_ticket("a")  # (1, 0) is still pinned by b
+    assert [key for key, chunk in evicted] == [(0, 0)]
+    assert (1, 0) in cache and (2, 0) in cache
+
+    cache.set_ticket("b", [(2, 0)])
+    assert len(cache) == 2 and cache.stats()["tickets"] == 1
@@ -1,10 +1,15 @@
+import pickle
+import numpy
 import math
 import gzip
+import zlib
+import io
 import sys
 import os
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
+import pytest
 from pymine.types.buffer import Buffer
 import pymine.types.nbt as nbt
 
@@ -42,3 +47,163 @@ def test_values_nantest():  # tests that the values for loading the nantest are
         assert len(tag["Rotation"]) == 2
         assert tag["Rotation"][0].data == 164.3999481201172
         assert tag["Rotation"][1].data == -63.150203704833984
+
+
+def test_pickle():  # tags are pickled to send chunks between processes
+    with open(os.path.join("tests", "sample_data", "bigtest.nbt"), "rb") as nbt_file:
+        tag = nbt.unpack(Buffer(nbt_file.read()))
+
+    unpickled = pickle.loads(pickle.dumps(tag))
+
+    assert unpickled.pack() == tag.pack()
+    assert unpickled.pretty() == tag.pretty()  # the names are kept too
+
+
+def test_roundtrip():  # covers the cases bigtest doesn't, like non-ascii names and empty lists
+    tag = nbt.TAG_Compound(
+        "",
+        [
+            nbt.TAG_String("ascii", "plain"),
+            nbt.TAG_String("nééd\u0000s mütf8 \U0001f600", "é\u0000\U0001f600"),
+            nbt.TAG_Int_Array("ints", [-(2**31), -1, 0, 1, 2**31 - 1]),
+            nbt.TAG_Long_Array("longs", [-(2**63), -1, 0, 2**63 - 1]),
+            nbt.TAG_Long_Array("empty longs", []),
+            nbt.TAG_Byte_Array("bytes", b"\x00\xff\x80"),
+            nbt.TAG_List("empty", []),
+            nbt.TAG_List(
+                "lists", [nbt.TAG_List(None, [nbt.TAG_Short(None, -5)]), nbt.TAG_List(None, [])]
+            ),
+            nbt.TAG_Compound("nested", [nbt.TAG_Double("d", 0.5), nbt.TAG_Float("f", -2.0)]),
+        ],
+    )
+
+    unpacked = nbt.TAG_Compound.unpack(Buffer(tag.pack()))
+
+    assert unpacked.pack() == tag.pack()
+    assert unpacked["nééd\u0000s mütf8 \U0001f600"].data == "é\u0000\U0001f600"
+    assert unpacked["longs"] == [-(2**63), -1, 0, 2**63 - 1]
+    assert unpacked["lists"][0][0].data == -5
+
+
+def test_lazy():  # lazy tags are parsed when they're accessed, and packed as they were read
+    with open(os.path.join("tests", "sample_data", "bigtest.nbt"), "rb") as nbt_file:
+        buf = Buffer(nbt_file.read())
+
+    tag = nbt.unpack(buf, lazy=True)
+
+    assert tag.pack() == buf.buf
+    assert isinstance(dict.__getitem__(tag, "nested compound test"), nbt.TAG_Lazy)
+    assert tag["nested compound test"]["egg"]["name"].data == "Eggbert"
+    assert isinstance(tag["nested compound test"], nbt.TAG_Compound)
+    assert tag["listTest (long)"][2].data == 13
+    assert tag.pack() == buf.buf
+
+    unpickled = pickle.loads(pickle.dumps(nbt.unpack(Buffer(buf.buf), lazy=True)))
+
+    assert unpickled.pack() == buf.buf
+    assert unpickled.pretty() == nbt.unpack(Buffer(buf.buf)).pretty()
+
+
+def test_paths():  # only the tags at the given paths are parsed
+    with open(os.path.join("tests", "sample_data", "bigtest.nbt"), "rb") as nbt_file:
+        buf = Buffer(nbt_file.read())
+
+    tag = nbt.unpack(buf, paths=["intTest", "nested compound test/egg", "listTest (compound)"])
+
+    assert list(tag) == ["intTest", "nested compound test", "listTest (compound)"]
+    assert tag["intTest"].data == 2147483647
+    assert list(tag["nested compound test"]) == ["egg"]
+    assert tag["nested compound test"]["egg"]["value"].data == 0.5
+    assert tag["listTest (compound)"][1]["name"].data == "Compound tag #1"
+
+
+def test_pack_compressed():  # the data is compressed as it's packed, in multiple parts if needed
+    tag = nbt.TAG_Compound(
+        "root",
+        [nbt.TAG_Long_Array(f"longs {i}", list(range(i, i + 100))) for i in range(200)],
+    )
+    packed = tag.pack()
+
+    assert len(packed) > 65536 * 2
+    assert nbt.unpack(Buffer(packed)).pack() == packed
+    assert gzip.decompress(nbt.pack(tag, "gzip")) == packed
+    assert zlib.decompress(nbt.pack(tag, "zlib")) == packed
+
+    file = io.BytesIO()
+
+    assert nbt.pack(tag, "gzip", file) is None
+    assert nbt.unpack(Buffer(file.getvalue())).pack() == packed
+
+
+def test_plain():  # plain values pack back into the same data with their schema
+    with open(os.path.join("tests", "sample_data", "bigtest.nbt"), "rb") as nbt_file:
+        buf = Buffer(nbt_file.read())
+
+    value, schema = nbt.unpack(buf, plain=True)
+
+    assert value["nested compound test"]["egg"]["name"] == "Eggbert"
+    assert value["listTest (long)"] == [11, 12, 13, 14, 15]
+    assert schema["listTest (long)"] == (nbt.TAG_Long.id, None)
+    assert nbt.from_plain(value, schema, "Level").pack() == nbt.unpack(Buffer(buf.buf)).pack()
+
+    tag = nbt.TAG_Compound("", [nbt.TAG_Long_Array("longs", [-(2**63), 5]), nbt.TAG_List("e", [])])
+    value, schema = nbt.unpack(Buffer(tag.pack()), plain=True)
+
+    assert value["longs"].dtype == numpy.int64 and value["longs"].tolist() == [-(2**63), 5]
+    assert nbt.from_plain(value, schema, "").pack() == tag.pack()
+
+
+def test_slots():  # tags have no __dict__, to keep the memory used by big trees of them down
+    for tag in (
+        nbt.TAG_Int("a", 1),
+        nbt.TAG_String("b", "c"),
+        nbt.TAG_List("d", []),
+        nbt.TAG_Compound("e", []),
+        nbt.TAG_Long_Array("f", [1]),
+        nbt.TAG_Byte_Array("g", b""),
+    ):
+        assert not hasattr(tag, "__dict__")
+
+
+def test_snbt():  # the shipped snbt dimension codec is the same as the binary one
+    with open(
+        os.path.join("pymine", "data", "default_nbt", "dimension_codec.snbt"), "r", encoding="utf8"
+    ) as f:
+        codec = nbt.from_snbt(f.read())
+
+    with open(os.path.join("pymine", "data", "default_nbt", "dimension_codec.nbt"), "rb") as f:
+        packed = nbt.unpack(Buffer(f.read()), root_is_full=False).pack()
+
+    assert codec.pack() == packed
+    assert nbt.from_snbt(nbt.to_snbt(codec)).pack() == packed
+    assert nbt.from_snbt(nbt.to_snbt(codec, 4)).pack() == packed
+
+    with open(os.path.join("tests", "sample_data", "bigtest.nbt"), "rb") as nbt_file:
+        tag = nbt.unpack(Buffer(nbt_file.read()))
+
+    assert nbt.from_snbt(nbt.to_snbt(tag), "Level").pack() == tag.pack()
+
+    tag = nbt.from_snbt('{\'a b\': "q\\"", c: [B; -1b, 2b], d: [], e: true, f: 1e3, g: 128b}')
+
+    assert nbt.to_snbt(tag) == '{"a b":"q\\"",c:[B;-1b,2b],d:[],e:1b,f:"1e3",g:"128b"}'
+
+
+def test_load_dim_codec(tmp_path):  # codec files can have a root tag header or not
+    from pymine.data.default_nbt.dimension_codec import load_dim_codec
+
+    codec, packed = load_dim_codec()
+    assert len(packed) == 30478
+
+    shipped = os.path.join("pymine", "data", "default_nbt", "dimension_codec.nbt")
+    assert load_dim_codec(shipped)[1] == packed  # no header
+
+    with open(os.path.join(tmp_path, "full.nbt"), "wb") as f:
+        f.write(nbt.pack(codec, "gzip"))  # with a header, like files written by the game
+
+    assert load_dim_codec(os.path.join(tmp_path, "full.nbt"))[1] == packed
+
+    with open(os.path.join(tmp_path, "truncated.nbt"), "wb") as f:
+        f.write(nbt.pack(codec)[:-100])
+
+    with pytest.raises(ValueError):
+        load_dim_codec(os.path.join(tmp_path, "truncated.nbt"))
@@ -0,0 +1,184 @@
+import asyncio
+import types
+import uuid
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from pymine.net.packets.status.status import StatusStatusPingPong
+from pymine.types.buffer import Buffer
+from pymine.server import Server
+
+
+class FakeStream:
+    """Records what's written to it, stands in for a Stream."""
+
+    def __init__(self) -> None:
+        self.written = []
+        self.outbound = types.SimpleNamespace(backlogged=False)
+
+    def write(self, data) -> None:
+        self.written.append(bytes(data))
+
+
+class FakePlayer:
+    def __init__(self, dimension: str, x: float, y: float, z: float) -> None:
+        self.uuid = uuid.uuid4()
+        self.stream = FakeStream()
+        self.dimension = dimension
+        self.x, self.y, self.z = x, y, z
+
+    def __getitem__(self, key: str):
+        assert key == "Dimension"
+        return types.SimpleNamespace(data=self.dimension)
+
+
+def new_server(*players) -> Server:
+    server = Server.__new__(Server)  # only what packets are sent with is set up
+
+    server.console = types.SimpleNamespace(debug=lambda *args: None)
+    server.comp_thresh = -1
+    server.comp_level = 6
+    server.comp_offload_size = 1 << 20
+    server.packet_cache = {}
+    server.playerio = types.SimpleNamespace(cache={p.uuid: p for p in players})
+
+    return server
+
+
+def unpack(data: bytes) -> tuple:
+    buf = Buffer(data)
+    buf.unpack_varint()  # length
+
+    return buf.unpack_varint(), buf.unpack("q")
+
+
+def test_broadcast_filters():
+    a = FakePlayer("minecraft:overworld", 0, 64, 0)
+    b = FakePlayer("minecraft:overworld", 100, 64, 0)
+    c = FakePlayer("minecraft:the_nether", 0, 64, 0)
+    d = FakePlayer("minecraft:overworld", 0, 64, 0)
+    d.stream = None  # still logging in
+
+    server = new_server(a, b, c, d)
+
+    def broadcast(payload, **kwargs):
+        asyncio.run(server.broadcast_packet(StatusStatusPingPong(payload), **kwargs))
+
+        return {
+            p for p in (a, b, c) if p.stream.written and unpack(p.stream.written[-1])[1] == payload
+        }
+
+    assert broadcast(1) == {a, b, c}
+    assert broadcast(2, world="minecraft:overworld") == {a, b}
+    assert broadcast(3, near=(90, 64, 0, 10)) == {b}
+    assert broadcast(4, near=(0, 64, 0, 10), world="minecraft:overworld") == {a}
+    assert broadcast(5, uuids={a.uuid, c.uuid}) == {a, c}
+    assert broadcast(6, uuids=set()) == set()
+
+    # every recipient gets the same data, which is encoded once
+    assert a.stream.written[0] == b.stream.written[0] == c.stream.written[0]
+    assert unpack(a.stream.written[0]) == (StatusStatusPingPong.id, 1)
+
+
+def test_broadcast_backlogged():
+    a = FakePlayer("minecraft:overworld", 0, 64, 0)
+    b = FakePlayer("minecraft:overworld", 0, 64, 0)
+    server = new_server(a, b)
+
+    flushed = []
+
+    async def flush():
+        flushed.append(b)
+
+    b.stream.outbound.backlogged = True
+    b.stream.flush = flush
+
+    asyncio.run(server.broadcast_packet(StatusStatusPingPong(1)))
+
+    assert flushed == [b] and len(a.stream.written) == len(b.stream.written) == 1
+
+
+def test_cached_packets():
+    a = FakePlayer("minecraft:overworld", 0, 64, 0)
+    b = FakePlayer("minecraft:overworld", 0, 64, 0)
+    server = new_server(a, b)
+
+    created = []
+
+    class CountedPingPong(StatusStatusPingPong):
+        def __init__(self, payload: int) -> None:
+            super().__init__(payload)
+            created.append(payload)
+
+    async def send(stream, key, payload, **kwargs):
+        await server.send_cached_packet(stream, key, CountedPingPong, payload, **kwargs)
+
+        return unpack(stream.written[-1])[1]
+
+    async def send_all():
+        assert await send(a.stream, "commands", 1) == 1
+        assert await send(b.stream, "commands", 2) == 1  # a hit, the args aren't used
+        assert await send(a.stream, "tags", 3) == 3
+        assert created == [1, 3]
+
+        # each compression threshold has its own entry
+        await send(a.stream, "commands", 4, comp_thresh=256)
+        assert created == [1, 3, 4] and server.packet_cache["commands"].keys() == {
+            (CountedPingPong, -1),
+            (CountedPingPong, 256),
+        }
+
+        server.invalidate_packet_cache("commands", "unknown")
+
+        assert await send(a.stream, "commands", 5) == 5
+        assert await send(a.stream, "tags", 6) == 3  # not invalidated
+
+        server.invalidate_packet_cache()
+
+        assert server.packet_cache == {}
+        assert await send(a.stream, "tags", 7) == 7
+
+        # a cache of its own, like a chunk's encoded packets
+        cache = {}
+        assert await send(a.stream, "data", 8, cache=cache) == 8
+        assert "data" in cache and "data" not in server.packet_cache
+
+    asyncio.run(send_all())
+
+
+def test_handle_compressed_login_packet():
+    stream = FakeStream()
+    stream.remote = ("127.0.0.1", 25565)
+
+    received = []
+
+    async def login_start(stream, packet):
+        received.append(packet.username)
+
+    server = new_server()
+    server.cache = Server.Cache()
+    server.api = types.SimpleNamespace(
+        register=types.SimpleNamespace(_on_packet={2: {0x00: {"login_start": login_start}}})
+    )
+
+    def frame(comp_thresh: int) -> Buffer:
+        buf = Buffer()
+
+        if comp_thresh > 0:  # small packets are sent with an uncompressed length of 0
+            buf.write_varint(0)
+
+        return Buffer(buf.write_varint(0x00).write_string("bob").buf)
+
+    async def handle_all():
+        server.cache.states[stream.remote] = 2  # login
+        await server.handle_packet(stream, frame(-1))
+
+        # compression is enabled during login, the following login packets are compressed too
+        server.cache.comp_thresh[stream.remote] = 256
+        await server.handle_packet(stream, frame(256))
+
+    asyncio.run(handle_all())
+
+    assert received == ["bob", "bob"]
@@ -0,0 +1,538 @@
+import asyncio
+import random
+import pytest
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from pymine.types.stream import (
+    ConnectionProtocol,
+    EncryptedStream,
+    FrameReader,
+    OutboundQueue,
+    Stream,
+)
+from pymine.util.encryption import gen_aes_cipher
+from pymine.api.errors import StopHandling
+from pymine.types.buffer import Buffer
+
+KEY = bytes(range(16))
+
+
+class Transport(asyncio.Transport):
+    """A transport which records everything written to it instead of sending it."""
+
+    def __init__(self) -> None:
+        super().__init__()
+
+        self.written = []
+        self.buffered = 0
+        self.paused = False
+        self.closing = False
+
+    def get_extra_info(self, name, default=None):
+        return ("127.0.0.1", 25565) if name == "peername" else default
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        pass
+
+    def get_write_buffer_size(self):
+        return self.buffered
+
+    def write(self, data):
+        self.written.append(bytes(data))
+
+    def writelines(self, data):
+        self.written.append([bytes(d) for d in data])
+
+    def is_closing(self):
+        return self.closing
+
+    def close(self):
+        self.closing = True
+
+    def pause_reading(self):
+        self.paused = True
+
+    def resume_reading(self):
+        self.paused = False
+
+
+def new_stream() -> Stream:
+    reader = asyncio.StreamReader()
+    protocol = asyncio.StreamReaderProtocol(reader)
+
+    # like for a real connection the protocol keeps the writer, which closes the transport if collected
+    protocol._stream_writer = asyncio.StreamWriter(
+        Transport(), protocol, reader, asyncio.get_event_loop()
+    )
+
+    return Stream(reader, protocol._stream_writer)
+
+
+def frame(data: bytes) -> bytes:
+    return Buffer.pack_varint(len(data)) + data
+
+
+def split(data: bytes, sizes: list) -> list:
+    fragments = []
+
+    for size in sizes:
+        fragments.append(data[:size])
+        data = data[size:]
+
+    return fragments + [data] if data else fragments
+
+
+async def read_frames(frames: FrameReader, fragments: list) -> list:
+    """Feeds the fragments one at a time, returns the payload of each complete frame."""
+
+    payloads = []
+
+    for fragment in fragments:
+        reader = frames.stream._reader
+        reader.feed_data(fragment)
+
+        while reader._buffer:  # fragments larger than chunk_size take several reads
+            await frames.fill()
+
+            buf = frames.next_frame()
+
+            while buf is not None:
+                payloads.append(buf.read())
+                buf = frames.next_frame()
+
+    return payloads
+
+
+def test_partial_reads():
+    payloads = [b"\x00", bytes(range(100)), b"\x01" * 300, b"", b"\x02" * 70000, b"\x03\x04"]
+    data = b"".join(frame(p) for p in payloads)
+
+    async def read_all():
+        rand = random.Random(0)
+
+        for sizes in ([len(data)], [1] * 400, [rand.randint(1, 1000) for _ in range(100)]):
+            frames = FrameReader(new_stream(), chunk_size=1024)
+
+            try:
+                assert await read_frames(frames, split(data, sizes)) == payloads
+                assert frames.start == frames.end
+            finally:
+                frames.close()
+
+    asyncio.run(read_all())
+
+
+def test_split_length_prefix():
+    payload = bytes(range(256)) * 2  # 2 byte length prefix
+
+    async def read_all():
+        for first in (1, 2):
+            frames = FrameReader(new_stream())
+
+            try:
+                data = frame(payload) + frame(b"\x05")
+                frames.stream._reader.feed_data(data[:first])
+                await frames.fill()
+
+                assert frames.next_frame() is None
+                assert frames.start == 0  # nothing is consumed until the whole frame is there
+
+                assert await read_frames(frames, [data[first:]]) == [payload, b"\x05"]
+            finally:
+                frames.close()
+
+    asyncio.run(read_all())
+
+
+def test_frames_in_place():
+    async def read_all():
+        frames = FrameReader(new_stream(), chunk_size=64)
+
+        try:
+            data = frame(b"\x01" * 10) + frame(b"\x02" * 10) + frame(b"\x03" * 200)
+            frames.stream._reader.feed_data(data[:30])
+            await frames.fill()
+
+            first, second = frames.next_frame(), frames.next_frame()
+
+            assert first.buf.obj is frames.recv_buf and second.buf.obj is frames.recv_buf
+            assert first.read() == b"\x01" * 10
+
+            del first
+            leaked = memoryview(frames.recv_buf)  # the receive buffer can't be resized in place
+
+            # the receive buffer is compacted and grown, the frame which is still held is copied
+            assert await read_frames(frames, [data[30:]]) == [b"\x03" * 200]
+            assert isinstance(second.buf, bytes) and second.read() == b"\x02" * 10
+            assert leaked.obj is not frames.recv_buf
+
+            leaked.release()
+        finally:
+            frames.close()
+
+    asyncio.run(read_all())
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"\x80\x80\x80\x01",  # 4 byte length, over the maximum frame size
+        Buffer.pack_varint(-1),  # negative length, which is encoded as 5 bytes
+        b"\xfe\x01",  # legacy ping
+    ],
+)
+def test_invalid_lengths(data):
+    async def read_all():
+        frames = FrameReader(new_stream())
+
+        try:
+            with pytest.raises(StopHandling):
+                await read_frames(frames, [data])
+        finally:
+            frames.close()
+
+    asyncio.run(read_all())
+
+
+def test_end_of_stream():
+    async def read_all():
+        frames = FrameReader(new_stream())
+
+        try:
+            frames.stream._reader.feed_eof()
+
+            with pytest.raises(StopHandling):
+                await frames.fill()
+        finally:
+            frames.close()
+
+    asyncio.run(read_all())
+
+
+def test_encryption_switch():
+    plain = [b"\x00" + bytes(100), b"\x01" * 20]
+    encrypted = [b"\x02" * 300, b"\x03", b"\x04" * 5000]
+
+    async def read_all():
+        stream = new_stream()
+        frames = FrameReader(stream)
+
+        try:
+            # the first encrypted frames arrive in the same read as the last plain frame
+            ciphertext = gen_aes_cipher(KEY).encryptor().update(b"".join(map(frame, encrypted)))
+            data = b"".join(map(frame, plain)) + ciphertext[:400]
+
+            stream._reader.feed_data(data)
+            await frames.fill()
+
+            assert frames.next_frame().read() == plain[0]
+            assert frames.next_frame().read() == plain[1]
+
+            frames.switch_stream(EncryptedStream(stream, gen_aes_cipher(KEY)))
+
+            payloads = []
+            buf = frames.next_frame()
+
+            while buf is not None:
+                payloads.append(buf.read())
+                buf = frames.next_frame()
+
+            payloads += await read_frames(frames, split(ciphertext[400:], [1, 7, 100, 1000]))
+
+            assert payloads == encrypted
+        finally:
+            frames.close()
+
+    asyncio.run(read_all())
+
+
+class FrameServer:
+    """Stands in for the server, collects the payload of every frame received by a protocol."""
+
+    def __init__(self) -> None:
+        self.payloads = []
+        self.stopped = False
+
+    async def handle_frames(self, stream, frames):
+        while True:
+            buf = frames.next_frame()
+
+            if buf is None:
+                try:
+                    await frames.fill()
+                except StopHandling:
+                    break
+
+                continue
+
+            self.payloads.append(buf.read())
+
+        frames.close()
+        self.stopped = True
+
+
+def receive(protocol: ConnectionProtocol, data: bytes) -> None:
+    """Delivers data to the protocol the way a transport does."""
+
+    view = protocol.get_buffer(-1)
+    assert len(view) >= len(data)
+
+    view[: len(data)] = data
+    protocol.buffer_updated(len(data))
+
+
+def test_protocol_receive():
+    payloads = [b"\x00", b"\x01" * 300, b"\x02" * 200000]
+    data = b"".join(map(frame, payloads))
+
+    async def receive_all():
+        server = FrameServer()
+        protocol = ConnectionProtocol(server)
+        protocol.connection_made(Transport())
+
+        for fragment in split(data, [1, 1, 1000, 50000, 3]):
+            while fragment:  # a transport never writes more than get_buffer() returned
+                size = min(len(fragment), protocol.frames.chunk_size)
+                receive(protocol, fragment[:size])
+                fragment = fragment[size:]
+
+                await asyncio.sleep(0)
+
+        assert server.payloads == payloads
+
+        protocol.connection_lost(None)
+        await asyncio.sleep(0)
+
+        assert server.stopped
+
+    asyncio.run(receive_all())
+
+
+def test_protocol_pause_reading():
+    async def receive_all():
+        server = FrameServer()
+        transport = Transport()
+        protocol = ConnectionProtocol(server)
+        protocol.connection_made(transport)
+        protocol.frames.max_buffered = 1000
+
+        # the handler doesn't run in between, so the data piles up in the receive buffer
+        for i in range(3):
+            receive(protocol, frame(bytes([i]) * 400))
+
+        assert transport.paused
+
+        await asyncio.sleep(0)
+
+        # the handler consumed everything and is waiting for more, so reading is resumed
+        assert server.payloads == [bytes([i]) * 400 for i in range(3)]
+        assert not transport.paused
+
+        protocol.eof_received()
+        await asyncio.sleep(0)
+
+        assert server.stopped
+
+    asyncio.run(receive_all())
+
+
+def test_protocol_stream():
+    async def write_all():
+        transport = Transport()
+        protocol = ConnectionProtocol(FrameServer())
+        protocol.connection_made(transport)
+
+        stream = protocol.stream
+
+        assert stream.remote == ("127.0.0.1", 25565)
+
+        stream.write(b"\x01")
+        stream.writelines([b"\x02", b"\x03"])
+        await stream.flush()
+
+        assert transport.written == [[b"\x01", b"\x02", b"\x03"]]
+
+        protocol.pause_writing()  # the transport's write buffer is full
+        flush = asyncio.ensure_future(stream.flush())
+        await asyncio.sleep(0)
+
+        assert not flush.done()
+
+        protocol.resume_writing()
+        await flush
+
+        stream.close()
+        protocol.connection_lost(None)
+
+        await stream.wait_closed()
+        assert transport.closing
+
+    asyncio.run(write_all())
+
+
+def test_outbound_coalescing():
+    async def write_all():
+        transport = Transport()
+        queue = OutboundQueue(transport, asyncio.get_running_loop())
+
+        queue.put(b"\x01")
+        queue.put(b"\x02\x03")
+        queue.put(b"\x04")
+
+        assert transport.written == [] and queue.size == 4
+
+        await asyncio.sleep(0)
+
+        # everything put during one loop iteration is written with one call
+        assert transport.written == [[b"\x01", b"\x02\x03", b"\x04"]]
+        assert queue.pending == [] and queue.size == 0
+
+    asyncio.run(write_all())
+
+
+def test_outbound_flush_order():
+    async def write_all():
+        transport = Transport()
+        queue = OutboundQueue(transport, asyncio.get_running_loop())
+
+        queue.put(b"\x01")
+        queue.write()  # a flush, the write scheduled by put() finds nothing left
+        queue.put(b"\x02")
+        queue.put(b"\x03")
+
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+        assert transport.written == [[b"\x01"], [b"\x02", b"\x03"]]
+
+        transport.closing = True
+        queue.put(b"\x04")
+        await asyncio.sleep(0)
+
+        assert transport.written == [[b"\x01"], [b"\x02", b"\x03"]] and queue.size == 0
+
+    asyncio.run(write_all())
+
+
+def test_outbound_backpressure():
+    async def write_all():
+        transport = Transport()
+        queue = OutboundQueue(transport, asyncio.get_running_loop(), high_water=100, low_water=10)
+
+        queue.put(bytes(60))
+        assert not queue.backlogged
+
+        queue.put(bytes(60))
+        assert queue.backlogged
+
+        queue.write()
+        assert not queue.backlogged
+
+        transport.buffered = 101  # the data sits in the transport until the client catches up
+        assert queue.backlogged
+
+    asyncio.run(write_all())
+
+
+def test_outbound_drain():
+    async def write_all():
+        transport = Transport()
+        protocol = ConnectionProtocol(FrameServer())
+        protocol.connection_made(transport)
+
+        stream = protocol.stream
+        stream.outbound.high_water = 100
+
+        async def send(*packets):  # like a handler calling Server.send_packet()
+            for data in packets:
+                stream.write(data)
+
+                if stream.outbound.backlogged:
+                    await stream.flush()
+
+        protocol.pause_writing()  # the transport is above its own high watermark
+
+        sender = asyncio.ensure_future(send(bytes(60), bytes(60)))
+        await asyncio.sleep(0)
+
+        # the backlogged sender wrote everything out and waits for the client
+        assert not sender.done() and transport.written == [[bytes(60), bytes(60)]]
+
+        protocol.resume_writing()
+        await sender
+
+        protocol.connection_lost(None)
+
+    asyncio.run(write_all())
+
+
+def test_encrypted_writes():
+    packets = [b"\x01" * 5, b"\x02" * 300, b"\x03", b"\x04" * 70000]
+
+    async def write_all():
+        stream = new_stream()
+        stream.write(b"\x00")  # queued before encryption is enabled, so it's sent as is
+
+        encrypted = EncryptedStream(stream, gen_aes_cipher(KEY))
+
+        for data in packets:
+            encrypted.write(data)
+
+        await asyncio.sleep(0)
+
+        # CFB8 is a stream cipher, one call for the batch matches one call per write
+        encryptor = gen_aes_cipher(KEY).encryptor()
+        ciphertext = b"".join(encryptor.update(data) for data in packets)
+
+        assert stream._transport.written == [[b"\x00"], ciphertext]
+
+        encrypted.write(b"\x05")
+        await asyncio.sleep(0)
+
+        assert stream._transport.written[-1] == encryptor.update(b"\x05")
+
+    asyncio.run(write_all())
+
+
+def test_encrypted_round_trip():
+    payloads = [b"\x01" * 5, b"\x02" * 300, b"\x03", b"\x04" * 70000, b"\x05" * 17]
+
+    async def round_trip():
+        rand = random.Random(1)
+
+        transport = Transport()
+        server = FrameServer()
+        protocol = ConnectionProtocol(server)
+        protocol.connection_made(transport)
+
+        stream = EncryptedStream(protocol.stream, gen_aes_cipher(KEY))
+        protocol.frames.switch_stream(stream)
+
+        # the client encrypts, the protocol decrypts every read in place
+        ciphertext = gen_aes_cipher(KEY).encryptor().update(b"".join(map(frame, payloads)))
+
+        for fragment in split(ciphertext, [rand.randint(1, 5000) for _ in range(40)]):
+            receive(protocol, fragment)
+            await asyncio.sleep(0)
+
+        assert server.payloads == payloads
+
+        # the server encrypts batches, the client decrypts whatever it reads
+        for data in payloads:
+            stream.write(data)
+
+        await stream.flush()
+
+        sent = transport.written[0]
+        decryptor = gen_aes_cipher(KEY).decryptor()
+
+        assert b"".join(decryptor.update(data) for data in split(sent, [1, 15, 16, 1000])) == (
+            b"".join(payloads)
+        )
+
+        protocol.connection_lost(None)
+
+    asyncio.run(round_trip())
@@ -0,0 +1,50 @@
+import asyncio
+import types
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from pymine.types.chunk import Chunk
+from pymine.types.world import World
+
+
+class ChunkIO:  # records what's saved instead of writing region files
+    def __init__(self) -> None:
+        self.saved = []
+
+    async def save_chunks_async(self, world_path: str, chunks: list, executor=None) -> None:
+        for chunk in chunks:
+            self.saved.append((chunk.x, chunk.z))
+            chunk.mark_saved(chunk.full_version)
+
+
+def test_autosave_with_frequent_evictions(tmp_path):
+    server = types.SimpleNamespace(
+        conf={"autosave_interval": 1.5}, chunkio=ChunkIO(), process_executor=None, console=None
+    )
+
+    async def evict_and_wait():
+        world = World(server, "world", tmp_path, 1, 1 << 30)
+        save_task = asyncio.create_task(world.save_loop())
+
+        pinned = Chunk.new(0, 0, 0)
+        pinned.mark_changed()
+        world.cache_chunk(pinned, (0, 0))
+        world.set_ticket("player", [(0, 0)])
+
+        # a changed chunk is evicted more often than the autosave interval
+        for x in range(1, 13):
+            chunk = Chunk.new(x, 0, 0)
+            chunk.mark_changed()
+            world.cache_chunk(chunk, (x, 0))
+            world.cache_chunk(Chunk.new(x, 1, 0), (x, 1))  # evicts the changed chunk
+
+            await asyncio.sleep(0.25)
+
+        save_task.cancel()
+
+        assert (1, 0) in server.chunkio.saved  # evicted chunks are saved right away
+        assert (0, 0) in server.chunkio.saved and not pinned.dirty
+
+    asyncio.run(evict_and_wait())
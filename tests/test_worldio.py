@@ -0,0 +1,207 @@
+import concurrent.futures
+import asyncio
+import struct
+import zlib
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import pytest
+import numpy
+from pymine.logic.worldio import ChunkIO, RegionFile, RegionFilePool
+from pymine.types.chunk import Chunk, ChunkSection, NibbleArray
+from pymine.types.block_palette import DirectPalette
+
+
+def write_region(path: str, chunks: dict) -> None:  # chunks is {(x, z): (compression, timestamp)}
+    header = bytearray(8192)
+    sectors = b""
+
+    for (x, z), (compression, timestamp) in chunks.items():
+        data = Chunk.new_nbt(x, z).pack()
+        data = zlib.compress(data) if compression == 2 else data
+        data = struct.pack(">IB", len(data) + 1, compression) + data
+        data += bytes(-len(data) % 4096)  # pad to a whole sector
+
+        location = ((2 + len(sectors) // 4096) << 8) | (len(data) // 4096)
+        struct.pack_into(">II", header, ChunkIO.calc_offset(x, z), location, 0)
+        struct.pack_into(">I", header, ChunkIO.calc_offset(x, z) + 4096, timestamp)
+
+        sectors += data
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, "wb") as region_file:
+        region_file.write(header + sectors)
+
+
+def test_fetch_chunk(tmp_path):
+    write_region(
+        os.path.join(tmp_path, "region", "r.0.-1.mca"), {(1, -2): (2, 1234), (31, -1): (3, 5678)}
+    )
+
+    chunk = ChunkIO.fetch_chunk(tmp_path, 1, -2)
+    assert (chunk.x, chunk.z, chunk.timestamp) == (1, -2, 1234)
+
+    with pytest.raises(FileNotFoundError):  # location is 0, the chunk isn't in the region
+        ChunkIO.fetch_chunk(tmp_path, 2, -2)
+
+    async def fetch():
+        chunk = await ChunkIO.fetch_chunk_async(tmp_path, 31, -1)
+        assert (chunk.x, chunk.z, chunk.timestamp) == (31, -1, 5678)
+
+        chunk = await ChunkIO.fetch_chunk_async(tmp_path, 1, -2)
+        assert (chunk.x, chunk.z, chunk.timestamp) == (1, -2, 1234)
+
+        assert len(ChunkIO.regions.files) == 1  # the region file was only opened once
+
+        with pytest.raises(FileNotFoundError):
+            await ChunkIO.fetch_chunk_async(tmp_path, 2, -2)
+
+        with pytest.raises(FileNotFoundError):  # the region file doesn't exist
+            await ChunkIO.fetch_chunk_async(tmp_path, 64, 64)
+
+        await ChunkIO.close()
+
+    regions, ChunkIO.regions = ChunkIO.regions, RegionFilePool(1)
+
+    try:
+        asyncio.run(fetch())
+    finally:
+        ChunkIO.regions = regions
+
+
+def test_fetch_chunks(tmp_path):
+    write_region(os.path.join(tmp_path, "region", "r.0.0.mca"), {(0, 0): (2, 1), (5, 3): (2, 2)})
+    write_region(os.path.join(tmp_path, "region", "r.-1.0.mca"), {(-1, 0): (3, 3)})
+
+    coords = [(0, 0), (5, 3), (-1, 0), (1, 1), (64, 64)]
+
+    async def fetch():
+        fetched = {}
+
+        async for key, chunk in ChunkIO.fetch_chunks_async(tmp_path, coords, max_parallel=2):
+            assert key not in fetched
+            fetched[key] = chunk
+
+        await ChunkIO.close()
+
+        return fetched
+
+    regions, ChunkIO.regions = ChunkIO.regions, RegionFilePool(1)
+
+    try:
+        fetched = asyncio.run(fetch())
+    finally:
+        ChunkIO.regions = regions
+
+    assert set(fetched) == set(coords)
+    assert fetched[(1, 1)] is None and fetched[(64, 64)] is None  # missing chunks
+
+    for key, timestamp in (((0, 0), 1), ((5, 3), 2), ((-1, 0), 3)):
+        assert (fetched[key].x, fetched[key].z, fetched[key].timestamp) == (*key, timestamp)
+
+
+def test_fetch_chunks_process_pool(tmp_path):
+    write_region(os.path.join(tmp_path, "region", "r.0.0.mca"), {(x, 0): (2, x) for x in range(8)})
+
+    async def fetch():
+        fetched = {}
+
+        with concurrent.futures.ProcessPoolExecutor(2) as executor:
+            async for key, chunk in ChunkIO.fetch_chunks_async(
+                tmp_path, [(x, 0) for x in range(8)], executor
+            ):
+                fetched[key] = chunk
+
+            chunk = await ChunkIO.fetch_chunk_async(tmp_path, 3, 0, executor)
+            assert (chunk.x, chunk.z, chunk.timestamp) == (3, 0, 3)
+
+        await ChunkIO.close()
+
+        return fetched
+
+    regions, ChunkIO.regions = ChunkIO.regions, RegionFilePool()
+
+    try:
+        fetched = asyncio.run(fetch())
+    finally:
+        ChunkIO.regions = regions
+
+    for x in range(8):  # chunks are decoded in the worker processes and pickled back
+        assert (fetched[x, 0].x, fetched[x, 0].z, fetched[x, 0].timestamp) == (x, 0, x)
+        assert fetched[x, 0]["Biomes"] == Chunk.new_nbt(x, 0)["Level"]["Biomes"]
+
+
+def test_save_chunks(tmp_path):
+    chunks = {key: Chunk.new(*key, 0) for key in ((0, 0), (1, 0), (40, 0))}
+
+    for chunk in chunks.values():
+        chunk.sections[0] = ChunkSection.new(0, DirectPalette)
+        chunk.sections[0].block_states[0] = DirectPalette.encode("minecraft:bedrock")
+        chunk.mark_changed()
+
+    def sectors(region: RegionFile) -> list:  # the sectors of each saved chunk
+        return sorted(ChunkIO.find_chunk(int(l)) for l in region.locations if l != 0)
+
+    async def save():
+        await ChunkIO.save_chunks_async(tmp_path, list(chunks.values()))
+        assert not any(chunk.dirty for chunk in chunks.values())
+
+        region = await ChunkIO.regions.get(ChunkIO.region_path(tmp_path, 0, 0))
+        assert sectors(region) == [(8192, 4096), (12288, 4096)]
+
+        # too big for its old sector, so it's moved to the end of the file
+        section = chunks[0, 0].sections[0]
+        section.block_states[1:] = numpy.arange(3840).reshape(15, 16, 16)
+        section.block_light = NibbleArray.from_bytes(os.urandom(2048))
+        section.mark_changed()
+
+        await ChunkIO.save_chunks_async(tmp_path, [chunks[0, 0]])
+        assert sectors(region)[0] == (12288, 4096) and sectors(region)[1][0] == 16384
+
+        chunks[1, 0].mark_changed()  # its old sectors are free now, so the first sector is reused
+        await ChunkIO.save_chunks_async(tmp_path, [chunks[1, 0]])
+        assert sectors(region)[0] == (8192, 4096)
+
+        await ChunkIO.close()
+
+    regions, ChunkIO.regions = ChunkIO.regions, RegionFilePool()
+
+    try:
+        asyncio.run(save())
+    finally:
+        ChunkIO.regions = regions
+
+    for key, chunk in chunks.items():
+        loaded = ChunkIO.fetch_chunk(tmp_path, *key)
+
+        assert (loaded.x, loaded.z, loaded.timestamp) == (*key, chunk.timestamp)
+        assert (
+            loaded.sections[0].palette.global_ids[loaded.sections[0].block_states.array()]
+            == chunk.sections[0].block_states.array()
+        ).all()
+        assert loaded.sections[0].block_light.packed() == chunk.sections[0].block_light.packed()
+
+
+def test_region_pool_eviction(tmp_path):
+    paths = [os.path.join(tmp_path, f"r.{x}.0.mca") for x in range(4)]
+    pool = RegionFilePool(1)
+
+    async def read(path: str) -> None:
+        region = await pool.get(path, create=True)
+        assert not region.file.closed  # wasn't evicted by another get before it was returned
+        await region.read(0, 8192)
+
+    async def read_regions():
+        await read(paths[0])
+
+        # while one get closes the least recently used file, the others open and evict files too
+        await asyncio.gather(*(read(path) for path in paths[1:]))
+        await asyncio.gather(*(read(paths[0]) for _ in range(3)))
+
+        assert len(pool.files) == 1
+        await pool.close()
+
+    asyncio.run(read_regions())